@@ -1,513 +1,3528 @@
-import os
-import time
-import tempfile
-import logging
-import json
-import re
-import unicodedata
-from datetime import datetime
-from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify, abort, send_file
-from werkzeug.utils import secure_filename
-from docx import Document
-from docx.shared import Inches
-from fpdf import FPDF
-import pyphen
-
-from google import genai
-from google.genai import types
-
-
-# --- Configuration ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-load_dotenv()
-
-# --- Gemini Client Initialization ---
-try:
-    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-    logging.info("Gemini Client initialized successfully.")
-except Exception as e:
-    logging.critical(f"Failed to initialize Gemini Client: {e}")
-    exit("Fatal Error: Gemini API key is missing or invalid.")
-
-app = Flask(__name__)
-# Create a temporary directory for session files if it doesn't exist
-TEMP_DIR = os.path.join(tempfile.gettempdir(), "nutri_app_files")
-os.makedirs(TEMP_DIR, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = TEMP_DIR
-
-# --- System Prompts for AI (FIXED) ---
-SYSTEM_INSTRUCTION_NUTRITIONIST = """
-You are a world-class AI Nutritionist and Dietitian. Your primary function is to generate a comprehensive, personalized, and deeply detailed nutritional report based on the user's provided data. The goal is to provide actionable, scientific, and easy-to-understand advice. The level of detail must be exhaustive.
-
-**ANALYSIS INSTRUCTIONS:**
-1.  **Analyze User Profile:** Carefully consider the user's age, gender, height, weight, activity level, dietary preferences, and any specified health conditions.
-2.  **Calculate Key Metrics:** Calculate the user's Body Mass Index (BMI) and estimate their daily caloric needs (e.g., using the Mifflin-St Jeor equation or a similar standard).
-3.  **Provide Quantitative Recommendations AND Specific Sources:** For every single nutrient listed below, you MUST provide both a specific quantitative daily intake recommendation AND a list of common, healthy food sources tailored to the user's dietary preferences.
-
-**CRITICAL FORMATTING RULE:**
-You MUST adhere to the following `OUTPUT_FORMAT` with **exact precision**. Preserve every heading, indentation, bullet point, numbering, and placeholder. The use of the `| Sources:` separator for every nutrient is mandatory. Do not add any introductory or concluding paragraphs, disclaimers, or conversational text outside of this strict structure.
-
----
-## OUTPUT_FORMAT
----
-
-**BMI:** [Calculate and insert BMI value, e.g., 22.5 kg/m²]
-**Estimated Daily Calories:** [Calculate and insert range, e.g., 2200-2500 kcal]
-
-**Macronutrients:**
-    **1. Carbohydrates:** [Provide % of daily caloric intake, e.g., 45-65%]
-        - **Sources:** [List 5-7 diverse sources, e.g., Quinoa, Oats, Brown Rice, Sweet Potatoes, Berries, Lentils, Chickpeas]
-        - **Glucose:** [Provide general statement, e.g., "Primary energy source, obtained from all dietary carbohydrates."]
-        - **Fructose:** [Provide general statement and sources, e.g., "Fruit sugar."] | Sources: [e.g., Fruits, honey, agave nectar]
-        - **Galactose:** [Provide general statement and sources, e.g., "Component of lactose."] | Sources: [e.g., Dairy products, avocados, sugar beets]
-        - **Sucrose:** [Provide general statement and sources, e.g., "Table sugar, limit intake."] | Sources: [e.g., Sugarcane, maple syrup, processed foods]
-        - **Lactose:** [Provide general statement and sources, e.g., "Milk sugar, avoid if intolerant."] | Sources: [e.g., Milk, yogurt, cheese]
-        - **Amylose & Amylopectin (Starches):** [Provide general statement.] | Sources: [e.g., Potatoes, corn, rice, wheat, legumes]
-
-    **2. Proteins:** [Provide % of daily caloric intake and g/kg of body weight, e.g., 15-25% | 0.8-1.2 g/kg]
-        - **Sources:** [List 5-7 diverse sources tailored to diet preference, e.g., Chicken Breast, Salmon, Eggs, Greek Yogurt, Tofu, Lentils]
-        - **Essential Amino Acids (EAAs):**
-            - Histidine (H): [Provide mg/kg/day, e.g., 10-14 mg/kg] | Sources: [e.g., Meat, fish, poultry, soy, nuts, seeds]
-            - Isoleucine (I): [Provide mg/kg/day, e.g., 19-25 mg/kg] | Sources: [e.g., Eggs, chicken, soy, almonds, lentils]
-            - Leucine (L): [Provide mg/kg/day, e.g., 40-45 mg/kg] | Sources: [e.g., Cottage cheese, beef, chicken, tofu, beans]
-            - Lysine (K): [Provide mg/kg/day, e.g., 30-38 mg/kg] | Sources: [e.g., Red meat, parmesan cheese, quinoa, lentils]
-            - Methionine (M): [Provide mg/kg/day, e.g., 15-19 mg/kg] | Sources: [e.g., Eggs, fish, sesame seeds, Brazil nuts]
-            - Phenylalanine (F): [Provide mg/kg/day, e.g., 30-35 mg/kg] | Sources: [e.g., Beef, soy, pumpkin seeds, cheese]
-            - Threonine (T): [Provide mg/kg/day, e.g., 15-20 mg/kg] | Sources: [e.g., Cottage cheese, poultry, lentils, black beans]
-            - Tryptophan (W): [Provide mg/kg/day, e.g., 4-5 mg/kg] | Sources: [e.g., Turkey, chicken, oats, nuts, seeds]
-            - Valine (V): [Provide mg/kg/day, e.g., 24-26 mg/kg] | Sources: [e.g., Soy, cheese, peanuts, mushrooms, whole grains]
-        - **Conditionally Essential Amino Acids:**
-            - Arginine (R): [Provide context, e.g., "Important for circulation."] | Sources: [e.g., Nuts, seeds, red meat, poultry, soy]
-            - Cysteine (C): [Provide context, e.g., "Key for antioxidant function."] | Sources: [e.g., Pork, chicken, soy, oats, garlic]
-            - Glutamine (Q): [Provide context, e.g., "Crucial for gut health."] | Sources: [e.g., Meat, seafood, cabbage, spinach, tofu]
-            - Glycine (G): [Provide context, e.g., "Component of collagen."] | Sources: [e.g., Bone broth, gelatin, pork rinds, chicken skin]
-            - Proline (P): [Provide context, e.g., "Essential for skin health."] | Sources: [e.g., Bone broth, gelatin, cheese, cabbage]
-            - Tyrosine (Y): [Provide context, e.g., "Precursor to neurotransmitters."] | Sources: [e.g., Cheese, soy, turkey, avocado, almonds]
-
-    **3. Fats:** [Provide % of daily caloric intake, e.g., 20-35%]
-        - **Sources:** [List 5-7 diverse sources, e.g., Avocado, Almonds, Walnuts, Olive Oil, Flaxseeds, Salmon]
-        - **Polyunsaturated Fatty Acids (PUFAs):**
-            - Linoleic acid (LA) Omega-6: [Provide g/day, e.g., 12-17 g] | Sources: [e.g., Sunflower seeds, walnuts, corn oil, soybean oil]
-            - α-Linolenic acid (ALA) Omega-3: [Provide g/day, e.g., 1.1-1.6 g] | Sources: [e.g., Flaxseeds, chia seeds, walnuts, edamame]
-        - **Monounsaturated Fatty Acids (MUFAs):** [Provide context, e.g., "Target ~15-20% of calories"] | Sources: [e.g., Olive oil, avocados, almonds, cashews, peanuts]
-        - **Saturated Fatty Acids (SFAs):** [Provide context, e.g., "Limit to <10% of daily calories"] | Sources: [e.g., Red meat, butter, coconut oil, cheese]
-        - **Dietary Cholesterol:** [Provide mg/day, e.g., <300 mg] | Sources: [e.g., Egg yolks, shellfish, organ meats, full-fat dairy]
-
-**Micronutrients:**
-    **1. Vitamins:**
-        - **Vitamin A (retinol/carotenoids):** [Provide mcg RAE/day, e.g., 700-900 mcg] | Sources: [e.g., Carrots, sweet potatoes, spinach, liver]
-        - **Vitamin B Complex:**
-            - B1 (Thiamine): [Provide mg/day, e.g., 1.1-1.2 mg] | Sources: [e.g., Pork, whole grains, nutritional yeast, black beans]
-            - B2 (Riboflavin): [Provide mg/day, e.g., 1.1-1.3 mg] | Sources: [e.g., Dairy products, almonds, lean meat, mushrooms]
-            - B3 (Niacin): [Provide mg NE/day, e.g., 14-16 mg] | Sources: [e.g., Chicken, tuna, peanuts, brown rice]
-            - B5 (Pantothenic Acid): [Provide mg/day, e.g., 5 mg] | Sources: [e.g., Avocado, shiitake mushrooms, sunflower seeds, chicken]
-            - B6 (Pyridoxine): [Provide mg/day, e.g., 1.3-1.7 mg] | Sources: [e.g., Chickpeas, salmon, potatoes, bananas]
-            - B7 (Biotin): [Provide mcg/day, e.g., 30 mcg] | Sources: [e.g., Egg yolk, liver, salmon, avocado, nuts, seeds]
-            - B9 (Folate): [Provide mcg DFE/day, e.g., 400 mcg] | Sources: [e.g., Leafy greens, lentils, beans, fortified grains]
-            - B12 (Cobalamin): [Provide mcg/day, e.g., 2.4 mcg] | Sources: [e.g., Clams, tuna, beef, fortified nutritional yeast (for vegans)]
-        - **Vitamin C (ascorbic acid):** [Provide mg/day, e.g., 75-90 mg] | Sources: [e.g., Bell peppers, oranges, broccoli, strawberries]
-        - **Vitamin D (calciferol):** [Provide IU/day, e.g., 600-800 IU] | Sources: [e.g., Fatty fish (salmon), fortified milk, sunlight]
-        - **Vitamin E (tocopherol):** [Provide mg/day, e.g., 15 mg] | Sources: [e.g., Almonds, sunflower seeds, spinach, avocado]
-        - **Vitamin K (phylloquinone/menaquinone):** [Provide mcg/day, e.g., 90-120 mcg] | Sources: [e.g., Kale, spinach, broccoli, natto]
-
-    **2. Minerals:**
-        - **Calcium:** [Provide mg/day, e.g., 1000-1300 mg] | Sources: [e.g., Dairy, tofu, sardines, fortified plant milks]
-        - **Phosphorus:** [Provide mg/day, e.g., 700 mg] | Sources: [e.g., Meat, fish, dairy, nuts, seeds, whole grains]
-        - **Potassium:** [Provide mg/day, e.g., 2600-3400 mg] | Sources: [e.g., Bananas, potatoes, spinach, beans, lentils]
-        - **Magnesium:** [Provide mg/day, e.g., 310-420 mg] | Sources: [e.g., Nuts, seeds, leafy greens, dark chocolate]
-        - **Iron:** [Provide mg/day, e.g., 8-18 mg] | Sources: [e.g., Red meat, beans, lentils, spinach, fortified cereals]
-        - **Zinc:** [Provide mg/day, e.g., 8-11 mg] | Sources: [e.g., Oysters, red meat, chickpeas, pumpkin seeds]
-        - **Sodium:** [Provide mg/day, e.g., < 2300 mg] | Sources: [e.g., Limit processed foods; small amounts in vegetables]
-        - **Chloride:** [Provide g/day, e.g., 1.8-2.3 g] | Sources: [e.g., Table salt, seaweed, tomatoes, celery]
-        - **Trace Elements:**
-            - Copper: [Provide mcg/day, e.g., 900 mcg] | Sources: [e.g., Oysters, shiitake mushrooms, cashews, seeds]
-            - Manganese: [Provide mg/day, e.g., 1.8-2.3 mg] | Sources: [e.g., Mussels, whole grains, nuts, leafy vegetables]
-            - Selenium: [Provide mcg/day, e.g., 55 mcg] | Sources: [e.g., Brazil nuts, seafood, organ meats, eggs]
-            - Iodine: [Provide mcg/day, e.g., 150 mcg] | Sources: [e.g., Seaweed, cod, dairy, iodized salt]
-            - Chromium: [Provide mcg/day, e.g., 25-35 mcg] | Sources: [e.g., Broccoli, grape juice, whole wheat products]
-            - Molybdenum: [Provide mcg/day, e.g., 45 mcg] | Sources: [e.g., Legumes, grains, nuts, leafy vegetables]
-            - Fluoride: [Provide mg/day, e.g., 3-4 mg] | Sources: [e.g., Fluoridated water, tea, grapes, raisins]
-
-**Other Key Compounds:**
-    - **Water:** [Provide L/day and glasses, e.g., 2.7-3.7 L (about 8-12 glasses)] | Tip: [Add a tip, e.g., "Drink more if active or in a hot climate."]
-    - **Fiber:** [Provide g/day, e.g., 25-38 g] | Sources: [e.g., Oats, beans, apples, broccoli, psyllium husk]
-    - **Electrolytes:** [Provide context, e.g., "Crucial for hydration; obtain from a balanced diet."] | Key Sources: [e.g., Sodium, Potassium, Magnesium from diet]
-    - **Phytochemicals:**
-        - **Polyphenols:** [Provide context, e.g., "Potent antioxidants."] | Sources: [e.g., Berries, dark chocolate, tea, coffee, red wine]
-        - **Carotenoids:** [Provide context, e.g., "Protect cells from damage."] | Sources: [e.g., Carrots, tomatoes, spinach, kale]
-
-**Actionable Advice & Recommendations:**
-    - **General Tips:**
-        - [Provide a tip about diet diversity.]
-        - [Provide a tip about mindful eating and portion control.]
-        - [Provide a tip about limiting processed foods, added sugars, and unhealthy fats.]
-    - **Health-Specific Guidance:**
-        # If no health condition is provided, output: "No specific health conditions were listed. Focus on general wellness by maintaining a balanced diet, staying hydrated, and engaging in regular physical activity."
-        # If a health condition is provided, follow the example format below.
-        # EXAMPLE START
-        # - **Diabetes:**
-        #   **Advice:** Prioritize complex carbohydrates with a low glycemic index (e.g., whole grains, legumes) to ensure stable blood sugar. Pair carbs with protein and healthy fats.
-        #   **Key Nutrients/Deficiencies:** Monitor **Magnesium** and **Chromium**, which play roles in glucose metabolism. **B-Vitamins**, especially B12, can be impacted by some medications.
-        # - **Hypertension:**
-        #   **Advice:** Dramatically reduce sodium intake by avoiding processed foods. Increase intake of potassium-rich foods (fruits, vegetables) to counterbalance sodium's effect on blood pressure.
-        #   **Key Nutrients/Deficiencies:** Focus on **Potassium, Calcium, and Magnesium**, as they are vital for blood pressure regulation.
-        # EXAMPLE END
-    - **Dietary Preference Tips:**
-        - [Provide a specific, actionable tip based on the user's diet, e.g., For a Vegan: "Ensure reliable Vitamin B12 intake through fortified foods (nutritional yeast, plant milks) or a supplement, as it's not naturally present in plant foods."]
-"""
-
-SYSTEM_INSTRUCTION_FOOD_COMPARISON = """
-Act as a concise nutritionist. Compare the two foods provided by the user.
-
-**CRITICAL: Your entire response must be ONLY the HTML `<table>` element and nothing else. Do not include `<html>`, `<body>`, `<!DOCTYPE>`, markdown fences (```html), or any explanatory text before or after the table.**
-
-**Output Instructions:**
-1.  Generate a **single, complete HTML `<table>`**.
-2.  The table must have a `<thead>` with the first column header as "Nutritional Metric (per 100g)" and subsequent headers as the food names.
-3.  The `<tbody>` must contain one `<tr>` for each of the following metrics:
-    - Calories (kcal)
-    - Protein (g)
-    - Carbohydrates (g)
-    - Fiber (g)
-    - Sugars (g)
-    - Fat (g)
-    - Key Vitamin
-    - Key Mineral
-    - Best For
-4.  Provide concise, data-driven comparisons for each metric in its respective `<td>`.
-5.  Highlight the "winner" for each metric (e.g., higher protein, lower sugar) with a simple emoji like ✅ or a brief comment.
-"""
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/get_nutrient_recommendations', methods=['POST'])
-def nutrient_recommendations():
-    data = request.get_json()
-    if not data:
-        return jsonify({"error": "Invalid request body"}), 400
-
-    prompt_data = {
-        "age": data.get("age", "N/A"),
-        "gender": data.get("gender", "N/A"),
-        "height": data.get("height", "N/A"),
-        "weight": data.get("weight", "N/A"),
-        "activity_level": data.get("activity_level", "N/A"),
-        "pregnancy_or_lactation": data.get("pregnancy_or_lactation", "None"),
-        "health_condition": data.get("health_condition", "None"),
-        "dietary_preferences": data.get("dietary_preferences", "N/A"),
-    }
-
-    prompt_text = "\n".join([f"{key.replace('_', ' ').title()}: {value}" for key, value in prompt_data.items()])
-
-    try:
-        contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt_text)])]
-
-        config = types.GenerateContentConfig(
-            system_instruction=SYSTEM_INSTRUCTION_NUTRITIONIST,
-            temperature=0.4,
-            response_mime_type="text/plain",
-        )
-
-        response_text = ""
-        for chunk in client.models.generate_content_stream(
-            model="gemini-2.0-flash-lite",
-            contents=contents,
-            config=config,
-        ):
-            if chunk.text:
-                response_text += chunk.text
-
-        if not response_text:
-            raise ValueError("AI returned an empty response.")
-
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        base_filename = f"NutriAI_Report_{timestamp}"
-
-        text_file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{base_filename}.txt")
-        with open(text_file_path, "w", encoding='utf-8') as f:
-            f.write(response_text)
-
-        formatted_html = format_recommendations_to_html(response_text)
-
-        return jsonify({
-            'recommendations': formatted_html,
-            'download_token': base_filename
-        })
-
-    except Exception as e:
-        logging.error(f"Error in recommendation endpoint: {e}", exc_info=True)
-        return jsonify({"error": f"An internal server error occurred: {e}"}), 500
-
-@app.route('/compare_foods', methods=['POST'])
-def compare_foods():
-    data = request.get_json()
-    if not data or 'foods' not in data or len(data['foods']) != 2:
-        return jsonify({"error": "Please provide exactly two foods to compare."}), 400
-
-    foods = data['foods']
-    prompt_text = f"Compare {foods[0]} and {foods[1]}"
-
-    try:
-        contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt_text)])]
-
-        config = types.GenerateContentConfig(
-            system_instruction=SYSTEM_INSTRUCTION_FOOD_COMPARISON,
-            temperature=0.3,
-            response_mime_type="text/plain",
-        )
-
-        raw_html_table = ""
-        for chunk in client.models.generate_content_stream(
-            model="gemini-2.0-flash-lite",
-            contents=contents,
-            config=config,
-        ):
-            if chunk.text:
-                raw_html_table += chunk.text
-
-        clean_html_table = format_comparison(raw_html_table)
-
-        return jsonify({"comparison": clean_html_table})
-    except Exception as e:
-        logging.error(f"Error in food comparison endpoint: {e}", exc_info=True)
-        return jsonify({"error": f"An internal server error occurred: {e}"}), 500
-
-def _convert_txt_to_docx(txt_file_path):
-    """Converts a text file to a DOCX document with specific A4 landscape formatting."""
-    doc = Document()
-    section = doc.sections[0]
-    section.orientation = 1
-    section.page_width = Inches(11.69)
-    section.page_height = Inches(8.27)
-    section.top_margin = Inches(0.55)
-    section.bottom_margin = Inches(0.55)
-    section.left_margin = Inches(0.55)
-    section.right_margin = Inches(0.55)
-    with open(txt_file_path, 'r', encoding='utf-8') as file:
-        text_content = file.read().replace('**', '')
-        for line in text_content.split('\n'):
-            p = doc.add_paragraph(line.rstrip('\n'))
-            p.paragraph_format.space_before = 0
-            p.paragraph_format.space_after = 0
-    docx_file_path = txt_file_path.replace('.txt', '.docx')
-    doc.save(docx_file_path)
-    logging.info(f"Successfully converted TXT to DOCX: {docx_file_path}")
-    return docx_file_path
-
-class PDF(FPDF):
-    """Custom PDF class to remove default header and footer."""
-    def header(self): pass
-    def footer(self): pass
-
-def _convert_docx_to_pdf(docx_file_path):
-    import pyphen
-    dic = pyphen.Pyphen(lang='en_US')
-
-    pdf_file_path = docx_file_path.replace(".docx", ".pdf")
-    doc = Document(docx_file_path)
-    pdf = PDF(orientation='L', unit='mm', format='A4')
-    pdf.add_page()
-
-    font_path = os.path.join(os.path.dirname(__file__), 'static', 'fonts', 'DejaVuSerif.ttf')
-    if os.path.isfile(font_path):
-        pdf.add_font('DejaVuSerif', '', font_path, uni=True)
-        pdf.set_font('DejaVuSerif', size=12)
-    else:
-        pdf.set_font('Arial', size=12)
-
-    base_left = pdf.l_margin
-    max_width = pdf.w - pdf.r_margin
-
-    for paragraph in doc.paragraphs:
-        text = paragraph.text or ""
-        if not text.strip():
-            pdf.ln(5)
-            continue
-
-        # Calculate indentation (in mm)
-        indent_pts = paragraph.paragraph_format.left_indent
-        if indent_pts:
-            indent_mm = indent_pts.pt * 0.3528  # convert points to mm
-        else:
-            indent_mm = 0
-
-        # Set new x position for this paragraph
-        pdf.set_x(base_left + indent_mm)
-        usable_width = max_width - (base_left + indent_mm)
-
-        # Hyphenation-aware wrapping
-        words = text.split()
-        line = ''
-        for word in words:
-            test_line = f"{line} {word}".strip()
-            if pdf.get_string_width(test_line) <= usable_width:
-                line = test_line
-            else:
-                # Word too long, try hyphenation
-                hyphenated = dic.inserted(word, hyphen='-').split('-')
-                for i, part in enumerate(hyphenated):
-                    part += '-' if i < len(hyphenated) - 1 else ''
-                    test_line = f"{line} {part}".strip()
-                    if pdf.get_string_width(test_line) <= usable_width:
-                        line = test_line
-                    else:
-                        pdf.set_x(base_left + indent_mm)
-                        pdf.cell(0, 5, line)
-                        pdf.ln(5)
-                        line = part
-        if line:
-            pdf.set_x(base_left + indent_mm)
-            pdf.cell(0, 5, line)
-            pdf.ln(5)
-
-    pdf.output(pdf_file_path)
-    logging.info(f"Successfully converted DOCX to PDF with indentations preserved: {pdf_file_path}")
-    return pdf_file_path
-
-@app.route('/download/<token>')
-def download_file(token):
-    """Finds the report by its token, converts it to PDF via DOCX, and serves it."""
-    sanitized_token = secure_filename(token)
-    text_file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{sanitized_token}.txt")
-    if not os.path.exists(text_file_path):
-        logging.warning(f"Download request for non-existent token: {token}")
-        abort(404, description="Report not found or has expired.")
-    try:
-        docx_path = _convert_txt_to_docx(text_file_path)
-        pdf_path = _convert_docx_to_pdf(docx_path)
-        return send_file(pdf_path, as_attachment=True, download_name=f"{sanitized_token}.pdf")
-    except Exception as e:
-        logging.error(f"Failed to generate or send PDF for token {token}: {e}", exc_info=True)
-        abort(500, description="An error occurred while generating the PDF report.")
-
-def format_recommendations_to_html(text: str) -> str:
-    """
-    FIXED: A robust, single-pass parser to convert the AI's structured text into clean HTML.
-    It correctly identifies top-level cards and all nested content, including special handling
-    for macronutrient-style subheadings.
-    """
-    html_output = ""
-    lines = text.strip().split('\n')
-
-    icon_map = {
-        "BMI": "fa-weight", "ESTIMATED DAILY CALORIES": "fa-fire",
-        "MACRONUTRIENTS": "fa-pizza-slice", "MICRONUTRIENTS": "fa-pills",
-        "OTHER KEY COMPOUNDS": "fa-tint", "ACTIONABLE ADVICE & RECOMMENDATIONS": "fa-clipboard-check"
-    }
-
-    in_card = False
-
-    for line in lines:
-        stripped = line.strip()
-        if not stripped:
-            continue
-
-        indent_level = len(line) - len(line.lstrip(' '))
-        is_card_header = stripped.startswith('**') and stripped.endswith('**') and ':' in stripped and indent_level == 0
-
-        if is_card_header:
-            if in_card:
-                html_output += "</div></div>\n"
-            parts = stripped.replace('**', '').split(':', 1)
-            title, content_on_same_line = parts[0].strip(), parts[1].strip()
-            card_id, icon = title.lower().replace(' ', '_').replace('&', 'and'), icon_map.get(title.upper(), "fa-info-circle")
-            html_output += f"""<div class='result-card' id='{card_id}'>
-    <button class='result-card-header' onclick='app.toggleCardBody("{card_id}")'>
-        <span><i class='fas {icon}'></i> {title}</span>
-        <i class='fas fa-chevron-down card-chevron'></i>
-    </button>
-    <div class='result-card-body'>"""
-            in_card = True
-            if content_on_same_line:
-                html_output += f"<p class='main-value'>{content_on_same_line}</p>\n"
-            continue
-
-        if not in_card:
-            continue
-
-        # This new condition specifically finds indented, bolded, numbered list items with a colon,
-        # which is the pattern for Macronutrient subheadings (e.g., "**1. Carbohydrates:** value").
-        is_macro_style_header = stripped.startswith('**') and re.match(r'\*\*\d\.', stripped) and ':' in stripped
-
-        if is_macro_style_header:
-            clean_line = stripped.replace('**', '')
-            parts = clean_line.split(':', 1)
-            header_text = parts[0].strip() + ':'
-            value_text = parts[1].strip() if len(parts) > 1 else ""
-
-            # Create the h3 tag for the header part
-            html_output += f"<h3 class='section-heading' style='margin-left: {indent_level * 2}px;'>{header_text}</h3>\n"
-
-            # If there was a value on the same line, process and display it
-            if value_text:
-                if '|' in value_text:
-                    value_parts = value_text.split('|', 1)
-                    html_output += f"""<div class='nutrient-item' style='margin-left: {indent_level * 2 + 10}px;'>
-    <span class='nutrient-name'>{value_parts[0].strip()}</span>
-    <span class='nutrient-source'>{value_parts[1].strip()}</span>
-</div>\n"""
-                else:
-                    html_output += f"<p style='margin-left: {indent_level * 2 + 10}px;'>{value_text}</p>\n"
-            continue # Important: We've handled this line, so skip to the next one
-
-        if stripped.startswith('**') and stripped.endswith('**') and ':' in stripped:
-            tag = "h3" if indent_level < 8 else "h4"
-            html_output += f"<{tag} class='section-heading' style='margin-left: {indent_level * 2}px;'>{stripped.replace('**', '')}</{tag}>\n"
-        elif stripped.startswith('-'):
-            item_text = stripped.replace('**', '')[1:].strip()
-            if '|' in item_text:
-                parts = item_text.split('|', 1)
-                source_part = parts[1].strip().replace('Sources:', '').replace('Tip:', '').strip()
-                html_output += f"""<div class='nutrient-item' style='margin-left: {indent_level * 2 + 10}px;'>
-    <span class='nutrient-name'>{parts[0].strip()}</span>
-    <span class='nutrient-source'>{source_part}</span>
-</div>\n"""
-            else:
-                html_output += f"<p class='list-item' style='margin-left: {indent_level * 2}px;'>• {item_text}</p>\n"
-        elif '|' in stripped:
-            parts = stripped.replace('**', '').split('|', 1)
-            source_part = parts[1].strip().replace('Sources:', '').replace('Tip:', '').strip()
-            html_output += f"""<div class='nutrient-item' style='margin-left: {indent_level * 2}px;'>
-    <span class='nutrient-name'>{parts[0].strip()}</span>
-    <span class='nutrient-source'>{source_part}</span>
-</div>\n"""
-        else:
-            html_output += f"<p style='margin-left: {indent_level * 2}px;'>{stripped.replace('**', '')}</p>\n"
-
-    if in_card:
-        html_output += "</div></div>\n"
-
-    return html_output
-
-
-def format_comparison(text: str) -> str:
-    """
-    Cleans the model's output to extract just the HTML table for crop comparison.
-    Handles cases where the model might still include markdown fences or explanatory text.
-    """
-    # Remove markdown fences and surrounding whitespace
-    cleaned_text = text.strip().removeprefix('```html').removesuffix('```').strip()
-
-    # Use regex to find the table, which is more robust
-    table_match = re.search(r'(<table.*?>.*?</table\s*>)', cleaned_text, re.DOTALL | re.IGNORECASE)
-
-    if table_match:
-        # If a table is found, return it directly. This is the ideal case.
-        return table_match.group(1)
-    else:
-        # Fallback for unexpected format: return a formatted error.
-        logging.warning(f"Comparison format error. AI output was: {text}")
-        return f"""
-        <div class="no-data error">
-            <i class="fas fa-exclamation-triangle"></i>
-            <h3>Comparison Error</h3>
-            <p>The AI model returned data in an unexpected format. Please try your query again.</p>
-        </div>
-        """
-
-
-if __name__ == "__main__":
+import time
+# Taken before the other imports so the startup figures include them.
+_IMPORT_STARTED = time.perf_counter()
+
+import io
+import os
+import sys
+import csv
+import asyncio
+import base64
+import bisect
+import fcntl
+import tempfile
+import logging
+import json
+import re
+import queue
+import random
+import shutil
+import hashlib
+import importlib
+import html
+import sqlite3
+import threading
+import unicodedata
+import zipfile
+import multiprocessing
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import asynccontextmanager, closing, contextmanager
+from contextvars import ContextVar, copy_context
+from datetime import datetime
+from functools import lru_cache
+import click
+from dotenv import load_dotenv
+from werkzeug.local import LocalProxy
+import reports
+from flask import Blueprint, Config, Flask, Response, current_app, g, render_template, request, jsonify, abort, send_file, stream_with_context
+from reports import (PDF_FONT_PATH, RecommendationHTMLFormatter, RenderResources, Report, init_render_process,
+                     parse_report, render_cohort_files, report_to_docx, report_to_pdf)
+# The document stack (docx, fpdf, pyphen), the model SDK (google.genai), httpx and a2wsgi are
+# imported where they are first used, so a worker can serve "/" without loading them.
+
+
+# --- Configuration ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+load_dotenv()
+
+# Settings are read from the environment once, at import; create_app() copies them into app.config.
+config = Config(os.path.dirname(os.path.abspath(__file__)))
+TEMP_DIR = os.path.join(tempfile.gettempdir(), "nutri_app_files")
+# Reports, cohort jobs and the cache and metrics databases; create_app() creates the directory.
+config['UPLOAD_FOLDER'] = TEMP_DIR
+config['RESPONSE_CACHE_SIZE'] = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+config['RESPONSE_CACHE_TTL'] = int(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+config['RESPONSE_CACHE_DISK'] = os.getenv("RESPONSE_CACHE_DISK", "1") == "1"
+# Rows kept in the shared sqlite cache file; the entries closest to expiry go first.
+config['RESPONSE_CACHE_DISK_MAX_ENTRIES'] = int(os.getenv("RESPONSE_CACHE_DISK_MAX_ENTRIES", "50000"))
+config['COMPARISON_CACHE_SIZE'] = int(os.getenv("COMPARISON_CACHE_SIZE", "2048"))
+config['COMPARISON_BATCH_LIMIT'] = int(os.getenv("COMPARISON_BATCH_LIMIT", "8"))
+# Coalesce identical generations across gunicorn workers too, through a lease in the shared cache database.
+config['SINGLE_FLIGHT_CROSS_WORKER'] = os.getenv("SINGLE_FLIGHT_CROSS_WORKER", "0") == "1"
+config['SINGLE_FLIGHT_LEASE_TTL'] = int(os.getenv("SINGLE_FLIGHT_LEASE_TTL", "120"))
+# A name in MODEL_BACKENDS, or "module:function" for a backend kept elsewhere, e.g. the offline
+# stand-in the tests and benchmarks use: MODEL_BACKEND=fake_model:create_fake_backend.
+config['MODEL_BACKEND'] = os.getenv("MODEL_BACKEND", "gemini")
+config['MODEL_TIMEOUT'] = float(os.getenv("MODEL_TIMEOUT", "60"))  # seconds per call, retries included
+config['MODEL_MAX_RETRIES'] = int(os.getenv("MODEL_MAX_RETRIES", "2"))
+config['MODEL_RETRY_BASE_DELAY'] = float(os.getenv("MODEL_RETRY_BASE_DELAY", "0.5"))
+config['MODEL_POOL_SIZE'] = int(os.getenv("MODEL_POOL_SIZE", "32"))
+config['MODEL_BREAKER_THRESHOLD'] = int(os.getenv("MODEL_BREAKER_THRESHOLD", "5"))
+config['MODEL_BREAKER_RESET'] = float(os.getenv("MODEL_BREAKER_RESET", "30"))
+config['MAX_CONCURRENT_GENERATIONS'] = int(os.getenv("MAX_CONCURRENT_GENERATIONS", "200"))
+config['MAX_QUEUED_GENERATIONS'] = int(os.getenv("MAX_QUEUED_GENERATIONS", "100"))
+config['PRERENDER_PDF'] = os.getenv("PRERENDER_PDF", "1") == "1"
+config['PDF_RENDER_WORKERS'] = int(os.getenv("PDF_RENDER_WORKERS", "1"))
+# "lazy" loads the document-export and model subsystems on first use; "eager" loads them in create_app(),
+# e.g. in a preloading gunicorn master so workers share them (see gunicorn.conf.py).
+config['STARTUP_LOADING'] = os.getenv("STARTUP_LOADING", "lazy")
+config['PDF_TEMPLATE_POOL_SIZE'] = int(os.getenv("PDF_TEMPLATE_POOL_SIZE", "2"))
+config['REPORT_STORE'] = os.getenv("REPORT_STORE", "filesystem")  # "filesystem" or "sqlite"
+config['REPORT_TTL'] = int(os.getenv("REPORT_TTL", str(24 * 3600)))
+config['REPORT_STORE_MAX_BYTES'] = int(os.getenv("REPORT_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+config['REPORT_GC_INTERVAL'] = int(os.getenv("REPORT_GC_INTERVAL", "300"))
+# Publish each worker's metrics to a shared sqlite file so /metrics reports totals for all gunicorn workers.
+config['METRICS_MULTIPROCESS'] = os.getenv("METRICS_MULTIPROCESS", "1") == "1"
+config['METRICS_PUBLISH_INTERVAL'] = float(os.getenv("METRICS_PUBLISH_INTERVAL", "5"))
+# Add a Server-Timing header with the per-stage breakdown to every response, for browser devtools.
+config['SERVER_TIMING'] = os.getenv("SERVER_TIMING", "0") == "1"
+# Cohort batch jobs (`flask generate-cohort`, POST /cohort_jobs): concurrent generations per job,
+# model requests per second across a worker's jobs (0 for no limit), render processes per job, jobs
+# run at once per worker, rows accepted per upload, and seconds a job is kept after its last update.
+config['COHORT_WORKERS'] = int(os.getenv("COHORT_WORKERS", "8"))
+config['COHORT_RATE_LIMIT'] = float(os.getenv("COHORT_RATE_LIMIT", "5"))
+config['COHORT_RENDER_PROCESSES'] = int(os.getenv("COHORT_RENDER_PROCESSES", "2"))
+config['COHORT_JOB_WORKERS'] = int(os.getenv("COHORT_JOB_WORKERS", "1"))
+config['COHORT_MAX_ROWS'] = int(os.getenv("COHORT_MAX_ROWS", "5000"))
+config['COHORT_JOB_TTL'] = int(os.getenv("COHORT_JOB_TTL", str(7 * 24 * 3600)))
+# Compute BMI, calories and DRI targets locally so the model only writes sources and advice.
+config['LOCAL_NUTRITION_ENGINE'] = os.getenv("LOCAL_NUTRITION_ENGINE", "1") == "1"
+
+# Routes, request hooks and CLI commands; create_app() registers them on the Flask app.
+bp = Blueprint("nutri", __name__, cli_group=None)
+
+def _service(name: str):
+    """A module-level stand-in for the current app's subsystem `name` (see NutriServices)."""
+    return LocalProxy(lambda: getattr(current_app.extensions["nutri"], name))
+
+metrics = _service("metrics")
+model_gateway = _service("model_gateway")
+# Parsed report trees by content hash, so each report is parsed once per process.
+report_model_cache = _service("report_model_cache")
+recommendation_cache = _service("recommendation_cache")
+comparison_cache = _service("comparison_cache")
+flight_lease = _service("flight_lease")
+recommendation_flights = _service("recommendation_flights")
+comparison_flights = _service("comparison_flights")
+# Every coalescing group by name, for /stats; the ASGI app registers its own.
+flight_groups = _service("flight_groups")
+report_store = _service("report_store")
+resources = _service("resources")
+pdf_executor = _service("pdf_executor")
+cohort_rate_limiter = _service("cohort_rate_limiter")
+cohort_executor = _service("cohort_executor")
+
+MODEL_NAME = "gemini-2.0-flash-lite"
+NUTRITIONIST_TEMPERATURE = 0.4
+COMPARISON_TEMPERATURE = 0.3
+
+# --- System Prompts for AI (FIXED) ---
+SYSTEM_INSTRUCTION_NUTRITIONIST = """
+You are a world-class AI Nutritionist and Dietitian. Your primary function is to generate a comprehensive, personalized, and deeply detailed nutritional report based on the user's provided data. The goal is to provide actionable, scientific, and easy-to-understand advice. The level of detail must be exhaustive.
+
+**ANALYSIS INSTRUCTIONS:**
+1.  **Analyze User Profile:** Carefully consider the user's age, gender, height, weight, activity level, dietary preferences, and any specified health conditions.
+2.  **Calculate Key Metrics:** Calculate the user's Body Mass Index (BMI) and estimate their daily caloric needs (e.g., using the Mifflin-St Jeor equation or a similar standard).
+3.  **Provide Quantitative Recommendations AND Specific Sources:** For every single nutrient listed below, you MUST provide both a specific quantitative daily intake recommendation AND a list of common, healthy food sources tailored to the user's dietary preferences.
+
+**CRITICAL FORMATTING RULE:**
+You MUST adhere to the following `OUTPUT_FORMAT` with **exact precision**. Preserve every heading, indentation, bullet point, numbering, and placeholder. The use of the `| Sources:` separator for every nutrient is mandatory. Do not add any introductory or concluding paragraphs, disclaimers, or conversational text outside of this strict structure.
+
+---
+## OUTPUT_FORMAT
+---
+
+**BMI:** [Calculate and insert BMI value, e.g., 22.5 kg/m²]
+**Estimated Daily Calories:** [Calculate and insert range, e.g., 2200-2500 kcal]
+
+**Macronutrients:**
+    **1. Carbohydrates:** [Provide % of daily caloric intake, e.g., 45-65%]
+        - **Sources:** [List 5-7 diverse sources, e.g., Quinoa, Oats, Brown Rice, Sweet Potatoes, Berries, Lentils, Chickpeas]
+        - **Glucose:** [Provide general statement, e.g., "Primary energy source, obtained from all dietary carbohydrates."]
+        - **Fructose:** [Provide general statement and sources, e.g., "Fruit sugar."] | Sources: [e.g., Fruits, honey, agave nectar]
+        - **Galactose:** [Provide general statement and sources, e.g., "Component of lactose."] | Sources: [e.g., Dairy products, avocados, sugar beets]
+        - **Sucrose:** [Provide general statement and sources, e.g., "Table sugar, limit intake."] | Sources: [e.g., Sugarcane, maple syrup, processed foods]
+        - **Lactose:** [Provide general statement and sources, e.g., "Milk sugar, avoid if intolerant."] | Sources: [e.g., Milk, yogurt, cheese]
+        - **Amylose & Amylopectin (Starches):** [Provide general statement.] | Sources: [e.g., Potatoes, corn, rice, wheat, legumes]
+
+    **2. Proteins:** [Provide % of daily caloric intake and g/kg of body weight, e.g., 15-25% | 0.8-1.2 g/kg]
+        - **Sources:** [List 5-7 diverse sources tailored to diet preference, e.g., Chicken Breast, Salmon, Eggs, Greek Yogurt, Tofu, Lentils]
+        - **Essential Amino Acids (EAAs):**
+            - Histidine (H): [Provide mg/kg/day, e.g., 10-14 mg/kg] | Sources: [e.g., Meat, fish, poultry, soy, nuts, seeds]
+            - Isoleucine (I): [Provide mg/kg/day, e.g., 19-25 mg/kg] | Sources: [e.g., Eggs, chicken, soy, almonds, lentils]
+            - Leucine (L): [Provide mg/kg/day, e.g., 40-45 mg/kg] | Sources: [e.g., Cottage cheese, beef, chicken, tofu, beans]
+            - Lysine (K): [Provide mg/kg/day, e.g., 30-38 mg/kg] | Sources: [e.g., Red meat, parmesan cheese, quinoa, lentils]
+            - Methionine (M): [Provide mg/kg/day, e.g., 15-19 mg/kg] | Sources: [e.g., Eggs, fish, sesame seeds, Brazil nuts]
+            - Phenylalanine (F): [Provide mg/kg/day, e.g., 30-35 mg/kg] | Sources: [e.g., Beef, soy, pumpkin seeds, cheese]
+            - Threonine (T): [Provide mg/kg/day, e.g., 15-20 mg/kg] | Sources: [e.g., Cottage cheese, poultry, lentils, black beans]
+            - Tryptophan (W): [Provide mg/kg/day, e.g., 4-5 mg/kg] | Sources: [e.g., Turkey, chicken, oats, nuts, seeds]
+            - Valine (V): [Provide mg/kg/day, e.g., 24-26 mg/kg] | Sources: [e.g., Soy, cheese, peanuts, mushrooms, whole grains]
+        - **Conditionally Essential Amino Acids:**
+            - Arginine (R): [Provide context, e.g., "Important for circulation."] | Sources: [e.g., Nuts, seeds, red meat, poultry, soy]
+            - Cysteine (C): [Provide context, e.g., "Key for antioxidant function."] | Sources: [e.g., Pork, chicken, soy, oats, garlic]
+            - Glutamine (Q): [Provide context, e.g., "Crucial for gut health."] | Sources: [e.g., Meat, seafood, cabbage, spinach, tofu]
+            - Glycine (G): [Provide context, e.g., "Component of collagen."] | Sources: [e.g., Bone broth, gelatin, pork rinds, chicken skin]
+            - Proline (P): [Provide context, e.g., "Essential for skin health."] | Sources: [e.g., Bone broth, gelatin, cheese, cabbage]
+            - Tyrosine (Y): [Provide context, e.g., "Precursor to neurotransmitters."] | Sources: [e.g., Cheese, soy, turkey, avocado, almonds]
+
+    **3. Fats:** [Provide % of daily caloric intake, e.g., 20-35%]
+        - **Sources:** [List 5-7 diverse sources, e.g., Avocado, Almonds, Walnuts, Olive Oil, Flaxseeds, Salmon]
+        - **Polyunsaturated Fatty Acids (PUFAs):**
+            - Linoleic acid (LA) Omega-6: [Provide g/day, e.g., 12-17 g] | Sources: [e.g., Sunflower seeds, walnuts, corn oil, soybean oil]
+            - α-Linolenic acid (ALA) Omega-3: [Provide g/day, e.g., 1.1-1.6 g] | Sources: [e.g., Flaxseeds, chia seeds, walnuts, edamame]
+        - **Monounsaturated Fatty Acids (MUFAs):** [Provide context, e.g., "Target ~15-20% of calories"] | Sources: [e.g., Olive oil, avocados, almonds, cashews, peanuts]
+        - **Saturated Fatty Acids (SFAs):** [Provide context, e.g., "Limit to <10% of daily calories"] | Sources: [e.g., Red meat, butter, coconut oil, cheese]
+        - **Dietary Cholesterol:** [Provide mg/day, e.g., <300 mg] | Sources: [e.g., Egg yolks, shellfish, organ meats, full-fat dairy]
+
+**Micronutrients:**
+    **1. Vitamins:**
+        - **Vitamin A (retinol/carotenoids):** [Provide mcg RAE/day, e.g., 700-900 mcg] | Sources: [e.g., Carrots, sweet potatoes, spinach, liver]
+        - **Vitamin B Complex:**
+            - B1 (Thiamine): [Provide mg/day, e.g., 1.1-1.2 mg] | Sources: [e.g., Pork, whole grains, nutritional yeast, black beans]
+            - B2 (Riboflavin): [Provide mg/day, e.g., 1.1-1.3 mg] | Sources: [e.g., Dairy products, almonds, lean meat, mushrooms]
+            - B3 (Niacin): [Provide mg NE/day, e.g., 14-16 mg] | Sources: [e.g., Chicken, tuna, peanuts, brown rice]
+            - B5 (Pantothenic Acid): [Provide mg/day, e.g., 5 mg] | Sources: [e.g., Avocado, shiitake mushrooms, sunflower seeds, chicken]
+            - B6 (Pyridoxine): [Provide mg/day, e.g., 1.3-1.7 mg] | Sources: [e.g., Chickpeas, salmon, potatoes, bananas]
+            - B7 (Biotin): [Provide mcg/day, e.g., 30 mcg] | Sources: [e.g., Egg yolk, liver, salmon, avocado, nuts, seeds]
+            - B9 (Folate): [Provide mcg DFE/day, e.g., 400 mcg] | Sources: [e.g., Leafy greens, lentils, beans, fortified grains]
+            - B12 (Cobalamin): [Provide mcg/day, e.g., 2.4 mcg] | Sources: [e.g., Clams, tuna, beef, fortified nutritional yeast (for vegans)]
+        - **Vitamin C (ascorbic acid):** [Provide mg/day, e.g., 75-90 mg] | Sources: [e.g., Bell peppers, oranges, broccoli, strawberries]
+        - **Vitamin D (calciferol):** [Provide IU/day, e.g., 600-800 IU] | Sources: [e.g., Fatty fish (salmon), fortified milk, sunlight]
+        - **Vitamin E (tocopherol):** [Provide mg/day, e.g., 15 mg] | Sources: [e.g., Almonds, sunflower seeds, spinach, avocado]
+        - **Vitamin K (phylloquinone/menaquinone):** [Provide mcg/day, e.g., 90-120 mcg] | Sources: [e.g., Kale, spinach, broccoli, natto]
+
+    **2. Minerals:**
+        - **Calcium:** [Provide mg/day, e.g., 1000-1300 mg] | Sources: [e.g., Dairy, tofu, sardines, fortified plant milks]
+        - **Phosphorus:** [Provide mg/day, e.g., 700 mg] | Sources: [e.g., Meat, fish, dairy, nuts, seeds, whole grains]
+        - **Potassium:** [Provide mg/day, e.g., 2600-3400 mg] | Sources: [e.g., Bananas, potatoes, spinach, beans, lentils]
+        - **Magnesium:** [Provide mg/day, e.g., 310-420 mg] | Sources: [e.g., Nuts, seeds, leafy greens, dark chocolate]
+        - **Iron:** [Provide mg/day, e.g., 8-18 mg] | Sources: [e.g., Red meat, beans, lentils, spinach, fortified cereals]
+        - **Zinc:** [Provide mg/day, e.g., 8-11 mg] | Sources: [e.g., Oysters, red meat, chickpeas, pumpkin seeds]
+        - **Sodium:** [Provide mg/day, e.g., < 2300 mg] | Sources: [e.g., Limit processed foods; small amounts in vegetables]
+        - **Chloride:** [Provide g/day, e.g., 1.8-2.3 g] | Sources: [e.g., Table salt, seaweed, tomatoes, celery]
+        - **Trace Elements:**
+            - Copper: [Provide mcg/day, e.g., 900 mcg] | Sources: [e.g., Oysters, shiitake mushrooms, cashews, seeds]
+            - Manganese: [Provide mg/day, e.g., 1.8-2.3 mg] | Sources: [e.g., Mussels, whole grains, nuts, leafy vegetables]
+            - Selenium: [Provide mcg/day, e.g., 55 mcg] | Sources: [e.g., Brazil nuts, seafood, organ meats, eggs]
+            - Iodine: [Provide mcg/day, e.g., 150 mcg] | Sources: [e.g., Seaweed, cod, dairy, iodized salt]
+            - Chromium: [Provide mcg/day, e.g., 25-35 mcg] | Sources: [e.g., Broccoli, grape juice, whole wheat products]
+            - Molybdenum: [Provide mcg/day, e.g., 45 mcg] | Sources: [e.g., Legumes, grains, nuts, leafy vegetables]
+            - Fluoride: [Provide mg/day, e.g., 3-4 mg] | Sources: [e.g., Fluoridated water, tea, grapes, raisins]
+
+**Other Key Compounds:**
+    - **Water:** [Provide L/day and glasses, e.g., 2.7-3.7 L (about 8-12 glasses)] | Tip: [Add a tip, e.g., "Drink more if active or in a hot climate."]
+    - **Fiber:** [Provide g/day, e.g., 25-38 g] | Sources: [e.g., Oats, beans, apples, broccoli, psyllium husk]
+    - **Electrolytes:** [Provide context, e.g., "Crucial for hydration; obtain from a balanced diet."] | Key Sources: [e.g., Sodium, Potassium, Magnesium from diet]
+    - **Phytochemicals:**
+        - **Polyphenols:** [Provide context, e.g., "Potent antioxidants."] | Sources: [e.g., Berries, dark chocolate, tea, coffee, red wine]
+        - **Carotenoids:** [Provide context, e.g., "Protect cells from damage."] | Sources: [e.g., Carrots, tomatoes, spinach, kale]
+
+**Actionable Advice & Recommendations:**
+    - **General Tips:**
+        - [Provide a tip about diet diversity.]
+        - [Provide a tip about mindful eating and portion control.]
+        - [Provide a tip about limiting processed foods, added sugars, and unhealthy fats.]
+    - **Health-Specific Guidance:**
+        # If no health condition is provided, output: "No specific health conditions were listed. Focus on general wellness by maintaining a balanced diet, staying hydrated, and engaging in regular physical activity."
+        # If a health condition is provided, follow the example format below.
+        # EXAMPLE START
+        # - **Diabetes:**
+        #   **Advice:** Prioritize complex carbohydrates with a low glycemic index (e.g., whole grains, legumes) to ensure stable blood sugar. Pair carbs with protein and healthy fats.
+        #   **Key Nutrients/Deficiencies:** Monitor **Magnesium** and **Chromium**, which play roles in glucose metabolism. **B-Vitamins**, especially B12, can be impacted by some medications.
+        # - **Hypertension:**
+        #   **Advice:** Dramatically reduce sodium intake by avoiding processed foods. Increase intake of potassium-rich foods (fruits, vegetables) to counterbalance sodium's effect on blood pressure.
+        #   **Key Nutrients/Deficiencies:** Focus on **Potassium, Calcium, and Magnesium**, as they are vital for blood pressure regulation.
+        # EXAMPLE END
+    - **Dietary Preference Tips:**
+        - [Provide a specific, actionable tip based on the user's diet, e.g., For a Vegan: "Ensure reliable Vitamin B12 intake through fortified foods (nutritional yeast, plant milks) or a supplement, as it's not naturally present in plant foods."]
+"""
+
+SYSTEM_INSTRUCTION_FOOD_COMPARISON = """
+Act as a concise nutritionist. Compare the foods provided by the user.
+
+**CRITICAL: Your entire response must be ONLY the HTML `<table>` element and nothing else. Do not include `<html>`, `<body>`, `<!DOCTYPE>`, markdown fences (```html), or any explanatory text before or after the table.**
+
+**Output Instructions:**
+1.  Generate a **single, complete HTML `<table>`**.
+2.  The table must have a `<thead>` with the first column header as "Nutritional Metric (per 100g)" and subsequent headers as the food names, one column per food in the order given.
+3.  The `<tbody>` must contain one `<tr>` for each of the following metrics:
+    - Calories (kcal)
+    - Protein (g)
+    - Carbohydrates (g)
+    - Fiber (g)
+    - Sugars (g)
+    - Fat (g)
+    - Key Vitamin
+    - Key Mineral
+    - Best For
+4.  Provide concise, data-driven comparisons for each metric in its respective `<td>`.
+5.  Highlight the "winner" for each metric (e.g., higher protein, lower sugar) with a simple emoji like ✅ or a brief comment.
+"""
+
+# --- Metrics ---
+# Latency buckets in seconds, from a cache hit up to a slow model call.
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Every exported series, by name: (type, help).
+METRIC_FAMILIES = {
+    "nutri_http_requests_total": ("counter", "HTTP requests served, by endpoint, method and status."),
+    "nutri_http_requests_in_flight": ("gauge", "HTTP requests currently being served."),
+    "nutri_http_request_duration_seconds": ("histogram", "Time from receiving a request until its response body is finished."),
+    "nutri_stage_duration_seconds": ("histogram", "Time spent in each stage of a request: generation, parsing, rendering and export."),
+    "nutri_model_time_to_first_chunk_seconds": ("histogram", "Time from starting a model call until its first text chunk, retries included."),
+    "nutri_model_stream_duration_seconds": ("histogram", "Duration of successful model calls, retries included."),
+    "nutri_model_calls_total": ("counter", "Model calls admitted by the gateway."),
+    "nutri_model_retries_total": ("counter", "Model calls retried after a transient error."),
+    "nutri_model_failures_total": ("counter", "Model calls that failed after any retries."),
+    "nutri_model_timeouts_total": ("counter", "Model calls that ran out of their deadline."),
+    "nutri_model_short_circuited_total": ("counter", "Model calls rejected while the circuit breaker was open."),
+    "nutri_model_calls_in_flight": ("gauge", "Model calls currently streaming."),
+    "nutri_model_circuit_state": ("gauge", "Workers whose model circuit breaker is in each state."),
+    "nutri_cache_hits_total": ("counter", "Cache lookups that found an entry."),
+    "nutri_cache_misses_total": ("counter", "Cache lookups that found nothing."),
+    "nutri_cache_evictions_total": ("counter", "Cache entries dropped from memory for size or age."),
+    "nutri_cache_entries": ("gauge", "Entries held in the in-memory tier of each cache."),
+    "nutri_cache_hit_ratio": ("gauge", "Share of cache lookups that found an entry, over the life of the workers."),
+    "nutri_single_flight_started_total": ("counter", "Generations started by a single-flight group."),
+    "nutri_single_flight_coalesced_total": ("counter", "Requests that shared a generation already in flight."),
+    "nutri_single_flight_in_flight": ("gauge", "Generations currently in flight per single-flight group."),
+    "nutri_generations_in_flight": ("gauge", "Model generations holding a slot on the ASGI event loop."),
+    "nutri_generations_queued": ("gauge", "ASGI requests waiting for a generation slot."),
+    "nutri_startup_seconds": ("gauge", "Startup milestones per worker: import, ready (after create_app) and each lazily loaded subsystem."),
+    "nutri_cohort_profiles_total": ("counter", "Distinct profiles finished by cohort batch jobs, by outcome: generated, fallback, checkpointed or failed."),
+    "nutri_temp_dir_bytes_written_total": ("counter", "Bytes written under TEMP_DIR, by kind: report, artifact or cache."),
+}
+# Ratios derived after workers are summed: name -> (hits counter, misses counter).
+METRIC_RATIOS = {"nutri_cache_hit_ratio": ("nutri_cache_hits_total", "nutri_cache_misses_total")}
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_metric_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in labels) + "}"
+
+def _format_metric_value(value) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms for this process, exported in the Prometheus text format.
+    With `db_path` set, every worker publishes a snapshot of its series to a shared sqlite file
+    every `publish_interval` seconds and `render()` sums the snapshots of all workers: counters
+    and histograms of every worker seen in the last day, so totals do not drop when gunicorn
+    recycles one, and gauges of live workers only.
+    """
+    RETENTION = 24 * 3600
+
+    def __init__(self, families, ratios=None, buckets=METRIC_BUCKETS, db_path=None, publish_interval=5.0):
+        self.families = families
+        self.ratios = ratios or {}
+        self.buckets = buckets
+        self.db_path = db_path
+        self.publish_interval = publish_interval
+        self._collectors = []
+        self._reset()
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("CREATE TABLE IF NOT EXISTS metrics (worker TEXT PRIMARY KEY, updated_at REAL NOT NULL, snapshot TEXT NOT NULL)")
+            except sqlite3.Error as e:
+                logging.warning(f"Metrics will cover this worker only, cannot use {self.db_path}: {e}")
+                self.db_path = None
+        # A worker forked from a preloaded master starts with empty series of its own.
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._values = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._worker = None
+        self._publisher = None
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=5, isolation_level=None))
+
+    def add_collector(self, collector):
+        """Registers `collector(registry)`, called before each snapshot to copy in counters kept elsewhere."""
+        self._collectors.append(collector)
+
+    def inc(self, name, value=1, **labels):
+        """Adds `value` to a counter or gauge."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+        if self._publisher is None:
+            self._start_publisher()
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts (the last one is +Inf), sum, count; made cumulative on render.
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bucket] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+        if self._publisher is None:
+            self._start_publisher()
+
+    def snapshot(self) -> dict:
+        for collector in self._collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                logging.warning(f"Metrics collector {collector.__name__} failed: {e}")
+        with self._lock:
+            return {
+                "values": [[name, labels, value] for (name, labels), value in self._values.items()],
+                "histograms": [[name, labels, list(counts), total, count] for (name, labels), (counts, total, count) in self._histograms.items()],
+            }
+
+    def publish(self):
+        """Writes this worker's snapshot to the shared database."""
+        if self._worker is None:
+            self._worker = f"{os.getpid()}-{time.time_ns()}"
+        snapshot = json.dumps(self.snapshot())
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO metrics VALUES (?, ?, ?)", (self._worker, now, snapshot))
+            conn.execute("DELETE FROM metrics WHERE updated_at < ?", (now - self.RETENTION,))
+
+    def _start_publisher(self):
+        if not self.db_path:
+            return
+        with self._lock:
+            if self._publisher is not None:
+                return
+            self._publisher = threading.Thread(target=self._publish_loop, name="metrics-publisher", daemon=True)
+        self._publisher.start()
+
+    def _publish_loop(self):
+        while True:
+            time.sleep(self.publish_interval)
+            try:
+                self.publish()
+            except Exception as e:
+                logging.warning(f"Publishing metrics failed: {e}")
+
+    def _snapshots(self):
+        """Returns (is_live, snapshot) for every worker, this one included."""
+        if not self.db_path:
+            return [(True, self.snapshot())]
+        try:
+            self.publish()
+            with self._connect() as conn:
+                rows = conn.execute("SELECT updated_at, snapshot FROM metrics").fetchall()
+        except sqlite3.Error as e:
+            logging.warning(f"Reading shared metrics failed, reporting this worker only: {e}")
+            return [(True, self.snapshot())]
+        live_after = time.time() - 3 * self.publish_interval
+        return [(updated_at >= live_after, json.loads(snapshot)) for updated_at, snapshot in rows]
+
+    def collect(self):
+        """Sums the series of all workers; returns ({(name, labels): value}, {(name, labels): [counts, sum, count]})."""
+        values, histograms = {}, {}
+        for live, snapshot in self._snapshots():
+            for name, labels, value in snapshot["values"]:
+                family = self.families.get(name)
+                if family is None or (family[0] == "gauge" and not live):
+                    continue
+                key = (name, tuple(tuple(label) for label in labels))
+                values[key] = values.get(key, 0) + value
+            for name, labels, counts, total, count in snapshot["histograms"]:
+                if name not in self.families or len(counts) != len(self.buckets) + 1:
+                    continue
+                merged = histograms.setdefault((name, tuple(tuple(label) for label in labels)), [[0] * len(counts), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+        for ratio_name, (hits_name, misses_name) in self.ratios.items():
+            for (name, labels), hits in list(values.items()):
+                lookups = hits + values.get((misses_name, labels), 0)
+                if name == hits_name and lookups:
+                    values[(ratio_name, labels)] = hits / lookups
+        return values, histograms
+
+    def render(self) -> str:
+        values, histograms = self.collect()
+        series = {}
+        for (name, labels), value in sorted(values.items()):
+            series.setdefault(name, []).append(f"{name}{_format_metric_labels(labels)} {_format_metric_value(value)}")
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, bucket_count in zip((*map(_format_metric_value, self.buckets), "+Inf"), counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_metric_labels((*labels, ('le', bound)))} {cumulative}")
+            lines.append(f"{name}_sum{_format_metric_labels(labels)} {_format_metric_value(total)}")
+            lines.append(f"{name}_count{_format_metric_labels(labels)} {count}")
+        out = []
+        for name, (kind, help_text) in self.families.items():
+            if name in series:
+                out.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *series[name]])
+        return "\n".join(out) + "\n"
+
+
+# Seconds from the start of the import to each startup milestone ("import", "ready"), plus
+# the time taken to load each lazily loaded subsystem, in the process that loaded it.
+# Shared with reports.py, which records the load times of the document stack here.
+startup_timings = reports.load_timings
+
+def record_startup(phase: str, seconds: float):
+    startup_timings[phase] = seconds
+    logging.info(f"Startup: {phase} took {seconds * 1000:.1f} ms")
+
+def _collect_startup_timings(registry):
+    for phase, seconds in startup_timings.items():
+        registry.set("nutri_startup_seconds", seconds, phase=phase, pid=str(os.getpid()))
+
+# Stage durations of the request being served, for its Server-Timing header; None outside a request.
+_request_timings = ContextVar("request_timings", default=None)
+
+@contextmanager
+def timed(stage: str):
+    """Times a block (or, as a decorator, a call) into nutri_stage_duration_seconds and the request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe("nutri_stage_duration_seconds", elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+def server_timing_header(timings: dict, total: float) -> str:
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    return ", ".join([*entries, f"total;dur={total * 1000:.1f}"])
+
+def _start_request_metrics():
+    """Opens the request's Server-Timing entries and counts it in flight; returns its start time."""
+    _request_timings.set({})
+    metrics.inc("nutri_http_requests_in_flight")
+    return time.perf_counter()
+
+def _finish_request_metrics(endpoint: str, method: str, status: int, started: float):
+    metrics.inc("nutri_http_requests_in_flight", -1)
+    metrics.inc("nutri_http_requests_total", endpoint=endpoint, method=method, status=str(status))
+    metrics.observe("nutri_http_request_duration_seconds", time.perf_counter() - started, endpoint=endpoint)
+
+@bp.before_app_request
+def _before_request_metrics():
+    g.request_started = _start_request_metrics()
+
+@bp.after_app_request
+def _add_server_timing(response):
+    g.response_status = response.status_code
+    if current_app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = server_timing_header(_request_timings.get() or {}, time.perf_counter() - g.request_started)
+    return response
+
+@bp.teardown_app_request
+def _teardown_request_metrics(error=None):
+    # Runs after a streamed body is finished, so durations cover the whole response.
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    status = 500 if error is not None else g.get('response_status', 500)
+    _finish_request_metrics(endpoint, request.method, status, started)
+
+# --- Model Gateway ---
+class ModelUnavailableError(Exception):
+    """The model could not produce a response: no backend, open circuit, deadline or exhausted retries."""
+
+
+class CircuitOpenError(ModelUnavailableError):
+    """Raised without calling the model while the circuit breaker is open."""
+
+
+class ModelTimeoutError(ModelUnavailableError, TimeoutError):
+    """The call ran past its deadline."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed calls and rejects calls for `reset_timeout`
+    seconds; then a single trial call is let through, which closes the circuit again on success.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opens = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opens += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def release_trial(self):
+        """Frees the half-open trial slot of a call abandoned before it succeeded or failed."""
+        with self._lock:
+            if self.state == "half_open":
+                self._trial_in_flight = False
+
+
+def _is_transient_model_error(error: Exception) -> bool:
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # Only a loaded SDK can have raised its own errors, so there is no need to import it here.
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return True
+    genai_errors = sys.modules.get("google.genai.errors")
+    if genai_errors is not None and isinstance(error, genai_errors.APIError):
+        return error.code in (408, 429) or (error.code or 0) >= 500
+    return False
+
+_END_OF_STREAM = object()
+
+
+class ModelGateway:
+    """
+    The one way the app talks to the model. Wraps a genai-compatible backend (anything with
+    `models.generate_content_stream` and `aio.models.generate_content_stream`) with a deadline
+    per call, jittered retries on transient errors before the first chunk arrives, a circuit
+    breaker, and a per-process pool of threads for the sync client. Counters feed /stats.
+
+    The backend is built by `backend_factory` on first use, so the model SDK is only imported
+    by processes that call the model; after a fork each worker builds its own client.
+    """
+    def __init__(self, backend_factory, timeout=60.0, max_retries=2, retry_base_delay=0.5, pool_size=32, breaker=None):
+        self.backend_factory = backend_factory
+        self._backend = None
+        self._backend_loaded = False
+        self._backend_lock = threading.Lock()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.breaker = breaker or CircuitBreaker()
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="model")
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "timeouts": 0, "short_circuited": 0, "in_flight": 0}
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # HTTP connection pools must not be shared between processes.
+        self._backend = None
+        self._backend_loaded = False
+        self._backend_lock = threading.Lock()
+
+    @property
+    def backend(self):
+        """The backend client, built on first access; None when it could not be built."""
+        if not self._backend_loaded:
+            with self._backend_lock:
+                if not self._backend_loaded:
+                    start = time.perf_counter()
+                    try:
+                        self._backend = self.backend_factory()
+                        record_startup("model_backend", time.perf_counter() - start)
+                    except Exception as e:
+                        # Keep serving: cached reports, local fallbacks and downloads work without the model.
+                        logging.critical(f"Failed to initialize the model backend, model calls will fail: {e}")
+                    self._backend_loaded = True
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        with self._backend_lock:
+            self._backend = backend
+            self._backend_loaded = True
+
+    def _count(self, name, delta=1):
+        with self._lock:
+            self.counters[name] += delta
+
+    def _admit(self):
+        if self.backend is None:
+            raise ModelUnavailableError("No model backend is configured.")
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise CircuitOpenError("The model circuit breaker is open.")
+        self._count("calls")
+
+    def _retry_delay(self, attempt: int, deadline: float):
+        """Full-jitter exponential backoff, or None when the retry would not fit in the deadline."""
+        delay = random.uniform(0, self.retry_base_delay * 2 ** attempt)
+        return delay if time.monotonic() + delay < deadline else None
+
+    def _failed(self, error: Exception):
+        self._count("failures")
+        if isinstance(error, ModelTimeoutError):
+            self._count("timeouts")
+        if _is_transient_model_error(error):
+            self.breaker.record_failure()
+        else:
+            # The upstream answered; a bad request says nothing about its health.
+            self.breaker.record_success()
+
+    def stream_text(self, request: dict):
+        """Yields the response text chunk by chunk (sync client)."""
+        self._admit()
+        started = time.monotonic()
+        deadline = started + self.timeout
+        self._count("in_flight")
+        settled = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                produced = False
+                try:
+                    for text in self._stream_once(request, deadline):
+                        if not produced:
+                            metrics.observe("nutri_model_time_to_first_chunk_seconds", time.monotonic() - started)
+                        produced = True
+                        yield text
+                    settled = True
+                    self.breaker.record_success()
+                    metrics.observe("nutri_model_stream_duration_seconds", time.monotonic() - started)
+                    return
+                except Exception as e:
+                    delay = None if produced or attempt == self.max_retries or not _is_transient_model_error(e) \
+                        else self._retry_delay(attempt, deadline)
+                    if delay is None:
+                        settled = True
+                        self._failed(e)
+                        raise
+                    logging.warning(f"Transient model error, retrying in {delay:.2f}s: {e}")
+                    self._count("retries")
+                    time.sleep(delay)
+        finally:
+            if not settled:
+                # Closed by the consumer (GeneratorExit) or interrupted: neither a success nor a failure.
+                self.breaker.release_trial()
+            self._count("in_flight", -1)
+
+    def _stream_once(self, request: dict, deadline: float):
+        """Runs one streaming call on the pool and relays its chunks until the deadline."""
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+
+        def pump():
+            if cancelled.is_set():
+                return
+            try:
+                for chunk in self.backend.models.generate_content_stream(**request):
+                    if cancelled.is_set():
+                        return
+                    if chunk.text:
+                        chunks.put(chunk.text)
+                chunks.put(_END_OF_STREAM)
+            except Exception as e:
+                chunks.put(e)
+
+        future = self._pool.submit(pump)
+        try:
+            while True:
+                try:
+                    item = chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    raise ModelTimeoutError(f"The model did not respond within {self.timeout:g}s.")
+                if item is _END_OF_STREAM:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            cancelled.set()
+            future.cancel()
+
+    async def astream_text(self, request: dict):
+        """Async counterpart of stream_text, for the ASGI app."""
+        self._admit()
+        started = time.monotonic()
+        deadline = started + self.timeout
+        self._count("in_flight")
+        settled = False
+        try:
+            for attempt in range(self.max_retries + 1):
+                produced = False
+                try:
+                    stream = await asyncio.wait_for(self.backend.aio.models.generate_content_stream(**request),
+                                                    max(0.0, deadline - time.monotonic()))
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(anext(stream), max(0.0, deadline - time.monotonic()))
+                        except StopAsyncIteration:
+                            break
+                        if chunk.text:
+                            if not produced:
+                                metrics.observe("nutri_model_time_to_first_chunk_seconds", time.monotonic() - started)
+                            produced = True
+                            yield chunk.text
+                    settled = True
+                    self.breaker.record_success()
+                    metrics.observe("nutri_model_stream_duration_seconds", time.monotonic() - started)
+                    return
+                except Exception as e:
+                    error = e
+                    if isinstance(e, asyncio.TimeoutError) and not isinstance(e, ModelTimeoutError):
+                        error = ModelTimeoutError(f"The model did not respond within {self.timeout:g}s.")
+                    delay = None if produced or attempt == self.max_retries or not _is_transient_model_error(error) \
+                        else self._retry_delay(attempt, deadline)
+                    if delay is None:
+                        settled = True
+                        self._failed(error)
+                        raise error from (e if error is not e else None)
+                    logging.warning(f"Transient model error, retrying in {delay:.2f}s: {error}")
+                    self._count("retries")
+                    await asyncio.sleep(delay)
+        finally:
+            if not settled:
+                # Closed by the consumer or cancelled: neither a success nor a failure.
+                self.breaker.release_trial()
+            self._count("in_flight", -1)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, "circuit": self.breaker.state, "circuit_opens": self.breaker.opens}
+
+
+MODEL_UNAVAILABLE_MESSAGE = "The AI service is temporarily unavailable. Please try again shortly."
+
+def _model_unavailable_response():
+    return jsonify({"error": MODEL_UNAVAILABLE_MESSAGE}), 503, {"Retry-After": str(int(model_gateway.breaker.reset_timeout))}
+
+def _create_gemini_backend(config):
+    import httpx
+    from google import genai
+    from google.genai import types
+    limits = httpx.Limits(max_connections=config['MODEL_POOL_SIZE'], max_keepalive_connections=config['MODEL_POOL_SIZE'])
+    return genai.Client(api_key=os.getenv("GEMINI_API_KEY"), http_options=types.HttpOptions(
+        timeout=int(config['MODEL_TIMEOUT'] * 1000), client_args={"limits": limits}, async_client_args={"limits": limits}))
+
+MODEL_BACKENDS = {"gemini": _create_gemini_backend}
+
+def _model_backend_factory(name: str):
+    """The backend factory for a MODEL_BACKEND setting: a MODEL_BACKENDS name or "module:function"."""
+    if name in MODEL_BACKENDS:
+        return MODEL_BACKENDS[name]
+    module_name, _, function_name = name.partition(":")
+    if not function_name:
+        raise ValueError(f"Unknown MODEL_BACKEND '{name}': use one of {', '.join(MODEL_BACKENDS)} or 'module:function'.")
+    return getattr(importlib.import_module(module_name), function_name)
+
+def _create_model_gateway(config) -> ModelGateway:
+    def load_backend():
+        backend = _model_backend_factory(config['MODEL_BACKEND'])(config)
+        logging.info(f"Model backend '{config['MODEL_BACKEND']}' initialized successfully.")
+        return backend
+
+    return ModelGateway(
+        load_backend,
+        timeout=config['MODEL_TIMEOUT'],
+        max_retries=config['MODEL_MAX_RETRIES'],
+        retry_base_delay=config['MODEL_RETRY_BASE_DELAY'],
+        pool_size=config['MODEL_POOL_SIZE'],
+        breaker=CircuitBreaker(config['MODEL_BREAKER_THRESHOLD'], config['MODEL_BREAKER_RESET']),
+    )
+
+# --- Response Cache ---
+class ResponseCache:
+    """
+    Two-tier cache for model output: a bounded in-process LRU with TTL, backed by an
+    optional sqlite file in UPLOAD_FOLDER so every gunicorn worker shares the same entries.
+    The file is pruned at most every `prune_interval` seconds: expired rows, then the rows
+    closest to expiry beyond `max_disk_entries`.
+    """
+    def __init__(self, max_entries=512, ttl=24 * 3600, db_path=None, max_disk_entries=None, prune_interval=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.max_disk_entries = max_disk_entries
+        self.prune_interval = prune_interval
+        self._next_prune = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+                    conn.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+            except sqlite3.Error as e:
+                logging.warning(f"Disabling on-disk response cache at {self.db_path}: {e}")
+                self.db_path = None
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=5, isolation_level=None))
+
+    def _remember(self, key, value, expires_at):
+        """Stores an entry in the memory tier. Caller must hold the lock."""
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+                self.evictions += 1
+
+        row = None
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute("SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            except sqlite3.Error as e:
+                logging.warning(f"Response cache read failed: {e}")
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, row[0], row[1])
+            return row[0]
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, value, expires_at)
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute("INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at))
+                    if self._prune_due():
+                        self._prune(conn)
+                metrics.inc("nutri_temp_dir_bytes_written_total", len(value.encode('utf-8')), kind="cache")
+            except sqlite3.Error as e:
+                logging.warning(f"Response cache write failed: {e}")
+
+    def _prune_due(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_prune:
+                return False
+            self._next_prune = now + self.prune_interval
+            return True
+
+    def _prune(self, conn):
+        conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        if self.max_disk_entries:
+            excess = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_disk_entries
+            if excess > 0:
+                conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY expires_at LIMIT ?)", (excess,))
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._entries)}
+
+
+def _text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def _normalize_profile_value(value) -> str:
+    """Collapses whitespace and case, and renders numbers canonically ("70", "70.0 " -> "70")."""
+    normalized = " ".join(str(value).split()).casefold()
+    try:
+        return format(float(normalized), 'g')
+    except ValueError:
+        return normalized
+
+def _response_cache_key(system_instruction: str, temperature: float, payload) -> str:
+    """
+    Builds a content-addressed cache key. The system instruction is hashed into the key,
+    so editing a prompt invalidates every entry produced with the old one.
+    """
+    key_material = json.dumps({
+        "model": MODEL_NAME,
+        "temperature": temperature,
+        "system_instruction": _text_digest(system_instruction),
+        "payload": payload,
+    }, sort_keys=True, ensure_ascii=False)
+    return _text_digest(key_material)
+
+# --- Request Coalescing ---
+class FlightLease:
+    """
+    Cross-worker half of single-flight: a row in the shared cache database marks the worker that
+    is generating a key, so other gunicorn workers wait for its cached result instead of calling
+    the model themselves. Leases expire, so a crashed worker cannot block a key for long.
+    """
+    def __init__(self, db_path, ttl=120, poll_interval=0.05):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS flight_leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=5, isolation_level=None))
+
+    def acquire(self, key: str, owner: str) -> bool:
+        """Takes the lease unless another worker holds an unexpired one. Fails open on database errors."""
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO flight_leases (key, owner, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                    "WHERE flight_leases.expires_at <= ?", (key, owner, now + self.ttl, now))
+                row = conn.execute("SELECT owner FROM flight_leases WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"Flight lease unavailable, generating locally: {e}")
+            return True
+        return row is not None and row[0] == owner
+
+    def release(self, key: str, owner: str):
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM flight_leases WHERE key = ? AND owner = ?", (key, owner))
+        except sqlite3.Error as e:
+            logging.warning(f"Flight lease release failed: {e}")
+
+    def wait(self, key: str):
+        """Blocks until nobody holds an unexpired lease on the key."""
+        while True:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute("SELECT 1 FROM flight_leases WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+            except sqlite3.Error:
+                return
+            if row is None:
+                return
+            time.sleep(self.poll_interval)
+
+
+class _Flight:
+    """One in-flight generation: the chunks produced so far, replayed to every subscriber."""
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._condition = threading.Condition()
+
+    def append(self, chunk):
+        with self._condition:
+            self.chunks.append(chunk)
+            self._condition.notify_all()
+
+    def finish(self, error=None):
+        with self._condition:
+            self.done = True
+            self.error = error
+            self._condition.notify_all()
+
+    def subscribe(self):
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.chunks) and not self.done:
+                    self._condition.wait()
+                pending = self.chunks[index:]
+                index = len(self.chunks)
+                done, error = self.done, self.error
+            yield from pending
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight generations within a worker. The first caller for a key
+    starts the work; later callers attach to it and receive the same result, or the same
+    chunks from the start, as they arrive. With a FlightLease, a worker that finds another
+    worker generating the key waits for that worker's cached result via `lookup`.
+    """
+    def __init__(self, name, lease=None):
+        self.name = name
+        self.lease = lease
+        self.started = 0
+        self.coalesced = 0
+        self.remote_waits = 0
+        self.remote_hits = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        """Returns (flight, is_leader)."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self.started += 1
+            return flight, True
+
+    def _leave(self, key):
+        with self._lock:
+            self._flights.pop(key, None)
+
+    def _claim(self, key, lookup):
+        """
+        Coordinates with other workers. Returns (owner, cached): `owner` is the lease to release
+        after generating, `cached` a result another worker produced meanwhile. Without a cached
+        result, only returns once this worker holds the lease, so no two workers generate a key.
+        """
+        if self.lease is None or lookup is None:
+            return None, None
+        lease_key, owner = f"{self.name}:{key}", os.urandom(8).hex()
+        while not self.lease.acquire(lease_key, owner):
+            with self._lock:
+                self.remote_waits += 1
+            self.lease.wait(lease_key)
+            cached = lookup()
+            if cached is not None:
+                with self._lock:
+                    self.remote_hits += 1
+                return None, cached
+        return owner, None
+
+    def _release(self, key, owner):
+        if owner is not None:
+            self.lease.release(f"{self.name}:{key}", owner)
+
+    def call(self, key, fn, lookup=None):
+        """Runs fn() once for all concurrent callers with the same key and returns its result."""
+        flight, leader = self._join(key)
+        if leader:
+            owner = None
+            try:
+                owner, cached = self._claim(key, lookup)
+                flight.append(cached if cached is not None else fn())
+                flight.finish()
+            except Exception as e:
+                flight.finish(e)
+            finally:
+                self._leave(key)
+                self._release(key, owner)
+        return list(flight.subscribe())[0]
+
+    def stream(self, key, produce, on_complete=None, lookup=None):
+        """
+        Returns an iterator over the chunks of produce() shared by every concurrent caller with
+        the same key. The producer runs in its own thread, so a caller that disconnects does not
+        cut the stream short for the others; on_complete receives the joined text once.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            threading.Thread(target=copy_context().run, args=(self._produce, key, flight, produce, on_complete, lookup),
+                             name=f"{self.name}-flight", daemon=True).start()
+        return flight.subscribe()
+
+    def _produce(self, key, flight, produce, on_complete, lookup):
+        owner = None
+        try:
+            owner, cached = self._claim(key, lookup)
+            if cached is not None:
+                flight.append(cached)
+            else:
+                for chunk in produce():
+                    flight.append(chunk)
+                if on_complete is not None:
+                    on_complete("".join(flight.chunks))
+            flight.finish()
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            self._leave(key)
+            self._release(key, owner)
+
+    def stats(self):
+        with self._lock:
+            return {"started": self.started, "coalesced": self.coalesced, "in_flight": len(self._flights),
+                    "remote_waits": self.remote_waits, "remote_hits": self.remote_hits}
+
+
+class _LeaderCancelled(Exception):
+    """The leader of an async flight was cancelled before its work started."""
+
+
+class _AsyncFlight:
+    """Event-loop counterpart of _Flight."""
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def subscribe(self):
+        index = 0
+        while True:
+            if index < len(self.chunks):
+                pending = self.chunks[index:]
+                index = len(self.chunks)
+                for chunk in pending:
+                    yield chunk
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self._changed.wait()
+
+
+class AsyncSingleFlight(SingleFlight):
+    """
+    SingleFlight for the ASGI app. The leader's work runs as a task so that it outlives the
+    request that started it. `admit` is an async context manager factory (a generation slot),
+    entered before the work starts and held until it ends. `lookup` and `on_complete` are
+    blocking (they touch the sqlite cache) and run in a worker thread.
+    """
+    def _join(self, key):
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            return flight, False
+        flight = self._flights[key] = _AsyncFlight()
+        return flight, True
+
+    async def _enter(self, key, flight, admit):
+        slot = admit() if admit is not None else None
+        try:
+            if slot is not None:
+                await slot.__aenter__()
+        except Exception as e:
+            flight.finish(e)
+            self._leave(key)
+            raise
+        except BaseException:
+            # The leader's request went away while waiting for a slot: free the key so
+            # that a follower starts the work instead of sharing the cancellation.
+            flight.finish(_LeaderCancelled())
+            self._leave(key)
+            raise
+        return slot
+
+    async def _lead(self, key, flight, admit, work):
+        slot = await self._enter(key, flight, admit)
+        # Counted once admitted, so requests turned away for a full queue are not generations.
+        self.started += 1
+        flight.task = asyncio.create_task(self._run(key, flight, slot, *work))
+
+    async def _follow(self, key, flight, admit, work):
+        """Chunks of the flight; if its leader was cancelled before starting, joins the key again."""
+        while True:
+            try:
+                async for chunk in flight.subscribe():
+                    yield chunk
+                return
+            except _LeaderCancelled:
+                flight, leader = self._join(key)
+                if leader:
+                    await self._lead(key, flight, admit, work)
+
+    async def call(self, key, fn, lookup=None, admit=None):
+        work = (lookup, fn, None)
+        flight, leader = self._join(key)
+        if leader:
+            await self._lead(key, flight, admit, work)
+        return [chunk async for chunk in self._follow(key, flight, admit, work)][0]
+
+    async def stream(self, key, produce, on_complete=None, lookup=None, admit=None):
+        work = (lookup, None, produce, on_complete)
+        flight, leader = self._join(key)
+        if leader:
+            await self._lead(key, flight, admit, work)
+        return self._follow(key, flight, admit, work)
+
+    async def _run(self, key, flight, slot, lookup, fn, produce, on_complete=None):
+        owner = None
+        try:
+            owner, cached = await asyncio.to_thread(self._claim, key, lookup)
+            if cached is not None:
+                flight.append(cached)
+            elif fn is not None:
+                flight.append(await fn())
+            else:
+                async for chunk in produce():
+                    flight.append(chunk)
+                if on_complete is not None:
+                    await asyncio.to_thread(on_complete, "".join(flight.chunks))
+            flight.finish()
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            self._leave(key)
+            if owner is not None:
+                await asyncio.to_thread(self._release, key, owner)
+            if slot is not None:
+                await slot.__aexit__(None, None, None)
+
+    def _leave(self, key):
+        self._flights.pop(key, None)
+
+    def stats(self):
+        return {"started": self.started, "coalesced": self.coalesced, "in_flight": len(self._flights),
+                "remote_waits": self.remote_waits, "remote_hits": self.remote_hits}
+
+
+def _create_flight_lease(config):
+    if not config['SINGLE_FLIGHT_CROSS_WORKER']:
+        return None
+    if not config['RESPONSE_CACHE_DISK']:
+        logging.warning("SINGLE_FLIGHT_CROSS_WORKER needs RESPONSE_CACHE_DISK; coalescing within each worker only.")
+        return None
+    return FlightLease(os.path.join(config['UPLOAD_FOLDER'], "response_cache.sqlite3"), ttl=config['SINGLE_FLIGHT_LEASE_TTL'])
+
+# --- Report Storage ---
+_CROCKFORD_BASE32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+REPORT_TOKEN_PATTERN = re.compile(r"[0-9A-HJKMNP-TV-Z]{26}")
+
+def new_report_token() -> str:
+    """
+    Returns a ULID-style token: 48 bits of millisecond timestamp followed by 80 random bits,
+    in Crockford base32. Tokens are unique across processes and sort by creation time.
+    """
+    value = (int(time.time() * 1000) << 80) | int.from_bytes(os.urandom(10), 'big')
+    chars = []
+    for _ in range(26):
+        chars.append(_CROCKFORD_BASE32[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+def is_valid_report_token(token: str) -> bool:
+    return REPORT_TOKEN_PATTERN.fullmatch(token) is not None
+
+
+ReportMetadata = namedtuple("ReportMetadata", "token created_at digest artifacts")
+
+
+def _atomic_write(path: str, data: bytes):
+    """Writes to a temp file in the target directory and renames it into place, so readers
+    in other workers never see a half-written file."""
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+class ReportIndex:
+    """
+    sqlite index of token -> report metadata (creation and access time, content hash, size
+    and derived artifacts). Lookups, expiry and eviction are answered from the index alone.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS reports (token TEXT PRIMARY KEY, created_at REAL NOT NULL, "
+                         "accessed_at REAL NOT NULL, digest TEXT NOT NULL, size INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS artifacts (token TEXT NOT NULL, name TEXT NOT NULL, "
+                         "size INTEGER NOT NULL, PRIMARY KEY (token, name))")
+            conn.execute("CREATE INDEX IF NOT EXISTS reports_accessed_at ON reports (accessed_at)")
+
+    def connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=10, isolation_level=None))
+
+    def add(self, conn, token, digest, size):
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?)", (token, now, now, digest, size))
+
+    def add_artifact(self, conn, token, name, size):
+        conn.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?)", (token, name, size))
+        conn.execute("UPDATE reports SET size = size + ? WHERE token = ?", (size, token))
+
+    def lookup(self, token, ttl):
+        """Returns (metadata, expired); marks the report as accessed when it is live."""
+        now = time.time()
+        with self.connect() as conn:
+            row = conn.execute("SELECT created_at, digest FROM reports WHERE token = ?", (token,)).fetchone()
+            if row is None:
+                return None, False
+            if row[0] + ttl <= now:
+                return None, True
+            conn.execute("UPDATE reports SET accessed_at = ? WHERE token = ?", (now, token))
+            artifacts = frozenset(name for (name,) in conn.execute("SELECT name FROM artifacts WHERE token = ?", (token,)))
+        return ReportMetadata(token, row[0], row[1], artifacts), False
+
+    def delete(self, conn, tokens):
+        conn.executemany("DELETE FROM artifacts WHERE token = ?", [(token,) for token in tokens])
+        conn.executemany("DELETE FROM reports WHERE token = ?", [(token,) for token in tokens])
+
+    def select_for_removal(self, conn, ttl, max_bytes):
+        """Returns expired tokens plus the least recently accessed ones needed to fit max_bytes."""
+        removed = [token for (token,) in conn.execute(
+            "SELECT token FROM reports WHERE created_at <= ?", (time.time() - ttl,))]
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM reports WHERE created_at > ?",
+                             (time.time() - ttl,)).fetchone()[0]
+        if total > max_bytes:
+            for token, size in conn.execute("SELECT token, size FROM reports WHERE created_at > ? ORDER BY accessed_at",
+                                            (time.time() - ttl,)).fetchall():
+                if total <= max_bytes:
+                    break
+                removed.append(token)
+                total -= size
+        return removed
+
+
+class ReportStore(ABC):
+    """
+    Storage for report text and the artifacts derived from it (PDF, DOCX), with metadata kept
+    in a ReportIndex. Reports expire `ttl` seconds after creation; when the total size exceeds
+    `max_bytes`, the least recently accessed reports are evicted. A daemon thread runs
+    `sweep()` every `gc_interval` seconds.
+    """
+    def __init__(self, index, ttl=24 * 3600, max_bytes=512 * 1024 * 1024, gc_interval=300):
+        self.index = index
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.gc_interval = gc_interval
+        self._gc_thread = None
+        self._gc_lock = threading.Lock()
+
+    @abstractmethod
+    def save_report(self, token: str, text: str):
+        ...
+
+    @abstractmethod
+    def load_report(self, token: str):
+        """Returns the stored report text, or None if it is missing."""
+
+    @abstractmethod
+    def put_artifact(self, token: str, name: str, data: bytes):
+        ...
+
+    @abstractmethod
+    def open_artifact(self, token: str, name: str):
+        """Returns a path or file object that send_file can serve, or None if it is missing."""
+
+    @abstractmethod
+    def _delete_payloads(self, tokens):
+        ...
+
+    def get_metadata(self, token: str):
+        """Returns the report's ReportMetadata, or None if it does not exist or has expired."""
+        metadata, expired = self.index.lookup(token, self.ttl)
+        if expired:
+            self._remove([token])
+        return metadata
+
+    def _remove(self, tokens):
+        with self.index.connect() as conn:
+            self.index.delete(conn, tokens)
+        self._delete_payloads(tokens)
+
+    def sweep(self):
+        """Deletes expired reports, then evicts least recently used ones down to max_bytes."""
+        with self.index.connect() as conn:
+            tokens = self.index.select_for_removal(conn, self.ttl, self.max_bytes)
+        if tokens:
+            self._remove(tokens)
+        return len(tokens)
+
+    def start_gc(self):
+        with self._gc_lock:
+            if self._gc_thread is not None and self._gc_thread.is_alive():
+                return
+            self._gc_thread = threading.Thread(target=self._gc_loop, name="report-gc", daemon=True)
+            self._gc_thread.start()
+
+    def _gc_loop(self):
+        while True:
+            try:
+                start = time.perf_counter()
+                removed = self.sweep()
+                if removed:
+                    logging.info(f"Report GC removed {removed} reports in {(time.perf_counter() - start) * 1000:.1f} ms")
+            except Exception as e:
+                logging.error(f"Report GC sweep failed: {e}", exc_info=True)
+            time.sleep(self.gc_interval)
+
+
+class FileSystemReportStore(ReportStore):
+    """
+    Keeps each report in its own directory, sharded 256 ways by token hash:
+    <root>/<shard>/<token>/report.txt plus its artifacts. Metadata lives in <root>/index.sqlite3.
+    """
+    REPORT_FILENAME = "report.txt"
+
+    def __init__(self, root, **kwargs):
+        os.makedirs(root, exist_ok=True)
+        super().__init__(ReportIndex(os.path.join(root, "index.sqlite3")), **kwargs)
+        self.root = root
+
+    def _report_dir(self, token: str) -> str:
+        return os.path.join(self.root, hashlib.md5(token.encode('utf-8')).hexdigest()[:2], token)
+
+    def save_report(self, token, text):
+        data = text.encode('utf-8')
+        report_dir = self._report_dir(token)
+        os.makedirs(report_dir, exist_ok=True)
+        _atomic_write(os.path.join(report_dir, self.REPORT_FILENAME), data)
+        metrics.inc("nutri_temp_dir_bytes_written_total", len(data), kind="report")
+        with self.index.connect() as conn:
+            self.index.add(conn, token, _text_digest(text), len(data))
+        self.start_gc()
+
+    def load_report(self, token):
+        try:
+            with open(os.path.join(self._report_dir(token), self.REPORT_FILENAME), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put_artifact(self, token, name, data):
+        _atomic_write(os.path.join(self._report_dir(token), name), data)
+        metrics.inc("nutri_temp_dir_bytes_written_total", len(data), kind="artifact")
+        with self.index.connect() as conn:
+            self.index.add_artifact(conn, token, name, len(data))
+
+    def open_artifact(self, token, name):
+        return os.path.join(self._report_dir(token), name)
+
+    def _delete_payloads(self, tokens):
+        for token in tokens:
+            shutil.rmtree(self._report_dir(token), ignore_errors=True)
+
+
+class SQLiteReportStore(ReportStore):
+    """Keeps report text and artifacts as rows next to the index in one sqlite database shared by all workers."""
+    def __init__(self, db_path, **kwargs):
+        super().__init__(ReportIndex(db_path), **kwargs)
+        with self.index.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS report_texts (token TEXT PRIMARY KEY, text TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS artifact_data (token TEXT NOT NULL, name TEXT NOT NULL, "
+                         "data BLOB NOT NULL, PRIMARY KEY (token, name))")
+
+    def save_report(self, token, text):
+        with self.index.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR REPLACE INTO report_texts VALUES (?, ?)", (token, text))
+            self.index.add(conn, token, _text_digest(text), len(text.encode('utf-8')))
+            conn.execute("COMMIT")
+        metrics.inc("nutri_temp_dir_bytes_written_total", len(text.encode('utf-8')), kind="report")
+        self.start_gc()
+
+    def load_report(self, token):
+        with self.index.connect() as conn:
+            row = conn.execute("SELECT text FROM report_texts WHERE token = ?", (token,)).fetchone()
+        return row[0] if row else None
+
+    def put_artifact(self, token, name, data):
+        with self.index.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR REPLACE INTO artifact_data VALUES (?, ?, ?)", (token, name, data))
+            self.index.add_artifact(conn, token, name, len(data))
+            conn.execute("COMMIT")
+        metrics.inc("nutri_temp_dir_bytes_written_total", len(data), kind="artifact")
+
+    def open_artifact(self, token, name):
+        with self.index.connect() as conn:
+            row = conn.execute("SELECT data FROM artifact_data WHERE token = ? AND name = ?", (token, name)).fetchone()
+        return io.BytesIO(row[0]) if row else None
+
+    def _delete_payloads(self, tokens):
+        with self.index.connect() as conn:
+            conn.executemany("DELETE FROM artifact_data WHERE token = ?", [(token,) for token in tokens])
+            conn.executemany("DELETE FROM report_texts WHERE token = ?", [(token,) for token in tokens])
+
+
+def _create_report_store(config) -> ReportStore:
+    options = {"ttl": config['REPORT_TTL'], "max_bytes": config['REPORT_STORE_MAX_BYTES'], "gc_interval": config['REPORT_GC_INTERVAL']}
+    if config['REPORT_STORE'] == "sqlite":
+        return SQLiteReportStore(os.path.join(config['UPLOAD_FOLDER'], "reports.sqlite3"), **options)
+    return FileSystemReportStore(os.path.join(config['UPLOAD_FOLDER'], "reports"), **options)
+
+# --- Local Nutrition Engine ---
+# BMI, Mifflin-St Jeor calories and the Dietary Reference Intakes are deterministic functions of the
+# profile, so they are computed here and filled into the report. The model only writes food sources
+# and advice, and a locally built report stands in when the model is unavailable.
+LOCAL_ENGINE_MIN_AGE = 14  # Mifflin-St Jeor and the adult DRI bands below are not meant for younger children.
+
+ACTIVITY_FACTORS = {
+    "sedentary": 1.2,
+    "lightly active": 1.375,
+    "moderately active": 1.55,
+    "very active": 1.725,
+    "extremely active": 1.9,
+}
+MIFFLIN_SEX_CONSTANTS = {"male": 5, "female": -161, "other": -78}
+# Extra energy for the second trimester and the first six months of lactation.
+LIFE_STAGE_EXTRA_KCAL = {"pregnant": 340, "lactating": 330}
+
+DRI_AGE_BANDS = (14, 19, 31, 51, 71)
+DRI_COLUMNS = (
+    [("male", band) for band in DRI_AGE_BANDS]
+    + [("female", band) for band in DRI_AGE_BANDS]
+    + [("pregnant", band) for band in DRI_AGE_BANDS[:3]]
+    + [("lactating", band) for band in DRI_AGE_BANDS[:3]]
+)
+# Daily RDA/AI values (Institute of Medicine / NASEM) per template label, in DRI_COLUMNS order:
+# male 14-18, 19-30, 31-50, 51-70, 71+ | female (same bands) | pregnancy <=18, 19-30, 31-50 | lactation (same).
+DRI_ROWS = {
+    "Vitamin A (retinol/carotenoids)": ("mcg RAE", (900, 900, 900, 900, 900, 700, 700, 700, 700, 700, 750, 770, 770, 1200, 1300, 1300)),
+    "B1 (Thiamine)": ("mg", (1.2, 1.2, 1.2, 1.2, 1.2, 1.0, 1.1, 1.1, 1.1, 1.1, 1.4, 1.4, 1.4, 1.4, 1.4, 1.4)),
+    "B2 (Riboflavin)": ("mg", (1.3, 1.3, 1.3, 1.3, 1.3, 1.0, 1.1, 1.1, 1.1, 1.1, 1.4, 1.4, 1.4, 1.6, 1.6, 1.6)),
+    "B3 (Niacin)": ("mg NE", (16, 16, 16, 16, 16, 14, 14, 14, 14, 14, 18, 18, 18, 17, 17, 17)),
+    "B5 (Pantothenic Acid)": ("mg", (5, 5, 5, 5, 5, 5, 5, 5, 5, 5, 6, 6, 6, 7, 7, 7)),
+    "B6 (Pyridoxine)": ("mg", (1.3, 1.3, 1.3, 1.7, 1.7, 1.2, 1.3, 1.3, 1.5, 1.5, 1.9, 1.9, 1.9, 2.0, 2.0, 2.0)),
+    "B7 (Biotin)": ("mcg", (25, 30, 30, 30, 30, 25, 30, 30, 30, 30, 30, 30, 30, 35, 35, 35)),
+    "B9 (Folate)": ("mcg DFE", (400, 400, 400, 400, 400, 400, 400, 400, 400, 400, 600, 600, 600, 500, 500, 500)),
+    "B12 (Cobalamin)": ("mcg", (2.4, 2.4, 2.4, 2.4, 2.4, 2.4, 2.4, 2.4, 2.4, 2.4, 2.6, 2.6, 2.6, 2.8, 2.8, 2.8)),
+    "Vitamin C (ascorbic acid)": ("mg", (75, 90, 90, 90, 90, 65, 75, 75, 75, 75, 80, 85, 85, 115, 120, 120)),
+    "Vitamin D (calciferol)": ("IU", (600, 600, 600, 600, 800, 600, 600, 600, 600, 800, 600, 600, 600, 600, 600, 600)),
+    "Vitamin E (tocopherol)": ("mg", (15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 15, 19, 19, 19)),
+    "Vitamin K (phylloquinone/menaquinone)": ("mcg", (75, 120, 120, 120, 120, 75, 90, 90, 90, 90, 75, 90, 90, 75, 90, 90)),
+    "Calcium": ("mg", (1300, 1000, 1000, 1000, 1200, 1300, 1000, 1000, 1200, 1200, 1300, 1000, 1000, 1300, 1000, 1000)),
+    "Phosphorus": ("mg", (1250, 700, 700, 700, 700, 1250, 700, 700, 700, 700, 1250, 700, 700, 1250, 700, 700)),
+    "Potassium": ("mg", (3000, 3400, 3400, 3400, 3400, 2300, 2600, 2600, 2600, 2600, 2600, 2900, 2900, 2500, 2800, 2800)),
+    "Magnesium": ("mg", (410, 400, 420, 420, 420, 360, 310, 320, 320, 320, 400, 350, 360, 360, 310, 320)),
+    "Iron": ("mg", (11, 8, 8, 8, 8, 15, 18, 18, 8, 8, 27, 27, 27, 10, 9, 9)),
+    "Zinc": ("mg", (11, 11, 11, 11, 11, 9, 8, 8, 8, 8, 12, 11, 11, 13, 12, 12)),
+    "Sodium": ("mg", (2300, 2300, 2300, 2300, 2300, 2300, 2300, 2300, 2300, 2300, 2300, 2300, 2300, 2300, 2300, 2300)),
+    "Chloride": ("g", (2.3, 2.3, 2.3, 2.0, 1.8, 2.3, 2.3, 2.3, 2.0, 1.8, 2.3, 2.3, 2.3, 2.3, 2.3, 2.3)),
+    "Copper": ("mcg", (890, 900, 900, 900, 900, 890, 900, 900, 900, 900, 1000, 1000, 1000, 1300, 1300, 1300)),
+    "Manganese": ("mg", (2.2, 2.3, 2.3, 2.3, 2.3, 1.6, 1.8, 1.8, 1.8, 1.8, 2.0, 2.0, 2.0, 2.6, 2.6, 2.6)),
+    "Selenium": ("mcg", (55, 55, 55, 55, 55, 55, 55, 55, 55, 55, 60, 60, 60, 70, 70, 70)),
+    "Iodine": ("mcg", (150, 150, 150, 150, 150, 150, 150, 150, 150, 150, 220, 220, 220, 290, 290, 290)),
+    "Chromium": ("mcg", (35, 35, 35, 30, 30, 24, 25, 25, 20, 20, 29, 30, 30, 44, 45, 45)),
+    "Molybdenum": ("mcg", (43, 45, 45, 45, 45, 43, 45, 45, 45, 45, 50, 50, 50, 50, 50, 50)),
+    "Fluoride": ("mg", (3, 4, 4, 4, 4, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3)),
+    "Linoleic acid (LA) Omega-6": ("g", (16, 17, 17, 14, 14, 11, 12, 12, 11, 11, 13, 13, 13, 13, 13, 13)),
+    "α-Linolenic acid (ALA) Omega-3": ("g", (1.6, 1.6, 1.6, 1.6, 1.6, 1.1, 1.1, 1.1, 1.1, 1.1, 1.4, 1.4, 1.4, 1.3, 1.3, 1.3)),
+    "Water": ("L", (3.3, 3.7, 3.7, 3.7, 3.7, 2.3, 2.7, 2.7, 2.7, 2.7, 3.0, 3.0, 3.0, 3.8, 3.8, 3.8)),
+    "protein_g_per_kg": ("g/kg", (0.85, 0.8, 0.8, 0.8, 0.8, 0.85, 0.8, 0.8, 0.8, 0.8, 1.1, 1.1, 1.1, 1.1, 1.1, 1.1)),
+}
+# Upper limits rather than intake targets.
+DRI_LIMIT_LABELS = {"Sodium"}
+
+# Adult indispensable amino acid requirements in mg/kg/day (WHO/FAO/UNU 2007).
+AMINO_ACID_MG_PER_KG = {
+    "Histidine (H)": 10,
+    "Isoleucine (I)": 20,
+    "Leucine (L)": 39,
+    "Lysine (K)": 30,
+    "Methionine (M)": 10.4,
+    "Phenylalanine (F)": 25,  # combined with tyrosine
+    "Threonine (T)": 15,
+    "Tryptophan (W)": 4,
+    "Valine (V)": 26,
+}
+
+def _build_dri_tables() -> dict:
+    """Indexes DRI_ROWS by (life stage or sex, age band); "other" takes the higher of the two sexes."""
+    tables = {column: {label: values[i] for label, (unit, values) in DRI_ROWS.items()}
+              for i, column in enumerate(DRI_COLUMNS)}
+    for band in DRI_AGE_BANDS:
+        tables[("other", band)] = {label: max(tables[("male", band)][label], tables[("female", band)][label])
+                                   for label in DRI_ROWS}
+    return tables
+
+DRI_TABLES = _build_dri_tables()
+
+Profile = namedtuple("Profile", "age sex height_cm weight_kg activity life_stage")
+
+def parse_profile(prompt_data: dict):
+    """Returns a Profile when the form data is complete enough to compute metrics locally, else None."""
+    try:
+        age = int(float(prompt_data.get("age")))
+        height_cm = round(float(prompt_data.get("height")), 1)
+        weight_kg = round(float(prompt_data.get("weight")), 1)
+    except (TypeError, ValueError):
+        return None
+    sex = str(prompt_data.get("gender", "")).strip().lower()
+    activity = str(prompt_data.get("activity_level", "")).strip().lower()
+    life_stage = str(prompt_data.get("pregnancy_or_lactation", "None")).strip().lower()
+    if (not LOCAL_ENGINE_MIN_AGE <= age <= 120 or not 100 <= height_cm <= 250 or not 25 <= weight_kg <= 350
+            or sex not in MIFFLIN_SEX_CONSTANTS or activity not in ACTIVITY_FACTORS):
+        return None
+    if life_stage not in LIFE_STAGE_EXTRA_KCAL or sex == "male":
+        life_stage = None
+    return Profile(age, sex, height_cm, weight_kg, activity, life_stage)
+
+def _format_number(value) -> str:
+    return f"{value:,.1f}".rstrip("0").rstrip(".") if isinstance(value, float) else f"{value:,}"
+
+def _bmi_category(bmi: float) -> str:
+    if bmi < 18.5:
+        return "Underweight"
+    if bmi < 25:
+        return "Normal weight"
+    if bmi < 30:
+        return "Overweight"
+    return "Obesity"
+
+@lru_cache(maxsize=4096)
+def compute_local_values(profile: Profile) -> dict:
+    """Maps OUTPUT_FORMAT labels to their computed values for the given profile."""
+    band = DRI_AGE_BANDS[bisect.bisect_right(DRI_AGE_BANDS, profile.age) - 1]
+    if profile.life_stage:
+        dri = DRI_TABLES[(profile.life_stage, min(band, DRI_AGE_BANDS[2]))]
+    else:
+        dri = DRI_TABLES[(profile.sex, band)]
+    weight = profile.weight_kg
+
+    bmi = weight / (profile.height_cm / 100) ** 2
+    bmr = 10 * weight + 6.25 * profile.height_cm - 5 * profile.age + MIFFLIN_SEX_CONSTANTS[profile.sex]
+    calories = bmr * ACTIVITY_FACTORS[profile.activity] + LIFE_STAGE_EXTRA_KCAL.get(profile.life_stage, 0)
+    low_kcal, high_kcal = (int(round(calories * factor / 50) * 50) for factor in (0.95, 1.05))
+
+    values = {
+        "BMI": f"{bmi:.1f} kg/m² ({_bmi_category(bmi)})",
+        "Estimated Daily Calories": f"{low_kcal:,}-{high_kcal:,} kcal (maintenance)",
+        "1. Carbohydrates": f"45-65% of daily calories ({round(low_kcal * 0.45 / 4)}-{round(high_kcal * 0.65 / 4)} g)",
+        "2. Proteins": f"{'10-30' if band < 19 else '10-35'}% of daily calories | {_format_number(dri['protein_g_per_kg'])} g/kg "
+                       f"({round(dri['protein_g_per_kg'] * weight)} g/day)",
+        "3. Fats": f"{'25-35' if band < 19 else '20-35'}% of daily calories ({round(low_kcal * 0.20 / 9)}-{round(high_kcal * 0.35 / 9)} g)",
+        "Saturated Fatty Acids (SFAs)": f"Limit to <10% of daily calories (< {round(calories * 0.10 / 9)} g)",
+        "Fiber": f"{round(calories * 14 / 1000)} g",
+        "Water": f"{_format_number(dri['Water'])} L (about {round(dri['Water'] * 1000 / 240)} glasses)",
+    }
+    for label, mg_per_kg in AMINO_ACID_MG_PER_KG.items():
+        values[label] = f"{_format_number(mg_per_kg)} mg/kg ({round(mg_per_kg * weight):,} mg/day)"
+    for label, (unit, _) in DRI_ROWS.items():
+        if label in values or label == "protein_g_per_kg":
+            continue
+        prefix = "< " if label in DRI_LIMIT_LABELS else ""
+        values[label] = f"{prefix}{_format_number(dri[label])} {unit}"
+    return values
+
+def local_values_for(prompt_data: dict):
+    """Computed report values for the request, or None when the engine is disabled or cannot apply."""
+    if not current_app.config['LOCAL_NUTRITION_ENGINE']:
+        return None
+    profile = parse_profile(prompt_data)
+    return compute_local_values(profile) if profile else None
+
+
+TemplateLine = namedtuple("TemplateLine", "text head label placeholder tail")
+
+_TEMPLATE_LABEL_PATTERN = re.compile(r"(\s*(?:-\s+)?(?:\*\*)?)([^:*\[\]\n]+?)(:(?:\*\*)?)")
+_PLACEHOLDER_PATTERN = re.compile(r"\s*\[([^\]]*)\]")
+NUTRITIONIST_OUTPUT_FORMAT = SYSTEM_INSTRUCTION_NUTRITIONIST.split("## OUTPUT_FORMAT\n---\n", 1)[1].strip("\n") + "\n"
+
+def _parse_template_line(line: str) -> TemplateLine:
+    match = _TEMPLATE_LABEL_PATTERN.match(line)
+    if not match:
+        return TemplateLine(line, None, None, None, None)
+    placeholder = _PLACEHOLDER_PATTERN.match(line, match.end())
+    if not placeholder:
+        return TemplateLine(line, match.group(0), match.group(2).strip(), None, line[match.end():])
+    return TemplateLine(line, match.group(0), match.group(2).strip(), placeholder.group(1), line[placeholder.end():])
+
+TEMPLATE_LINES = [_parse_template_line(line) for line in NUTRITIONIST_OUTPUT_FORMAT.split("\n")]
+
+def _section_title(line: str):
+    """The case-folded title when `line` opens a top-level section ("**Micronutrients:**"), else None."""
+    match = _TEMPLATE_LABEL_PATTERN.match(line) if line.startswith("**") else None
+    return match.group(2).strip().casefold() if match else None
+
+def _template_positions() -> set:
+    positions, section = set(), None
+    for line in TEMPLATE_LINES:
+        section = _section_title(line.text) or section
+        if line.label:
+            positions.add((section, line.label))
+    return positions
+
+# (section, label) of every labelled template line: a label is only filled in the section it belongs to.
+TEMPLATE_POSITIONS = _template_positions()
+TEMPLATE_SECTIONS = {section for section, _ in TEMPLATE_POSITIONS}
+# Lines the engine writes on its own, ahead of the model's output.
+LOCAL_HEADER_LABELS = ("BMI", "Estimated Daily Calories")
+
+def _model_template() -> str:
+    """OUTPUT_FORMAT without the quantities the engine computes, leaving sources and advice to the model."""
+    example = compute_local_values(Profile(30, "male", 175.0, 70.0, "sedentary", None))
+    lines = []
+    for line in TEMPLATE_LINES:
+        if line.label in LOCAL_HEADER_LABELS:
+            continue
+        lines.append(f"{line.head}{line.tail}" if line.label in example and line.placeholder is not None else line.text)
+    return "\n".join(lines).lstrip("\n")
+
+SYSTEM_INSTRUCTION_NUTRITIONIST_LOCAL = """
+You are a world-class AI Nutritionist and Dietitian. Your primary function is to complete a personalized nutritional report based on the user's provided data. BMI, daily calories and every quantitative intake target have already been calculated and will be inserted after the label of each line by the application.
+
+**ANALYSIS INSTRUCTIONS:**
+1.  **Analyze User Profile:** Carefully consider the user's age, gender, height, weight, activity level, dietary preferences, and any specified health conditions.
+2.  **Provide Specific Sources and Advice:** For every nutrient listed below, provide a list of common, healthy food sources tailored to the user's dietary preferences, and fill in every remaining placeholder.
+3.  **Do Not Add Quantities:** Where a line has no placeholder between its label and the `|` separator, leave that space empty; do not write intake amounts.
+
+**CRITICAL FORMATTING RULE:**
+You MUST adhere to the following `OUTPUT_FORMAT` with **exact precision**. Preserve every heading, indentation, bullet point, numbering, and placeholder. The use of the `| Sources:` separator for every nutrient is mandatory. Do not add any introductory or concluding paragraphs, disclaimers, or conversational text outside of this strict structure.
+
+---
+## OUTPUT_FORMAT
+---
+
+""" + _model_template()
+
+# Generic text for placeholders that carry no usable example when the report is built without the model.
+FALLBACK_PLACEHOLDER_TEXT = {
+    "Provide general statement.": "Complex carbohydrates that provide slow-release energy.",
+    "Provide a tip about diet diversity.": "Eat a wide variety of vegetables, fruits, whole grains, legumes and proteins across the week.",
+    "Provide a tip about mindful eating and portion control.": "Eat slowly, stop when comfortably full and use smaller plates to keep portions in check.",
+    "Provide a tip about limiting processed foods, added sugars, and unhealthy fats.": "Cook from whole ingredients and keep sugary drinks, sweets and fried foods occasional.",
+}
+FALLBACK_DIET_TIP = "Choose the food sources above that fit your dietary preferences, and ask a dietitian about supplements if any group is excluded."
+
+def _fallback_placeholder(placeholder: str) -> str:
+    if placeholder in FALLBACK_PLACEHOLDER_TEXT:
+        return FALLBACK_PLACEHOLDER_TEXT[placeholder]
+    if "For a Vegan" in placeholder:
+        return FALLBACK_DIET_TIP
+    return placeholder.split("e.g.,", 1)[-1].strip().strip('"')
+
+def local_report_header(values: dict) -> str:
+    return "".join(f"**{label}:** {values[label]}\n" for label in LOCAL_HEADER_LABELS) + "\n"
+
+def local_fallback_report(values: dict, health_condition: str = "None") -> str:
+    """Builds the full report from computed values and the template's example sources and advice."""
+    lines = []
+    for line in TEMPLATE_LINES:
+        if line.label in LOCAL_HEADER_LABELS:
+            continue
+        if line.text.lstrip().startswith("#"):
+            if "EXAMPLE START" in line.text:
+                indent = line.text[:len(line.text) - len(line.text.lstrip())]
+                if health_condition.strip().lower() in ("", "none", "n/a"):
+                    lines.append(f"{indent}No specific health conditions were listed. Focus on general wellness by "
+                                 "maintaining a balanced diet, staying hydrated, and engaging in regular physical activity.")
+                else:
+                    lines.append(f"{indent}Personalized guidance for {health_condition} is unavailable right now; "
+                                 "please review these targets with your doctor or a registered dietitian.")
+            continue
+        tail = _PLACEHOLDER_PATTERN.sub(lambda m: " " + _fallback_placeholder(m.group(1)), line.tail or "")
+        if line.label in values:
+            lines.append(f"{line.head} {values[line.label]}{tail}")
+        elif line.placeholder is not None:
+            lines.append(f"{line.head} {_fallback_placeholder(line.placeholder)}{tail}")
+        elif line.head is None:
+            lines.append(re.sub(r"\[([^\]]*)\]", lambda m: _fallback_placeholder(m.group(1)), line.text))
+        else:
+            lines.append(f"{line.head}{tail}")
+    return local_report_header(values) + "\n".join(lines).lstrip("\n")
+
+
+class LocalValueFiller:
+    """
+    Incrementally inserts computed values into the model's report text. Text is emitted line by
+    line; a line whose label has a computed value, in the section where the template puts that
+    label, gets the value after the label, replacing anything the model wrote there. The same
+    label elsewhere (e.g. "**Sodium:**" in the advice) is left as the model wrote it.
+    """
+    _TAILED_LABELS = {line.label for line in TEMPLATE_LINES if line.label and line.tail and "|" in line.tail}
+
+    def __init__(self, values: dict):
+        self.values = values
+        self._buffer = ""
+        self._section = None
+
+    def header(self) -> str:
+        return local_report_header(self.values)
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        if "\n" not in self._buffer:
+            return ""
+        complete, self._buffer = self._buffer.rsplit("\n", 1)
+        return "".join(self._fill(line) + "\n" for line in complete.split("\n"))
+
+    def close(self) -> str:
+        remainder, self._buffer = self._buffer, ""
+        return self._fill(remainder) if remainder else ""
+
+    def _fill(self, line: str) -> str:
+        title = _section_title(line)
+        if title in TEMPLATE_SECTIONS:
+            self._section = title
+        match = _TEMPLATE_LABEL_PATTERN.match(line)
+        if not match:
+            return line
+        label = match.group(2).strip()
+        value = self.values.get(label)
+        if value is None or label in LOCAL_HEADER_LABELS or (self._section, label) not in TEMPLATE_POSITIONS:
+            return line
+        rest = line[match.end():]
+        tail = ""
+        if label in self._TAILED_LABELS and "|" in rest:
+            tail = " |" + rest.split("|", 1)[1]
+        return f"{match.group(0)} {value}{tail}"
+
+# --- Report Rendering ---
+# The report model, parser and renderers are in reports.py, which the cohort render processes load
+# without this module; the wrappers here time the renders into the metrics.
+@timed("render_html")
+def render_report_html(report: Report) -> str:
+    return reports.render_report_html(report)
+
+def format_recommendations_to_html(text: str) -> str:
+    """Converts a complete AI report into HTML cards. Thin wrapper around the parser and renderer."""
+    return render_report_html(parse_report(text))
+
+@timed("render_docx")
+def _convert_report_to_docx(report: Report) -> bytes:
+    return report_to_docx(report)
+
+@timed("render_pdf")
+def _convert_report_to_pdf(report: Report) -> bytes:
+    return report_to_pdf(report, resources)
+
+
+@bp.route('/')
+def index():
+    return render_template('index.html')
+
+def _build_prompt_data(data) -> dict:
+    return {
+        "age": data.get("age", "N/A"),
+        "gender": data.get("gender", "N/A"),
+        "height": data.get("height", "N/A"),
+        "weight": data.get("weight", "N/A"),
+        "activity_level": data.get("activity_level", "N/A"),
+        "pregnancy_or_lactation": data.get("pregnancy_or_lactation", "None"),
+        "health_condition": data.get("health_condition", "None"),
+        "dietary_preferences": data.get("dietary_preferences", "N/A"),
+    }
+
+def _nutritionist_instruction(prompt_data: dict) -> str:
+    return SYSTEM_INSTRUCTION_NUTRITIONIST if local_values_for(prompt_data) is None else SYSTEM_INSTRUCTION_NUTRITIONIST_LOCAL
+
+def _recommendation_cache_key(prompt_data: dict) -> str:
+    return _response_cache_key(
+        _nutritionist_instruction(prompt_data),
+        NUTRITIONIST_TEMPERATURE,
+        {key: _normalize_profile_value(value) for key, value in prompt_data.items()},
+    )
+
+def _model_request(system_instruction: str, temperature: float, prompt_text: str) -> dict:
+    """Builds the keyword arguments for a generate_content_stream call (sync or async client)."""
+    from google.genai import types
+    contents = [types.Content(role="user", parts=[types.Part.from_text(text=prompt_text)])]
+
+    config = types.GenerateContentConfig(
+        system_instruction=system_instruction,
+        temperature=temperature,
+        response_mime_type="text/plain",
+    )
+    return {"model": MODEL_NAME, "contents": contents, "config": config}
+
+def _recommendation_request(prompt_data: dict) -> dict:
+    prompt_text = "\n".join([f"{key.replace('_', ' ').title()}: {value}" for key, value in prompt_data.items()])
+    return _model_request(_nutritionist_instruction(prompt_data), NUTRITIONIST_TEMPERATURE, prompt_text)
+
+def _comparison_request(foods) -> dict:
+    food_list = f"{', '.join(foods[:-1])} and {foods[-1]}" if len(foods) > 1 else foods[0]
+    return _model_request(SYSTEM_INSTRUCTION_FOOD_COMPARISON, COMPARISON_TEMPERATURE, f"Compare {food_list}")
+
+def _stream_recommendation_text(prompt_data: dict):
+    """
+    Yields the report text chunk by chunk as it is generated. With the local engine the computed
+    header comes first, before the model is called, and computed values are filled into its lines.
+    """
+    local_values = local_values_for(prompt_data)
+    if local_values is None:
+        yield from model_gateway.stream_text(_recommendation_request(prompt_data))
+        return
+
+    filler = LocalValueFiller(local_values)
+    yield filler.header()
+    received_model_text = False
+    for chunk_text in model_gateway.stream_text(_recommendation_request(prompt_data)):
+        received_model_text = True
+        text = filler.feed(chunk_text)
+        if text:
+            yield text
+    if not received_model_text:
+        raise ValueError("AI returned an empty response.")
+    yield filler.close()
+
+def _cache_recommendation(cache_key: str, response_text: str):
+    if response_text:
+        recommendation_cache.set(cache_key, response_text)
+
+def _coalesced_recommendation_text(prompt_data: dict, cache_key: str):
+    """Report chunks for the profile, shared with any identical request already generating it."""
+    return recommendation_flights.stream(
+        cache_key, lambda: _stream_recommendation_text(prompt_data),
+        on_complete=lambda response_text: _cache_recommendation(cache_key, response_text),
+        lookup=lambda: recommendation_cache.get(cache_key))
+
+def _fallback_report_text(prompt_data: dict, received_text: str = ""):
+    """
+    The rest of a locally built report when the model fails, given the text already sent, or None
+    when there is no local report or the model had already produced part of the response.
+    """
+    local_values = local_values_for(prompt_data)
+    if local_values is None:
+        return None
+    fallback_text = local_fallback_report(local_values, str(prompt_data.get("health_condition", "None")))
+    if not fallback_text.startswith(received_text):
+        return None
+    return fallback_text[len(received_text):]
+
+def _recommendation_report_text(prompt_data: dict, cache_key: str, before_model_call=None):
+    """
+    Returns (report text, fallback) for a profile: from the cache, else generated (shared with any
+    identical request in flight), else the locally computed report when the model fails.
+    `before_model_call` runs only when the model is about to be asked, e.g. to pace batch jobs.
+    """
+    response_text = recommendation_cache.get(cache_key)
+    if response_text is not None:
+        logging.info("Serving nutrient recommendations from cache.")
+        return response_text, False
+    if before_model_call is not None:
+        before_model_call()
+    try:
+        with timed("generate"):
+            response_text = "".join(_coalesced_recommendation_text(prompt_data, cache_key))
+        if not response_text:
+            raise ValueError("AI returned an empty response.")
+        return response_text, False
+    except Exception as e:
+        response_text = _fallback_report_text(prompt_data)
+        if response_text is None:
+            raise
+        logging.warning(f"Model request failed, serving the locally computed report: {e}")
+        return response_text, True
+
+@timed("parse")
+def _report_model_for_text(response_text: str) -> "Report":
+    """Parses report text into its tree, reusing the cached tree for text we have already seen."""
+    digest = _text_digest(response_text)
+    report = report_model_cache.get(digest)
+    if report is None:
+        report = parse_report(response_text)
+        report_model_cache.set(digest, report)
+    return report
+
+@timed("save")
+def _save_report(response_text: str, report=None) -> str:
+    """Persists the report text and its parsed tree, and returns the download token."""
+    token = new_report_token()
+    digest = _text_digest(response_text)
+    if report is None:
+        report = parse_report(response_text)
+    report_model_cache.set(digest, report)
+    report_store.save_report(token, response_text)
+    report_store.put_artifact(token, f"{digest[:16]}.json", report.to_json().encode('utf-8'))
+
+    if current_app.config['PRERENDER_PDF']:
+        pdf_executor.submit(copy_context().run, _prerender_report_pdf, token)
+    return token
+
+@bp.route('/get_nutrient_recommendations', methods=['POST'])
+def nutrient_recommendations():
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid request body"}), 400
+
+    prompt_data = _build_prompt_data(data)
+    cache_key = _recommendation_cache_key(prompt_data)
+
+    try:
+        response_text, fallback = _recommendation_report_text(prompt_data, cache_key)
+        report = _report_model_for_text(response_text)
+        download_token = _save_report(response_text, report)
+        formatted_html = render_report_html(report)
+
+        return jsonify({
+            'recommendations': formatted_html,
+            'download_token': download_token,
+            'fallback': fallback
+        })
+
+    except ModelUnavailableError as e:
+        logging.warning(f"Recommendation request failed, model unavailable: {e}")
+        return _model_unavailable_response()
+    except Exception as e:
+        logging.error(f"Error in recommendation endpoint: {e}", exc_info=True)
+        return jsonify({"error": f"An internal server error occurred: {e}"}), 500
+
+@bp.route('/stream_nutrient_recommendations', methods=['POST'])
+def stream_nutrient_recommendations():
+    """
+    Streams the report as newline-delimited JSON: one {"type": "card"} event per finished
+    top-level section, then a {"type": "done"} event carrying the download token.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid request body"}), 400
+
+    prompt_data = _build_prompt_data(data)
+    cache_key = _recommendation_cache_key(prompt_data)
+
+    def events():
+        received = []
+        formatter = RecommendationHTMLFormatter()
+
+        def card_events(chunks):
+            for chunk in chunks:
+                received.append(chunk)
+                for card_html in formatter.feed(chunk):
+                    yield json.dumps({"type": "card", "html": card_html}) + "\n"
+
+        try:
+            fallback = False
+            cached_text = recommendation_cache.get(cache_key)
+            if cached_text is not None:
+                logging.info("Serving streamed nutrient recommendations from cache.")
+                yield from card_events([cached_text])
+            else:
+                try:
+                    yield from card_events(_coalesced_recommendation_text(prompt_data, cache_key))
+                    if not "".join(received):
+                        raise ValueError("AI returned an empty response.")
+                except Exception as e:
+                    fallback_text = _fallback_report_text(prompt_data, "".join(received))
+                    if fallback_text is None:
+                        raise
+                    logging.warning(f"Model stream failed, finishing with the locally computed report: {e}")
+                    fallback = True
+                    yield from card_events([fallback_text])
+            for card_html in formatter.close():
+                yield json.dumps({"type": "card", "html": card_html}) + "\n"
+
+            response_text = "".join(received)
+            download_token = _save_report(response_text, formatter.report)
+            yield json.dumps({"type": "done", "download_token": download_token, "fallback": fallback}) + "\n"
+
+        except Exception as e:
+            logging.error(f"Error in streaming recommendation endpoint: {e}", exc_info=True)
+            yield json.dumps({"type": "error", "error": f"An internal server error occurred: {e}"}) + "\n"
+
+    return Response(stream_with_context(events()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --- Food Comparison Cache ---
+# Comparison tables are cached under the sorted, normalized food names, with columns stored in
+# that canonical order, so "Apples"/"banana" and "Banana"/"apple" share one entry.
+def extract_comparison_table(text: str):
+    """Returns just the HTML table from the model's output, or None if it contains no table."""
+    # Remove markdown fences and surrounding whitespace
+    cleaned_text = text.strip().removeprefix('```html').removesuffix('```').strip()
+
+    # Use regex to find the table, which is more robust
+    table_match = re.search(r'(<table.*?>.*?</table\s*>)', cleaned_text, re.DOTALL | re.IGNORECASE)
+    return table_match.group(1) if table_match else None
+
+COMPARISON_ERROR_HTML = """
+        <div class="no-data error">
+            <i class="fas fa-exclamation-triangle"></i>
+            <h3>Comparison Error</h3>
+            <p>The AI model returned data in an unexpected format. Please try your query again.</p>
+        </div>
+        """
+
+class ComparisonFormatError(ValueError):
+    """Raised when the model's comparison table does not have the expected food columns."""
+
+
+def format_comparison(text: str) -> str:
+    """
+    Cleans the model's output to extract just the HTML table for crop comparison.
+    Handles cases where the model might still include markdown fences or explanatory text.
+    """
+    table = extract_comparison_table(text)
+    if table is not None:
+        # If a table is found, return it directly. This is the ideal case.
+        return table
+    else:
+        # Fallback for unexpected format: return a formatted error.
+        logging.warning(f"Comparison format error. AI output was: {text}")
+        return COMPARISON_ERROR_HTML
+
+COMPARISON_LOG_PREFIX = "Comparison request: "
+_COMPARISON_LOG_PATTERN = re.compile(re.escape(COMPARISON_LOG_PREFIX) + r"(\[.*\])\s*$")
+# Plural endings and their singular; any other final "s" is dropped unless the word ends in "ss" or "us".
+_PLURAL_SUFFIXES = (("ies", "y"), ("oes", "o"), ("sses", "ss"), ("ches", "ch"), ("shes", "sh"), ("xes", "x"))
+# Last words the suffix rules would get wrong: singular names that end in "s", and plurals of "-ie"/"-che" words.
+_PLURAL_EXCEPTIONS = {
+    "molasses": "molasses", "grits": "grits", "ananas": "ananas",
+    "cookies": "cookie", "brownies": "brownie", "smoothies": "smoothie", "veggies": "veggie",
+    "quiches": "quiche", "brioches": "brioche",
+}
+
+@lru_cache(maxsize=4096)
+def normalize_food_name(name: str) -> str:
+    """Canonical food name for cache keys: NFKC, casefolded, single-spaced, last word singularized."""
+    words = unicodedata.normalize("NFKC", str(name)).casefold().replace("_", " ").split()
+    if not words:
+        return ""
+    last = words[-1].strip(".,;:!?")
+    if last in _PLURAL_EXCEPTIONS:
+        return " ".join(words[:-1] + [_PLURAL_EXCEPTIONS[last]])
+    for suffix, replacement in _PLURAL_SUFFIXES:
+        if last.endswith(suffix) and len(last) > len(suffix) + 1:
+            last = last[:-len(suffix)] + replacement
+            break
+    else:
+        if last.endswith("s") and not last.endswith(("ss", "us")) and len(last) > 3:
+            last = last[:-1]
+    return " ".join(words[:-1] + [last])
+
+def _comparison_cache_key(normalized_names) -> str:
+    return _response_cache_key(SYSTEM_INSTRUCTION_FOOD_COMPARISON, COMPARISON_TEMPERATURE, sorted(normalized_names))
+
+def _column_order(source_names, target_names) -> tuple:
+    """For each position in target_names, the index of the same food in source_names."""
+    remaining = list(enumerate(source_names))
+    order = []
+    for name in target_names:
+        position = next(i for i, (_, source) in enumerate(remaining) if source == name)
+        order.append(remaining.pop(position)[0])
+    return tuple(order)
+
+_TABLE_ROW_PATTERN = re.compile(r"<tr\b.*?</tr\s*>", re.DOTALL | re.IGNORECASE)
+_TABLE_CELL_PATTERN = re.compile(r"<(t[hd])\b[^>]*>.*?</\1\s*>", re.DOTALL | re.IGNORECASE)
+
+def has_food_columns(table_html: str, food_count: int) -> bool:
+    """Whether the table has a header and body rows, each with a metric cell and `food_count` food cells."""
+    rows = _TABLE_ROW_PATTERN.findall(table_html)
+    return len(rows) >= 2 and all(len(_TABLE_CELL_PATTERN.findall(row)) == food_count + 1 for row in rows)
+
+@lru_cache(maxsize=1024)
+def reorder_table_columns(table_html: str, order: tuple) -> str:
+    """
+    Rearranges the food columns of a comparison table; the first (metric) column stays put.
+    Rows whose cell count does not match are left unchanged.
+    """
+    if order == tuple(range(len(order))):
+        return table_html
+
+    def reorder_row(row_match):
+        row = row_match.group(0)
+        cells = list(_TABLE_CELL_PATTERN.finditer(row))
+        if len(cells) != len(order) + 1:
+            return row
+        texts = [cell.group(0) for cell in cells]
+        reordered = texts[:1] + [texts[1 + i] for i in order]
+        parts, last_end = [], 0
+        for cell, text in zip(cells, reordered):
+            parts.append(row[last_end:cell.start()])
+            parts.append(text)
+            last_end = cell.end()
+        parts.append(row[last_end:])
+        return "".join(parts)
+
+    return _TABLE_ROW_PATTERN.sub(reorder_row, table_html)
+
+_HEADER_CELL_PATTERN = re.compile(r"(<(t[hd])\b[^>]*>).*?(</\2\s*>)", re.DOTALL | re.IGNORECASE)
+
+@lru_cache(maxsize=1024)
+def label_table_columns(table_html: str, labels: tuple) -> str:
+    """
+    Writes `labels` (plain text) into the food header cells of a comparison table, the metric
+    header stays put. A table whose header row has a different number of cells is left unchanged.
+    """
+    header = _TABLE_ROW_PATTERN.search(table_html)
+    if header is None:
+        return table_html
+    cells = list(_HEADER_CELL_PATTERN.finditer(header.group(0)))
+    if len(cells) != len(labels) + 1:
+        return table_html
+    row = header.group(0)
+    parts, last_end = [], 0
+    for cell, label in zip(cells[1:], labels):
+        parts.append(row[last_end:cell.start()])
+        parts.append(f"{cell.group(1)}{html.escape(label.strip())}{cell.group(3)}")
+        last_end = cell.end()
+    parts.append(row[last_end:])
+    return table_html[:header.start()] + "".join(parts) + table_html[header.end():]
+
+def _table_for_foods(table_html: str, foods) -> str:
+    """A table in cache order, with its columns in the order and spelling of `foods`."""
+    names = [normalize_food_name(food) for food in foods]
+    return label_table_columns(reorder_table_columns(table_html, _column_order(sorted(names), names)), tuple(foods))
+
+def cached_comparison(foods):
+    """Returns the cached table with columns in the order and spelling of `foods`, or None."""
+    table = comparison_cache.get(_comparison_cache_key([normalize_food_name(food) for food in foods]))
+    if table is None:
+        return None
+    return _table_for_foods(table, foods)
+
+def store_comparison(foods, table_html: str):
+    """
+    Caches a table for this set of foods. Only tables generated in one model call belong here:
+    their "winner" marks compare the foods against each other, so columns cannot be mixed.
+    """
+    names = [normalize_food_name(food) for food in foods]
+    canonical_table = reorder_table_columns(table_html, _column_order(names, sorted(names)))
+    comparison_cache.set(_comparison_cache_key(names), canonical_table)
+
+def _canonical_foods(foods) -> list:
+    """The foods in cache order (sorted by normalized name)."""
+    return [food for _, food in sorted(zip((normalize_food_name(food) for food in foods), foods), key=lambda pair: pair[0])]
+
+@timed("compare")
+def coalesced_comparison(foods) -> str:
+    """
+    Generates the comparison once for all concurrent requests for the same foods, in any order:
+    the model is asked in cache order and each caller gets the columns in its own order.
+    """
+    names = [normalize_food_name(food) for food in foods]
+    key = _comparison_cache_key(names)
+    table = comparison_flights.call(key, lambda: _generate_comparison(_canonical_foods(foods)),
+                                    lookup=lambda: comparison_cache.get(key))
+    return _table_for_foods(table, foods)
+
+def _generate_comparison(foods) -> str:
+    """Asks the model for a comparison table and caches it when the output contains a table."""
+    raw_html_table = "".join(model_gateway.stream_text(_comparison_request(foods)))
+    table = extract_comparison_table(raw_html_table)
+    if table is None:
+        return format_comparison(raw_html_table)
+    store_comparison(foods, table)
+    return table
+
+def _comparison_table_from_output(foods, raw_text: str) -> str:
+    """
+    Validates a multi-food table from the model, caches it for the set and returns it.
+    Raises ComparisonFormatError when the table does not have one column per food.
+    """
+    table = extract_comparison_table(raw_text)
+    if table is None or not has_food_columns(table, len(foods)):
+        logging.warning(f"Comparison format error for {foods}. AI output was: {raw_text}")
+        raise ComparisonFormatError(f"Expected a table with {len(foods)} food columns.")
+    store_comparison(foods, table)
+    return table
+
+def _generate_batch_comparison(foods) -> str:
+    raw_text = "".join(model_gateway.stream_text(_comparison_request(foods)))
+    return _comparison_table_from_output(foods, raw_text)
+
+@timed("compare")
+def batch_comparison(foods) -> str:
+    """
+    One table comparing every food, generated in a single model call so that its "winner" marks
+    are decided across all of them. Shares the cache and in-flight generation of the same set.
+    """
+    table = cached_comparison(foods)
+    if table is not None:
+        return table
+    names = [normalize_food_name(food) for food in foods]
+    key = _comparison_cache_key(names)
+    table = comparison_flights.call(key, lambda: _generate_batch_comparison(_canonical_foods(foods)),
+                                    lookup=lambda: comparison_cache.get(key))
+    return _table_for_foods(table, foods)
+
+def popular_comparisons(log_lines, top: int):
+    """Counts comparison requests in log lines; returns [(foods, count)] for the `top` most common pairs."""
+    counts = Counter()
+    spellings = {}
+    for line in log_lines:
+        match = _COMPARISON_LOG_PATTERN.search(line)
+        if not match:
+            continue
+        try:
+            foods = json.loads(match.group(1))
+        except ValueError:
+            continue
+        key = tuple(sorted(normalize_food_name(food) for food in foods))
+        counts[key] += 1
+        spellings.setdefault(key, foods)
+    return [(spellings[key], count) for key, count in counts.most_common(top)]
+
+@bp.cli.command("warm-comparisons")
+@click.argument("log_files", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--top", default=200, show_default=True, help="Number of most requested pairs to precompute.")
+@click.option("--workers", default=4, show_default=True, help="Concurrent model requests.")
+def warm_comparisons_command(log_files, top, workers):
+    """Precomputes the most requested food comparisons from application logs into the cache."""
+    if not comparison_cache.db_path:
+        click.echo("Warning: RESPONSE_CACHE_DISK is off, so warmed entries only live in this process.", err=True)
+
+    def log_lines():
+        for path in log_files:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                yield from f
+
+    pending = [foods for foods, _ in popular_comparisons(log_lines(), top) if cached_comparison(foods) is None]
+    click.echo(f"{len(pending)} of the top {top} pairs need a model request.")
+    failures = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for foods, future in [(foods, executor.submit(copy_context().run, coalesced_comparison, foods)) for foods in pending]:
+            try:
+                future.result()
+            except Exception as e:
+                failures += 1
+                logging.warning(f"Could not warm comparison {foods}: {e}")
+    click.echo(f"Warmed {len(pending) - failures} comparisons ({failures} failed).")
+
+@bp.route('/compare_foods', methods=['POST'])
+def compare_foods():
+    data = request.get_json()
+    if not _valid_foods(data, 2, 2):
+        return jsonify({"error": "Please provide exactly two foods to compare."}), 400
+
+    foods = data['foods']
+    logging.info(COMPARISON_LOG_PREFIX + json.dumps(foods, ensure_ascii=False))
+
+    try:
+        clean_html_table = cached_comparison(foods)
+        if clean_html_table is None:
+            clean_html_table = coalesced_comparison(foods)
+
+        return jsonify({"comparison": clean_html_table})
+    except ModelUnavailableError as e:
+        logging.warning(f"Food comparison failed, model unavailable: {e}")
+        return _model_unavailable_response()
+    except Exception as e:
+        logging.error(f"Error in food comparison endpoint: {e}", exc_info=True)
+        return jsonify({"error": f"An internal server error occurred: {e}"}), 500
+
+def _valid_foods(data, minimum: int, maximum: int) -> bool:
+    """Whether the request body has a 'foods' list of `minimum` to `maximum` non-empty strings."""
+    foods = data.get('foods') if isinstance(data, dict) else None
+    return isinstance(foods, list) and minimum <= len(foods) <= maximum \
+        and all(isinstance(food, str) and food.strip() for food in foods)
+
+def _batch_foods_error(data):
+    """Returns an error message for an invalid batch request body, or None."""
+    limit = current_app.config['COMPARISON_BATCH_LIMIT']
+    if not _valid_foods(data, 2, limit):
+        return f"Please provide between 2 and {limit} foods to compare."
+    return None
+
+@bp.route('/compare_foods/batch', methods=['POST'])
+def compare_foods_batch():
+    """Compares up to COMPARISON_BATCH_LIMIT foods in one multi-column table."""
+    data = request.get_json()
+    error = _batch_foods_error(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    foods = data['foods']
+    logging.info(COMPARISON_LOG_PREFIX + json.dumps(foods, ensure_ascii=False))
+
+    try:
+        return jsonify({"comparison": batch_comparison(foods)})
+    except ComparisonFormatError:
+        return jsonify({"comparison": COMPARISON_ERROR_HTML})
+    except ModelUnavailableError as e:
+        logging.warning(f"Batch food comparison failed, model unavailable: {e}")
+        return _model_unavailable_response()
+    except Exception as e:
+        logging.error(f"Error in batch food comparison endpoint: {e}", exc_info=True)
+        return jsonify({"error": f"An internal server error occurred: {e}"}), 500
+
+# --- Report Export Cache ---
+REPORT_CONVERTERS = {"pdf": _convert_report_to_pdf, "docx": _convert_report_to_docx}
+
+# Striped locks so concurrent downloads of one report in a worker render it only once.
+_render_locks = [threading.Lock() for _ in range(32)]
+
+def _render_report_file(metadata, file_format="pdf"):
+    """
+    Returns the artifact for a stored report exported as `file_format`. Exports are memoized
+    in the report store under the report's content hash, so each is rendered once for every worker.
+    """
+    artifact_name = f"{metadata.digest[:16]}.{file_format}"
+    if artifact_name in metadata.artifacts:
+        return report_store.open_artifact(metadata.token, artifact_name)
+
+    with _render_locks[int(metadata.digest[:8], 16) % len(_render_locks)]:
+        # Another thread may have rendered it while we waited for the lock.
+        metadata = report_store.get_metadata(metadata.token) or metadata
+        if artifact_name not in metadata.artifacts:
+            report = _load_report_model(metadata)
+            if report is None:
+                return None
+            report_store.put_artifact(metadata.token, artifact_name, REPORT_CONVERTERS[file_format](report))
+    return report_store.open_artifact(metadata.token, artifact_name)
+
+def _read_artifact(artifact):
+    """Returns the artifact's bytes, or None if the report GC removed it after its metadata was read."""
+    if artifact is None:
+        return None
+    if isinstance(artifact, str):
+        try:
+            with open(artifact, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+    return artifact.read()
+
+def _load_report_model(metadata):
+    """
+    Returns the parsed tree of a stored report: from the in-process cache, else from the JSON
+    artifact written when the report was saved, parsing the text only as a last resort.
+    """
+    report = report_model_cache.get(metadata.digest)
+    if report is not None:
+        return report
+    json_name = f"{metadata.digest[:16]}.json"
+    if json_name in metadata.artifacts:
+        data = _read_artifact(report_store.open_artifact(metadata.token, json_name))
+        if data is None:
+            return None
+        report = Report.from_json(data.decode('utf-8'))
+    else:
+        report_text = report_store.load_report(metadata.token)
+        if report_text is None:
+            return None
+        report = parse_report(report_text)
+    report_model_cache.set(metadata.digest, report)
+    return report
+
+def _prerender_report_pdf(token):
+    try:
+        metadata = report_store.get_metadata(token)
+        if metadata is not None:
+            _render_report_file(metadata, "pdf")
+    except Exception as e:
+        logging.error(f"Background PDF rendering failed for {token}: {e}", exc_info=True)
+
+@bp.route('/download/<token>')
+def download_file(token):
+    """
+    Finds the report by its token and serves it as a PDF (or as DOCX with ?format=docx),
+    rendering each format only on its first request.
+    """
+    file_format = request.args.get('format', 'pdf')
+    if file_format not in REPORT_CONVERTERS:
+        abort(400, description="Unsupported report format.")
+    # Reject malformed tokens before touching storage.
+    metadata = report_store.get_metadata(token) if is_valid_report_token(token) else None
+    if metadata is None:
+        logging.warning(f"Download request for non-existent or expired token: {token}")
+        abort(404, description="Report not found or has expired.")
+    try:
+        artifact = _render_report_file(metadata, file_format)
+    except FileNotFoundError:
+        # The report GC removed the report between the index lookup and the render.
+        artifact = None
+    except Exception as e:
+        logging.error(f"Failed to generate {file_format.upper()} for token {token}: {e}", exc_info=True)
+        abort(500, description=f"An error occurred while generating the {file_format.upper()} report.")
+    if artifact is None:
+        abort(404, description="Report not found or has expired.")
+    download_name = f"NutriAI_Report_{datetime.fromtimestamp(metadata.created_at):%Y%m%d_%H%M%S}.{file_format}"
+    try:
+        return send_file(artifact, as_attachment=True, download_name=download_name,
+                         etag=f"{metadata.digest}-{file_format}", max_age=3600)
+    except FileNotFoundError:
+        abort(404, description="Report not found or has expired.")
+    except Exception as e:
+        logging.error(f"Failed to send {file_format.upper()} for token {token}: {e}", exc_info=True)
+        abort(500, description=f"An error occurred while generating the {file_format.upper()} report.")
+
+@bp.route('/reports/<token>')
+def report_json(token):
+    """Returns the report as structured JSON (sections and nutrient records) for API clients."""
+    metadata = report_store.get_metadata(token) if is_valid_report_token(token) else None
+    report = _load_report_model(metadata) if metadata else None
+    if report is None:
+        return jsonify({"error": "Report not found or has expired."}), 404
+    response = Response(report.to_json(), mimetype='application/json')
+    response.set_etag(metadata.digest)
+    return response.make_conditional(request)
+
+@bp.route('/stats')
+def stats():
+    """Cache and request-coalescing counters for this worker."""
+    return jsonify({
+        "caches": {"recommendations": recommendation_cache.stats(), "comparisons": comparison_cache.stats(),
+                   "report_models": report_model_cache.stats()},
+        "single_flight": {name: group.stats() for name, group in flight_groups.items()},
+        "model": model_gateway.stats(),
+        "startup_seconds": dict(startup_timings),
+    })
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of the metrics of every worker."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# --- Cohort Batch Jobs ---
+COHORT_INPUT_EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+COHORT_INPUT_MIMETYPES = {"text/csv": "csv", "application/x-ndjson": "jsonl", "application/jsonl": "jsonl"}
+COHORT_OUTPUT_EXTENSIONS = {".zip": "zip", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+# File formats rendered per profile -> whether the file is binary (stored uncompressed in zips, base64 in JSONL).
+COHORT_FILE_FORMATS = {"html": False, "txt": False, "pdf": True, "docx": True}
+
+# A parsed input record; `prompt_data` is None (and `error` set) when the record could not be read.
+CohortRow = namedtuple("CohortRow", "number id prompt_data error")
+
+
+class CohortJobBusyError(Exception):
+    """Raised when another run already holds a cohort job's lock."""
+
+
+class RateLimiter:
+    """Token bucket shared by threads: acquire() blocks until one of `rate` permits per second is free."""
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _cohort_row(number: int, record: dict) -> CohortRow:
+    """Maps a record's fields ("Activity Level" and "activity_level" alike) onto prompt_data; blank cells keep the defaults."""
+    fields = {str(name).strip().lower().replace(" ", "_"): value for name, value in record.items() if name is not None}
+    row_id = fields.pop("id", None) or fields.pop("patient_id", None)
+    profile = {name: str(value).strip() for name, value in fields.items() if value is not None and str(value).strip()}
+    return CohortRow(number, str(row_id).strip() if row_id else None, _build_prompt_data(profile), None)
+
+def read_cohort_rows(lines, input_format: str):
+    """
+    Yields a CohortRow per record of a CSV (with a header row) or JSONL text stream, as it is read.
+    An "id" or "patient_id" field names the row in the results; unreadable records become error rows.
+    """
+    if input_format == "csv":
+        for number, record in enumerate(csv.DictReader(lines), 1):
+            yield _cohort_row(number, record)
+        return
+    number = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield CohortRow(number, None, None, f"Invalid JSON: {e}")
+            continue
+        if not isinstance(record, dict):
+            yield CohortRow(number, None, None, "Expected a JSON object.")
+            continue
+        yield _cohort_row(number, record)
+
+def cohort_options(output_format: str, file_formats: str) -> tuple:
+    """Validates the result format and a comma-separated list of file formats; raises ValueError."""
+    if output_format not in COHORT_OUTPUT_EXTENSIONS.values():
+        raise ValueError(f"Unsupported result format {output_format!r}; use zip or jsonl.")
+    formats = [name.strip().lower() for name in file_formats.split(",") if name.strip()]
+    unknown = [name for name in formats if name not in COHORT_FILE_FORMATS]
+    if unknown or not formats:
+        raise ValueError(f"Unsupported file formats {', '.join(unknown) or file_formats!r}; "
+                         f"choose from {', '.join(COHORT_FILE_FORMATS)}.")
+    return output_format, list(dict.fromkeys(formats))
+
+class CohortJob:
+    """
+    A cohort batch job and its working directory: job.json (settings and progress), checkpoint.jsonl
+    (one line per generated profile, keyed by its cache key; a profile that got the local fallback is
+    generated again on resume) and files/ (each profile's rendered files).
+    The checkpoint is keyed by profile content, so a rerun skips every profile already done, and a
+    run holds an flock on the directory, so any worker can tell a live run from an interrupted one.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.id = os.path.basename(os.path.normpath(path))
+        self._state_lock = threading.Lock()
+        self._written_at = 0.0
+        self.reload()
+
+    @classmethod
+    def create(cls, path: str, **settings) -> "CohortJob":
+        """Starts a job directory; settings are input_path, input_format, output_format, file_formats and result_path."""
+        os.makedirs(os.path.join(path, "files"), exist_ok=True)
+        now = time.time()
+        state = {"id": os.path.basename(os.path.normpath(path)), "status": "queued", "created_at": now,
+                 "updated_at": now, "rows": None, "unique_profiles": None, "completed": 0, "fallbacks": 0,
+                 "failed": 0, "error": None, "max_rows": None, **settings}
+        _atomic_write(os.path.join(path, "job.json"), json.dumps(state).encode('utf-8'))
+        return cls(path)
+
+    @classmethod
+    def open(cls, path: str):
+        """The job in `path`, or None when there is none."""
+        try:
+            return cls(path)
+        except FileNotFoundError:
+            return None
+
+    def reload(self):
+        with open(os.path.join(self.path, "job.json"), encoding="utf-8") as f:
+            self.state = json.load(f)
+
+    def update(self, **changes):
+        with self._state_lock:
+            self.state.update(changes)
+            self._write_state()
+
+    def advance(self, **increments):
+        """Adds to progress counters; job.json is rewritten at most once a second for these."""
+        with self._state_lock:
+            for name, amount in increments.items():
+                self.state[name] += amount
+            if time.monotonic() - self._written_at >= 1:
+                self._write_state()
+
+    def _write_state(self):
+        self.state["updated_at"] = time.time()
+        self._written_at = time.monotonic()
+        _atomic_write(os.path.join(self.path, "job.json"), json.dumps(self.state).encode('utf-8'))
+
+    @contextmanager
+    def lock(self):
+        """Holds the job's lock for a run; raises CohortJobBusyError when another run holds it."""
+        with open(os.path.join(self.path, "lock"), "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise CohortJobBusyError(f"Cohort job {self.id} is already running.") from None
+            yield
+
+    def is_running(self) -> bool:
+        try:
+            with self.lock():
+                return False
+        except CohortJobBusyError:
+            return True
+
+    def load_checkpoint(self) -> dict:
+        """{cache key: entry} of the profiles finished so far; a line cut short by a crash is dropped."""
+        path = os.path.join(self.path, "checkpoint.jsonl")
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return {}
+        if not data.endswith(b"\n"):
+            data = data[:data.rfind(b"\n") + 1]
+            with open(path, "r+b") as f:
+                f.truncate(len(data))
+        entries = {}
+        for line in data.splitlines():
+            entry = json.loads(line)
+            entries[entry["key"]] = entry
+        return entries
+
+    def record(self, key: str, text: str, fallback: bool) -> dict:
+        """Appends a finished profile to the checkpoint and returns its entry."""
+        entry = {"key": key, "text": text, "fallback": fallback}
+        with self._state_lock, open(os.path.join(self.path, "checkpoint.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        return entry
+
+    def file_path(self, key: str, file_format: str) -> str:
+        return os.path.join(self.path, "files", f"{key[:32]}.{file_format}")
+
+    def public_state(self) -> dict:
+        state = {name: value for name, value in self.state.items() if not name.endswith("_path")}
+        if state["status"] == "done":
+            state["result_url"] = f"/cohort_jobs/{self.id}/result"
+        return state
+
+
+def run_cohort_job(job: CohortJob, workers=None, render_processes=None, rate_limiter=None):
+    """
+    Runs a cohort job, or resumes it from its checkpoint: reads the rows, generates each distinct
+    profile once on `workers` threads paced by `rate_limiter`, renders its files on `render_processes`
+    processes (0 renders them in the generating thread) and writes the result file in input order.
+    Raises CohortJobBusyError when another run holds the job.
+    """
+    workers = workers or current_app.config['COHORT_WORKERS']
+    render_processes = current_app.config['COHORT_RENDER_PROCESSES'] if render_processes is None else render_processes
+    with job.lock():
+        job.reload()
+        if job.state["status"] == "done":
+            return
+        try:
+            _run_cohort_job(job, workers, render_processes, rate_limiter or cohort_rate_limiter)
+        except Exception as e:
+            job.update(status="failed", error=str(e))
+            raise
+
+def _run_cohort_job(job: CohortJob, workers: int, render_processes: int, rate_limiter: RateLimiter):
+    max_rows = job.state["max_rows"]
+    rows, profiles = [], {}
+    with open(job.state["input_path"], encoding="utf-8-sig", newline="") as f:
+        for row in read_cohort_rows(f, job.state["input_format"]):
+            if max_rows and row.number > max_rows:
+                raise ValueError(f"The cohort has more than {max_rows} rows.")
+            key = None
+            if row.prompt_data is not None:
+                key = _recommendation_cache_key(row.prompt_data)
+                profiles.setdefault(key, row.prompt_data)
+            rows.append((row.number, row.id, key, row.error))
+
+    checkpoint = job.load_checkpoint()
+    job.update(status="running", rows=len(rows), unique_profiles=len(profiles), completed=0, fallbacks=0,
+               failed=0, error=None)
+    generated = sum(1 for key in profiles if key in checkpoint and not checkpoint[key]["fallback"])
+    logging.info(f"Cohort job {job.id}: {len(rows)} rows, {len(profiles)} distinct profiles, {generated} already generated.")
+
+    failures = {}
+    renderers = None
+    if render_processes:
+        # Spawned rather than forked: this process already runs generation and metrics threads.
+        renderers = ProcessPoolExecutor(max_workers=render_processes, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=init_render_process,
+                                        initargs=(os.getpid(), current_app.config['PDF_TEMPLATE_POOL_SIZE']))
+    generators = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cohort")
+    try:
+        futures = {generators.submit(copy_context().run, _process_cohort_profile, job, key, prompt_data, checkpoint.get(key),
+                                     renderers, rate_limiter): key
+                   for key, prompt_data in profiles.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                checkpoint[key], outcome = future.result()
+            except Exception as e:
+                logging.warning(f"Cohort job {job.id}: a profile failed: {e}")
+                failures[key] = str(e)
+                metrics.inc("nutri_cohort_profiles_total", outcome="failed")
+                job.advance(failed=1)
+                continue
+            metrics.inc("nutri_cohort_profiles_total", outcome=outcome)
+            job.advance(completed=1, fallbacks=int(checkpoint[key]["fallback"]))
+    finally:
+        # On an interrupt, requests already running finish and are checkpointed; queued ones are dropped.
+        generators.shutdown(wait=True, cancel_futures=True)
+        if renderers is not None:
+            renderers.shutdown(wait=True, cancel_futures=True)
+
+    _write_cohort_result(job, rows, checkpoint, failures)
+    job.update(status="done", finished_at=time.time())
+    logging.info(f"Cohort job {job.id} finished: {job.state['completed']} profiles, "
+                 f"{job.state['fallbacks']} local fallbacks, {job.state['failed']} failed.")
+
+def _process_cohort_profile(job: CohortJob, key: str, prompt_data: dict, entry, renderers, rate_limiter):
+    """
+    Generates one distinct profile's report unless the checkpoint has the model's report for it,
+    then renders its missing files. A checkpointed local fallback is generated again, so a run
+    resumed after a model outage replaces it with the model's report when it can.
+    """
+    if entry is not None and not entry["fallback"]:
+        outcome = "checkpointed"
+        missing = [file_format for file_format in job.state["file_formats"]
+                   if not os.path.exists(job.file_path(key, file_format))]
+    else:
+        text, fallback = _recommendation_report_text(prompt_data, key, before_model_call=rate_limiter.acquire)
+        entry = job.record(key, text, fallback)
+        outcome = "fallback" if fallback else "generated"
+        missing = job.state["file_formats"]
+    if missing:
+        with timed("cohort_render"):
+            if renderers is None:
+                files = render_cohort_files(entry["text"], missing, resources)
+            else:
+                files = renderers.submit(render_cohort_files, entry["text"], missing).result()
+        for file_format, data in files.items():
+            _atomic_write(job.file_path(key, file_format), data)
+    return entry, outcome
+
+def _cohort_file_stem(number: int, row_id) -> str:
+    safe_id = re.sub(r"[^\w.-]+", "_", row_id or "").strip("._")[:64]
+    return f"{number:05d}_{safe_id}" if safe_id else f"{number:05d}"
+
+@timed("cohort_result")
+def _write_cohort_result(job: CohortJob, rows, entries: dict, failures: dict):
+    """
+    Writes the result in input order: a zip of each row's files plus manifest.jsonl, or one JSONL
+    line per row with its files inline. Rows sharing a profile get copies of the same files.
+    """
+    file_formats = job.state["file_formats"]
+    result_path = job.state["result_path"]
+    temp_path = f"{result_path}.{os.getpid()}.tmp"
+
+    def row_records():
+        for number, row_id, key, error in rows:
+            entry = entries.get(key)
+            record = {"row": number, "id": row_id, "status": "ok" if entry else "error",
+                      "fallback": bool(entry and entry["fallback"]),
+                      "error": None if entry else error or failures.get(key, "Not generated.")}
+            yield record, key if entry else None
+
+    if job.state["output_format"] == "zip":
+        manifest = []
+        with zipfile.ZipFile(temp_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for record, key in row_records():
+                if key is not None:
+                    record["files"] = []
+                    for file_format in file_formats:
+                        name = f"{_cohort_file_stem(record['row'], record['id'])}.{file_format}"
+                        compression = zipfile.ZIP_STORED if COHORT_FILE_FORMATS[file_format] else zipfile.ZIP_DEFLATED
+                        archive.write(job.file_path(key, file_format), name, compress_type=compression)
+                        record["files"].append(name)
+                manifest.append(json.dumps(record) + "\n")
+            archive.writestr("manifest.jsonl", "".join(manifest))
+    else:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for record, key in row_records():
+                if key is not None:
+                    for file_format in file_formats:
+                        with open(job.file_path(key, file_format), "rb") as source:
+                            data = source.read()
+                        binary = COHORT_FILE_FORMATS[file_format]
+                        record[file_format] = base64.b64encode(data).decode('ascii') if binary else data.decode('utf-8')
+                f.write(json.dumps(record) + "\n")
+    os.replace(temp_path, result_path)
+
+_scheduled_cohort_jobs = set()
+_scheduled_cohort_jobs_lock = threading.Lock()
+
+def _schedule_cohort_job(job: CohortJob):
+    """Queues the job on this worker's cohort executor, unless it is already queued here."""
+    with _scheduled_cohort_jobs_lock:
+        if job.id in _scheduled_cohort_jobs:
+            return
+        _scheduled_cohort_jobs.add(job.id)
+    cohort_executor.submit(copy_context().run, _run_scheduled_cohort_job, job)
+
+def _run_scheduled_cohort_job(job: CohortJob):
+    try:
+        run_cohort_job(job)
+    except CohortJobBusyError:
+        logging.info(f"Cohort job {job.id} is already running in another worker.")
+    except (ValueError, csv.Error) as e:
+        logging.warning(f"Cohort job {job.id} failed on its input: {e}")
+    except Exception as e:
+        logging.error(f"Cohort job {job.id} failed: {e}", exc_info=True)
+    finally:
+        with _scheduled_cohort_jobs_lock:
+            _scheduled_cohort_jobs.discard(job.id)
+
+def _cohort_jobs_dir() -> str:
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], "cohort_jobs")
+
+def _open_cohort_job(job_id: str):
+    return CohortJob.open(os.path.join(_cohort_jobs_dir(), job_id)) if is_valid_report_token(job_id) else None
+
+def _delete_expired_cohort_jobs():
+    """Removes the directories of jobs not updated for COHORT_JOB_TTL seconds and not running."""
+    cutoff = time.time() - current_app.config['COHORT_JOB_TTL']
+    for entry in os.scandir(_cohort_jobs_dir()):
+        try:
+            if os.path.getmtime(os.path.join(entry.path, "job.json")) >= cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        job = CohortJob.open(entry.path)
+        if job is not None and not job.is_running():
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+@bp.route('/cohort_jobs', methods=['POST'])
+def create_cohort_job():
+    """
+    Starts a batch job over a cohort uploaded as CSV or JSONL, either as a multipart "file" field
+    or as the request body. Options, as query or form fields: input_format (else taken from the
+    file name or content type), output ("zip" or "jsonl") and formats (comma-separated html, txt,
+    pdf, docx). Returns 202 with the job id; poll /cohort_jobs/<id> until its status is "done".
+    """
+    upload = request.files.get('file')
+    extension = os.path.splitext(upload.filename or "")[1].lower() if upload else ""
+    input_format = (request.values.get('input_format') or COHORT_INPUT_EXTENSIONS.get(extension)
+                    or COHORT_INPUT_MIMETYPES.get(upload.mimetype if upload else request.mimetype))
+    if input_format not in ("csv", "jsonl"):
+        return jsonify({"error": "Send the cohort as CSV or JSONL, or set input_format."}), 400
+    try:
+        output_format, file_formats = cohort_options(request.values.get('output', 'zip'),
+                                                     request.values.get('formats', 'html,pdf'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    os.makedirs(_cohort_jobs_dir(), exist_ok=True)
+    _delete_expired_cohort_jobs()
+    job_id = new_report_token()
+    job_dir = os.path.join(_cohort_jobs_dir(), job_id)
+    input_path = os.path.join(job_dir, f"input.{input_format}")
+    os.makedirs(job_dir)
+    if upload:
+        upload.save(input_path)
+    else:
+        with open(input_path, "wb") as f:
+            shutil.copyfileobj(request.stream, f)
+    if os.path.getsize(input_path) == 0:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return jsonify({"error": "The cohort file is empty."}), 400
+
+    job = CohortJob.create(job_dir, input_path=input_path, input_format=input_format, output_format=output_format,
+                           file_formats=file_formats, max_rows=current_app.config['COHORT_MAX_ROWS'],
+                           result_path=os.path.join(job_dir, f"result.{output_format}"))
+    _schedule_cohort_job(job)
+    logging.info(f"Cohort job {job_id} queued ({input_format} input, {output_format} result, {','.join(file_formats)}).")
+    status_url = f"/cohort_jobs/{job_id}"
+    return jsonify({"job_id": job_id, "status_url": status_url}), 202, {"Location": status_url}
+
+@bp.route('/cohort_jobs/<job_id>')
+def cohort_job_status(job_id):
+    """Progress of a cohort job. A job whose worker went away mid-run is resumed from its checkpoint here."""
+    job = _open_cohort_job(job_id)
+    if job is None:
+        return jsonify({"error": "Cohort job not found or has expired."}), 404
+    if job.state["status"] in ("queued", "running") and not job.is_running():
+        logging.info(f"Resuming interrupted cohort job {job_id}.")
+        _schedule_cohort_job(job)
+    return jsonify(job.public_state())
+
+@bp.route('/cohort_jobs/<job_id>/result')
+def cohort_job_result(job_id):
+    """Downloads the result of a finished cohort job: the zip of every row's files, or the JSONL stream."""
+    job = _open_cohort_job(job_id)
+    if job is None:
+        return jsonify({"error": "Cohort job not found or has expired."}), 404
+    if job.state["status"] != "done":
+        return jsonify({"error": "The cohort job has not finished.", "status": job.state["status"]}), 409
+    output_format = job.state["output_format"]
+    return send_file(job.state["result_path"], as_attachment=True, download_name=f"NutriAI_Cohort_{job_id}.{output_format}",
+                     mimetype="application/zip" if output_format == "zip" else "application/x-ndjson")
+
+@bp.cli.command("generate-cohort")
+@click.argument("input_file", type=click.Path(exists=True, dir_okay=False))
+@click.argument("output_file", type=click.Path(dir_okay=False))
+@click.option("--input-format", type=click.Choice(["csv", "jsonl"]), help="Defaults to the input file's extension.")
+@click.option("--formats", default="html,pdf", show_default=True, help="Files per row, from html, txt, pdf and docx.")
+@click.option("--workers", type=int, help="Concurrent model requests. Defaults to COHORT_WORKERS.")
+@click.option("--rate", type=float, help="Model requests per second, 0 for no limit. Defaults to COHORT_RATE_LIMIT.")
+@click.option("--render-processes", type=int,
+              help="Processes rendering the files, 0 to render in the request threads. Defaults to COHORT_RENDER_PROCESSES.")
+@click.option("--checkpoint-dir", type=click.Path(file_okay=False), help="Defaults to OUTPUT_FILE.checkpoint.")
+def generate_cohort_command(input_file, output_file, input_format, formats, workers, rate, render_processes, checkpoint_dir):
+    """
+    Generates a report for every profile in a CSV or JSONL cohort, writing a zip or JSONL file by
+    OUTPUT_FILE's extension. An interrupted run picks up where it stopped when run again.
+    """
+    input_format = input_format or COHORT_INPUT_EXTENSIONS.get(os.path.splitext(input_file)[1].lower())
+    if input_format is None:
+        raise click.BadParameter("cannot tell the format from the extension; pass --input-format.", param_hint="INPUT_FILE")
+    output_format = COHORT_OUTPUT_EXTENSIONS.get(os.path.splitext(output_file)[1].lower())
+    if output_format is None:
+        raise click.BadParameter("must end in .zip or .jsonl.", param_hint="OUTPUT_FILE")
+    try:
+        output_format, file_formats = cohort_options(output_format, formats)
+    except ValueError as e:
+        raise click.BadParameter(str(e)) from None
+
+    checkpoint_dir = checkpoint_dir or f"{output_file}.checkpoint"
+    settings = {"input_path": os.path.abspath(input_file), "input_format": input_format, "output_format": output_format,
+                "file_formats": file_formats, "result_path": os.path.abspath(output_file)}
+    job = CohortJob.open(checkpoint_dir)
+    if job is None:
+        job = CohortJob.create(checkpoint_dir, **settings)
+    else:
+        click.echo(f"Resuming from {checkpoint_dir}.")
+        job.update(status="queued", **settings)
+    rate_limiter = RateLimiter(current_app.config['COHORT_RATE_LIMIT'] if rate is None else rate)
+    try:
+        run_cohort_job(job, workers=workers, render_processes=render_processes, rate_limiter=rate_limiter)
+    except (CohortJobBusyError, ValueError, csv.Error) as e:
+        raise click.ClickException(str(e)) from None
+
+    state = job.state
+    click.echo(f"Wrote {state['rows']} rows ({state['unique_profiles']} distinct profiles, {state['fallbacks']} "
+               f"local fallbacks, {state['failed']} failed) to {output_file}.")
+    if state["failed"]:
+        click.echo(f"Run the command again to retry the failed profiles; progress is kept in {checkpoint_dir}.", err=True)
+        sys.exit(1)
+    if state["fallbacks"]:
+        click.echo(f"Run the command again to ask the model for the {state['fallbacks']} locally built reports; "
+                   f"progress is kept in {checkpoint_dir}.", err=True)
+        return
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+# --- Async (ASGI) Serving ---
+class QueueFullError(Exception):
+    """Raised when every generation slot is busy and the wait queue is full."""
+
+
+class GenerationLimiter:
+    """
+    Caps concurrent model generations on the event loop. Up to `max_queued` requests may wait
+    for a slot; beyond that, requests are rejected immediately so clients can back off.
+    """
+    def __init__(self, max_concurrent: int, max_queued: int):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = None
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self.in_flight >= self.max_concurrent and self.waiting >= self.max_queued:
+            raise QueueFullError()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+
+async def _astream_model_text(model_request: dict):
+    async for text in model_gateway.astream_text(model_request):
+        yield text
+
+async def _astream_recommendation_text(prompt_data: dict):
+    """Async counterpart of _stream_recommendation_text."""
+    local_values = local_values_for(prompt_data)
+    if local_values is None:
+        async for text in _astream_model_text(_recommendation_request(prompt_data)):
+            yield text
+        return
+
+    filler = LocalValueFiller(local_values)
+    yield filler.header()
+    received_model_text = False
+    async for chunk_text in _astream_model_text(_recommendation_request(prompt_data)):
+        received_model_text = True
+        text = filler.feed(chunk_text)
+        if text:
+            yield text
+    if not received_model_text:
+        raise ValueError("AI returned an empty response.")
+    yield filler.close()
+
+async def _read_json_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+async def _send_json(send, payload, status=200, extra_headers=()):
+    body = json.dumps(payload).encode('utf-8')
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *extra_headers]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class AsyncNutriApp:
+    """
+    ASGI entry point served next to the WSGI `app`, e.g. `uvicorn app:asgi_app`.
+    The generation endpoints run natively on the event loop through the gateway's async path,
+    so one process can hold hundreds of in-flight generations; every other route is
+    delegated to the Flask app.
+    """
+    BUSY_RESPONSE = {"error": "The server is busy generating other reports. Please try again shortly."}
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self._wsgi = None
+        services = flask_app.extensions["nutri"]
+        self.server_timing = flask_app.config['SERVER_TIMING']
+        self.limiter = GenerationLimiter(flask_app.config['MAX_CONCURRENT_GENERATIONS'], flask_app.config['MAX_QUEUED_GENERATIONS'])
+        # Only the request leading a flight takes a generation slot; coalesced requests wait on its result.
+        self.recommendation_flights = services.flight_groups["async_recommendations"] = AsyncSingleFlight("recommendations", services.flight_lease)
+        self.comparison_flights = services.flight_groups["async_comparisons"] = AsyncSingleFlight("comparisons", services.flight_lease)
+        self.routes = {
+            "/get_nutrient_recommendations": self.nutrient_recommendations,
+            "/stream_nutrient_recommendations": self.stream_nutrient_recommendations,
+            "/compare_foods": self.compare_foods,
+            "/compare_foods/batch": self.compare_foods_batch,
+        }
+        services.metrics.add_collector(self._collect_metrics)
+
+    def _collect_metrics(self, registry):
+        registry.set("nutri_generations_in_flight", self.limiter.in_flight)
+        registry.set("nutri_generations_queued", self.limiter.waiting)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        handler = self.routes.get(scope.get("path")) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if handler is None:
+            if self._wsgi is None:
+                from a2wsgi import WSGIMiddleware
+                self._wsgi = WSGIMiddleware(self.flask_app)
+            await self._wsgi(scope, receive, send)
+            return
+        # The module-level subsystems resolve to this app's while the request is handled.
+        with self.flask_app.app_context():
+            started = _start_request_metrics()
+            status = 500
+
+            async def send_with_timing(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    if self.server_timing:
+                        header = server_timing_header(_request_timings.get(), time.perf_counter() - started)
+                        message = {**message, "headers": [*message["headers"], (b"server-timing", header.encode())]}
+                await send(message)
+
+            try:
+                await self._dispatch(handler, scope, receive, send_with_timing)
+            finally:
+                _finish_request_metrics(scope["path"], scope["method"], status, started)
+
+    async def _dispatch(self, handler, scope, receive, send):
+        data = await _read_json_body(receive)
+        try:
+            await handler(data, send)
+        except QueueFullError:
+            logging.warning(f"Rejecting {scope['path']}: {self.limiter.in_flight} generations in flight, {self.limiter.waiting} queued.")
+            await _send_json(send, self.BUSY_RESPONSE, status=503, extra_headers=[(b"retry-after", b"5")])
+        except ModelUnavailableError as e:
+            logging.warning(f"{scope['path']} failed, model unavailable: {e}")
+            retry_after = str(int(model_gateway.breaker.reset_timeout)).encode()
+            await _send_json(send, {"error": MODEL_UNAVAILABLE_MESSAGE}, status=503, extra_headers=[(b"retry-after", retry_after)])
+
+    async def _recommendation_text(self, prompt_data):
+        """Returns the report text and whether it is the locally computed fallback."""
+        cache_key = _recommendation_cache_key(prompt_data)
+        response_text = await asyncio.to_thread(recommendation_cache.get, cache_key)
+        if response_text is not None:
+            logging.info("Serving nutrient recommendations from cache.")
+            return response_text, False
+        try:
+            with timed("generate"):
+                chunks = await self._coalesced_recommendation_text(prompt_data, cache_key)
+                response_text = "".join([text async for text in chunks])
+            if not response_text:
+                raise ValueError("AI returned an empty response.")
+        except QueueFullError:
+            raise
+        except Exception as e:
+            response_text = _fallback_report_text(prompt_data)
+            if response_text is None:
+                raise
+            logging.warning(f"Model request failed, serving the locally computed report: {e}")
+            return response_text, True
+        return response_text, False
+
+    async def _coalesced_recommendation_text(self, prompt_data, cache_key):
+        return await self.recommendation_flights.stream(
+            cache_key, lambda: _astream_recommendation_text(prompt_data),
+            on_complete=lambda response_text: _cache_recommendation(cache_key, response_text),
+            lookup=lambda: recommendation_cache.get(cache_key), admit=self.limiter.slot)
+
+    async def nutrient_recommendations(self, data, send):
+        if not data:
+            await _send_json(send, {"error": "Invalid request body"}, status=400)
+            return
+        try:
+            response_text, fallback = await self._recommendation_text(_build_prompt_data(data))
+            report = _report_model_for_text(response_text)
+            download_token = await asyncio.to_thread(_save_report, response_text, report)
+            payload = {'recommendations': render_report_html(report),
+                       'download_token': download_token, 'fallback': fallback}
+        except (QueueFullError, ModelUnavailableError):
+            raise
+        except Exception as e:
+            logging.error(f"Error in async recommendation endpoint: {e}", exc_info=True)
+            await _send_json(send, {"error": f"An internal server error occurred: {e}"}, status=500)
+            return
+        await _send_json(send, payload)
+
+    async def stream_nutrient_recommendations(self, data, send):
+        if not data:
+            await _send_json(send, {"error": "Invalid request body"}, status=400)
+            return
+        prompt_data = _build_prompt_data(data)
+        cache_key = _recommendation_cache_key(prompt_data)
+        cached_text = await asyncio.to_thread(recommendation_cache.get, cache_key)
+
+        async def stream_events(chunks):
+            received = []
+            await send({"type": "http.response.start", "status": 200, "headers": [
+                (b"content-type", b"application/x-ndjson"), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]})
+            formatter = RecommendationHTMLFormatter()
+
+            async def feed(chunk):
+                received.append(chunk)
+                cards = formatter.feed(chunk)
+                if cards:
+                    await send_events({"type": "card", "html": card_html} for card_html in cards)
+
+            try:
+                fallback = False
+                try:
+                    async for chunk in chunks:
+                        await feed(chunk)
+                    if not "".join(received):
+                        raise ValueError("AI returned an empty response.")
+                except Exception as e:
+                    fallback_text = None if cached_text is not None else _fallback_report_text(prompt_data, "".join(received))
+                    if fallback_text is None:
+                        raise
+                    logging.warning(f"Model stream failed, finishing with the locally computed report: {e}")
+                    fallback = True
+                    await feed(fallback_text)
+                await send_events({"type": "card", "html": card_html} for card_html in formatter.close())
+
+                response_text = "".join(received)
+                download_token = await asyncio.to_thread(_save_report, response_text, formatter.report)
+                await send_events([{"type": "done", "download_token": download_token, "fallback": fallback}])
+            except Exception as e:
+                logging.error(f"Error in async streaming recommendation endpoint: {e}", exc_info=True)
+                await send_events([{"type": "error", "error": f"An internal server error occurred: {e}"}])
+            await send({"type": "http.response.body", "body": b""})
+
+        async def send_events(events):
+            body = "".join(json.dumps(event) + "\n" for event in events).encode('utf-8')
+            if body:
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+
+        if cached_text is not None:
+            logging.info("Serving streamed nutrient recommendations from cache.")
+
+            async def cached_chunks():
+                yield cached_text
+            await stream_events(cached_chunks())
+            return
+
+        await stream_events(await self._coalesced_recommendation_text(prompt_data, cache_key))
+
+    async def compare_foods(self, data, send):
+        if not _valid_foods(data, 2, 2):
+            await _send_json(send, {"error": "Please provide exactly two foods to compare."}, status=400)
+            return
+        foods = data['foods']
+        logging.info(COMPARISON_LOG_PREFIX + json.dumps(foods, ensure_ascii=False))
+        try:
+            table = await asyncio.to_thread(cached_comparison, foods)
+            if table is None:
+                with timed("compare"):
+                    table = await self._coalesced_comparison(foods)
+            payload = {"comparison": table}
+        except (QueueFullError, ModelUnavailableError):
+            raise
+        except Exception as e:
+            logging.error(f"Error in async food comparison endpoint: {e}", exc_info=True)
+            await _send_json(send, {"error": f"An internal server error occurred: {e}"}, status=500)
+            return
+        await _send_json(send, payload)
+
+    async def _coalesced_comparison(self, foods):
+        """Async counterpart of coalesced_comparison."""
+        names = [normalize_food_name(food) for food in foods]
+        key = _comparison_cache_key(names)
+        canonical_foods = _canonical_foods(foods)
+
+        async def generate():
+            raw_html_table = "".join([text async for text in _astream_model_text(_comparison_request(canonical_foods))])
+            table = extract_comparison_table(raw_html_table)
+            if table is None:
+                return format_comparison(raw_html_table)
+            await asyncio.to_thread(store_comparison, canonical_foods, table)
+            return table
+
+        table = await self.comparison_flights.call(key, generate, lookup=lambda: comparison_cache.get(key), admit=self.limiter.slot)
+        return _table_for_foods(table, foods)
+
+    async def _batch_comparison(self, foods):
+        """Async counterpart of batch_comparison, after the cache lookup."""
+        names = [normalize_food_name(food) for food in foods]
+        key = _comparison_cache_key(names)
+        canonical_foods = _canonical_foods(foods)
+
+        async def generate():
+            raw_text = "".join([text async for text in _astream_model_text(_comparison_request(canonical_foods))])
+            return await asyncio.to_thread(_comparison_table_from_output, canonical_foods, raw_text)
+
+        table = await self.comparison_flights.call(key, generate, lookup=lambda: comparison_cache.get(key), admit=self.limiter.slot)
+        return _table_for_foods(table, foods)
+
+    async def compare_foods_batch(self, data, send):
+        error = _batch_foods_error(data)
+        if error:
+            await _send_json(send, {"error": error}, status=400)
+            return
+        foods = data['foods']
+        logging.info(COMPARISON_LOG_PREFIX + json.dumps(foods, ensure_ascii=False))
+        try:
+            table = await asyncio.to_thread(cached_comparison, foods)
+            if table is None:
+                with timed("compare"):
+                    table = await self._batch_comparison(foods)
+            payload = {"comparison": table}
+        except (QueueFullError, ModelUnavailableError):
+            raise
+        except ComparisonFormatError:
+            payload = {"comparison": COMPARISON_ERROR_HTML}
+        except Exception as e:
+            logging.error(f"Error in async batch food comparison endpoint: {e}", exc_info=True)
+            await _send_json(send, {"error": f"An internal server error occurred: {e}"}, status=500)
+            return
+        await _send_json(send, payload)
+
+
+# --- App Factory ---
+class NutriServices:
+    """
+    The stateful subsystems of one app, built from its config by create_app() and kept in
+    app.extensions["nutri"]; the module-level names (metrics, model_gateway, the caches, ...)
+    stand for the current app's. Databases and report files go under UPLOAD_FOLDER.
+    """
+    def __init__(self, config):
+        os.makedirs(config['UPLOAD_FOLDER'], exist_ok=True)
+        cache_path = os.path.join(config['UPLOAD_FOLDER'], "response_cache.sqlite3") if config['RESPONSE_CACHE_DISK'] else None
+        self.metrics = MetricsRegistry(
+            METRIC_FAMILIES, METRIC_RATIOS,
+            db_path=os.path.join(config['UPLOAD_FOLDER'], "metrics.sqlite3") if config['METRICS_MULTIPROCESS'] else None,
+            publish_interval=config['METRICS_PUBLISH_INTERVAL'],
+        )
+        self.model_gateway = _create_model_gateway(config)
+        self.report_model_cache = ResponseCache(max_entries=256, ttl=config['REPORT_TTL'])
+        self.recommendation_cache = ResponseCache(
+            max_entries=config['RESPONSE_CACHE_SIZE'], ttl=config['RESPONSE_CACHE_TTL'],
+            db_path=cache_path, max_disk_entries=config['RESPONSE_CACHE_DISK_MAX_ENTRIES'])
+        self.comparison_cache = ResponseCache(
+            max_entries=config['COMPARISON_CACHE_SIZE'], ttl=config['RESPONSE_CACHE_TTL'],
+            db_path=cache_path, max_disk_entries=config['RESPONSE_CACHE_DISK_MAX_ENTRIES'])
+        self.flight_lease = _create_flight_lease(config)
+        self.recommendation_flights = SingleFlight("recommendations", self.flight_lease)
+        self.comparison_flights = SingleFlight("comparisons", self.flight_lease)
+        self.flight_groups = {"recommendations": self.recommendation_flights, "comparisons": self.comparison_flights}
+        self.report_store = _create_report_store(config)
+        self.resources = RenderResources(PDF_FONT_PATH, template_pool_size=config['PDF_TEMPLATE_POOL_SIZE'])
+        self.pdf_executor = ThreadPoolExecutor(max_workers=config['PDF_RENDER_WORKERS'], thread_name_prefix="pdf-render")
+        self.cohort_rate_limiter = RateLimiter(config['COHORT_RATE_LIMIT'])
+        self.cohort_executor = ThreadPoolExecutor(max_workers=config['COHORT_JOB_WORKERS'], thread_name_prefix="cohort-job")
+        self.metrics.add_collector(_collect_startup_timings)
+        self.metrics.add_collector(self._collect_component_stats)
+
+    def _collect_component_stats(self, registry):
+        """Copies the counters kept by the caches, single-flight groups and model gateway into the registry."""
+        caches = {"recommendations": self.recommendation_cache, "comparisons": self.comparison_cache,
+                  "report_models": self.report_model_cache}
+        for name, cache in caches.items():
+            cache_stats = cache.stats()
+            registry.set("nutri_cache_hits_total", cache_stats["hits"], cache=name)
+            registry.set("nutri_cache_misses_total", cache_stats["misses"], cache=name)
+            registry.set("nutri_cache_evictions_total", cache_stats["evictions"], cache=name)
+            registry.set("nutri_cache_entries", cache_stats["size"], cache=name)
+        for name, group in self.flight_groups.items():
+            group_stats = group.stats()
+            registry.set("nutri_single_flight_started_total", group_stats["started"], group=name)
+            registry.set("nutri_single_flight_coalesced_total", group_stats["coalesced"], group=name)
+            registry.set("nutri_single_flight_in_flight", group_stats["in_flight"], group=name)
+        model_stats = self.model_gateway.stats()
+        for counter in ("calls", "retries", "failures", "timeouts", "short_circuited"):
+            registry.set(f"nutri_model_{counter}_total", model_stats[counter])
+        registry.set("nutri_model_calls_in_flight", model_stats["in_flight"])
+        for state in ("closed", "open", "half_open"):
+            registry.set("nutri_model_circuit_state", int(model_stats["circuit"] == state), state=state)
+
+
+def preload_subsystems():
+    """
+    Loads the document-export and model subsystems now instead of on first use. In a gunicorn
+    master with preload_app, forked workers then share the loaded modules copy-on-write.
+    """
+    start = time.perf_counter()
+    import docx  # noqa: F401
+    resources.warm_up()
+    model_gateway.backend
+    logging.info(f"Preloaded document export and model backend in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+def create_app(test_config=None) -> Flask:
+    """
+    Builds a Flask app from `config`, with `test_config` overriding it, and its own NutriServices;
+    registers the routes, request hooks and CLI commands of `bp`.
+    """
+    flask_app = Flask(__name__)
+    flask_app.config.from_mapping(config)
+    if test_config is not None:
+        flask_app.config.from_mapping(test_config)
+    flask_app.extensions["nutri"] = NutriServices(flask_app.config)
+    flask_app.register_blueprint(bp)
+    if flask_app.config['STARTUP_LOADING'] == "eager":
+        with flask_app.app_context():
+            preload_subsystems()
+    return flask_app
+
+
+record_startup("import", time.perf_counter() - _IMPORT_STARTED)
+app = create_app()
+asgi_app = AsyncNutriApp(app)
+record_startup("ready", time.perf_counter() - _IMPORT_STARTED)
+
+
+if __name__ == "__main__":
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+Micro-benchmark for PDF line wrapping over a full-size report.
+
+Compares the LineWrapper used by reports.report_to_pdf against the previous loop, which
+re-measured the whole growing line with pdf.get_string_width for every word.
+
+    python benchmarks/bench_line_wrap.py [--repeat 20]
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("MODEL_BACKEND", "fake_model:create_fake_backend")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import pyphen  # noqa: E402
+
+import app  # noqa: E402
+import reports  # noqa: E402
+
+
+def legacy_wrap(pdf, dic, text, usable_width):
+    """The wrapping loop as it was before LineWrapper, kept verbatim for comparison."""
+    lines = []
+    words = text.split()
+    line = ''
+    for word in words:
+        test_line = f"{line} {word}".strip()
+        if pdf.get_string_width(test_line) <= usable_width:
+            line = test_line
+        else:
+            hyphenated = dic.inserted(word, hyphen='-').split('-')
+            for i, part in enumerate(hyphenated):
+                part += '-' if i < len(hyphenated) - 1 else ''
+                test_line = f"{line} {part}".strip()
+                if pdf.get_string_width(test_line) <= usable_width:
+                    line = test_line
+                else:
+                    lines.append(line)
+                    line = part
+    if line:
+        lines.append(line)
+    return lines
+
+
+def full_size_report():
+    """The OUTPUT_FORMAT template, which has the length and nesting of a real report."""
+    return app.SYSTEM_INSTRUCTION_NUTRITIONIST.split("## OUTPUT_FORMAT\n---\n", 1)[1].replace('**', '')
+
+
+def make_pdf():
+    pdf = reports._pdf_class()(orientation='L', unit='mm', format='A4')
+    pdf.add_page()
+    pdf.add_font('DejaVuSerif', '', os.path.join(os.path.dirname(reports.__file__), 'static', 'fonts', 'DejaVuSerif.ttf'))
+    pdf.set_font('DejaVuSerif', size=12)
+    return pdf
+
+
+def paragraphs(pdf, report):
+    base_left, max_width = pdf.l_margin, pdf.w - pdf.r_margin
+    for raw_line in report.split('\n'):
+        text = raw_line.strip()
+        if text:
+            indent_mm = (len(raw_line) - len(raw_line.lstrip(' '))) * reports.PDF_INDENT_MM_PER_SPACE
+            yield text, max_width - (base_left + indent_mm)
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    pdf = make_pdf()
+    items = list(paragraphs(pdf, full_size_report()))
+    dic = pyphen.Pyphen(lang='en_US')
+
+    def run_legacy():
+        for text, width in items:
+            legacy_wrap(pdf, dic, text, width)
+
+    def run_wrapper():
+        # A fresh wrapper per render, as in report_to_pdf; glyph and hyphenation caches stay warm.
+        wrapper = reports.LineWrapper(pdf)
+        for text, width in items:
+            wrapper.wrap(text, width)
+
+    legacy = best_of(args.repeat, run_legacy)
+    current = best_of(args.repeat, run_wrapper)
+    print(f"paragraphs: {len(items)}")
+    print(f"legacy loop:  {legacy * 1000:8.2f} ms")
+    print(f"LineWrapper:  {current * 1000:8.2f} ms")
+    print(f"speedup:      {legacy / current:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Micro-benchmarks for the rendering hot paths over a full-length report: parsing, HTML cards,
+comparison table cleanup and the DOCX/PDF exporters.
+
+Each benchmark is calibrated so one round takes at least --round-time, then run for at least
+--min-rounds rounds and --min-time seconds; times are per call.
+
+    python benchmarks/bench_render.py [-k pdf] [--json benchmarks/results/render.json]
+"""
+import argparse
+import time
+
+import common
+
+import app
+
+
+def benchmarks():
+    """Name -> zero-argument callable, in report order."""
+    report_text = common.sample_report_text()
+    report = app.parse_report(report_text)
+    comparison_pair = common.sample_comparison_output(2)
+    comparison_batch = common.sample_comparison_output(len(common.SAMPLE_FOODS))
+    return {
+        "parse_report": lambda: app.parse_report(report_text),
+        "format_recommendations_to_html": lambda: app.format_recommendations_to_html(report_text),
+        "render_report_html": lambda: app.render_report_html(report),
+        "stream_formatter": lambda: stream_formatter(report_text),
+        "format_comparison[2]": lambda: app.format_comparison(comparison_pair),
+        f"format_comparison[{len(common.SAMPLE_FOODS)}]": lambda: app.format_comparison(comparison_batch),
+        f"has_food_columns[{len(common.SAMPLE_FOODS)}]":
+            lambda: app.has_food_columns(app.extract_comparison_table(comparison_batch), len(common.SAMPLE_FOODS)),
+        "convert_report_to_docx": lambda: app._convert_report_to_docx(report),
+        "convert_report_to_pdf": lambda: app._convert_report_to_pdf(report),
+    }
+
+
+def stream_formatter(report_text, chunk_size=80):
+    """The streaming endpoint's path: the report fed in model-sized chunks."""
+    formatter = app.RecommendationHTMLFormatter()
+    for start in range(0, len(report_text), chunk_size):
+        formatter.feed(report_text[start:start + chunk_size])
+    formatter.close()
+
+
+def calibrate(func, round_time):
+    """Calls per round so that a round lasts at least `round_time` seconds."""
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= round_time:
+            return iterations
+        iterations *= 2 if elapsed == 0 else max(2, min(10, int(round_time / elapsed) + 1))
+
+
+def run(func, min_rounds, min_time, round_time):
+    func()  # warm caches, fonts and templates
+    iterations = calibrate(func, round_time)
+    timings = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < min_rounds or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        timings.append((time.perf_counter() - start) / iterations)
+    return {**common.summarize(timings), "iterations": iterations}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-k", dest="filter", help="only run benchmarks whose name contains this text")
+    parser.add_argument("--min-rounds", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds per benchmark")
+    parser.add_argument("--round-time", type=float, default=0.005, help="minimum seconds per round")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    app.app.app_context().push()  # the renderers use the entry-point app's fonts and metrics
+    results = {}
+    print(f"{'Name (time in ms)':<34}{'Min':>10}{'Max':>10}{'Mean':>10}{'StdDev':>10}{'Median':>10}{'P95':>10}{'Rounds':>8}")
+    for name, func in benchmarks().items():
+        if args.filter and args.filter not in name:
+            continue
+        stats = results[name] = run(func, args.min_rounds, args.min_time, args.round_time)
+        print(f"{name:<34}{common.ms(stats['min'])}{common.ms(stats['max'])}{common.ms(stats['mean'])}"
+              f"{common.ms(stats['stddev'])}{common.ms(stats['p50'])}{common.ms(stats['p95'])}{stats['rounds']:>8}")
+
+    if args.json:
+        common.write_results(args.json, "render", results, {
+            "min_rounds": args.min_rounds, "min_time": args.min_time, "round_time": args.round_time})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Cold-start benchmark: imports the app in fresh interpreters with lazy and eager loading.
+
+For each run it records the wall time of `import app`, the time until the first response to
+"/", and the app's own startup figures (import, ready and each subsystem it loaded).
+
+    python benchmarks/bench_startup.py [--runs 10] [--json benchmarks/results/startup.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+import common
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get("/")
+print(json.dumps({"import_wall": imported - start, "first_response": time.perf_counter() - start, **app.startup_timings}))
+"""
+
+
+def probe(mode):
+    env = {**os.environ, "STARTUP_LOADING": mode, "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))}
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=common.REPO_ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modes", default="lazy,eager")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'Measurement (time in ms)':<34}{'Min':>10}{'P50':>10}{'P95':>10}{'Max':>10}")
+    for mode in args.modes.split(","):
+        samples = defaultdict(list)
+        for _ in range(args.runs):
+            for name, seconds in probe(mode).items():
+                samples[name].append(seconds)
+        for name, values in samples.items():
+            stats = results[f"{mode}:{name}"] = common.summarize(values)
+            print(f"{mode + ':' + name:<34}{common.ms(stats['min'])}{common.ms(stats['p50'])}"
+                  f"{common.ms(stats['p95'])}{common.ms(stats['max'])}")
+
+    if args.json:
+        common.write_results(args.json, "startup", results, {"runs": args.runs, "modes": args.modes})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Shared helpers for the benchmark scripts: offline app setup, sample reports, latency
+summaries and the JSON results format read by compare.py.
+
+Import this module before `app`: it selects the fake model backend (fake_model.py) so nothing
+leaves the box.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+FAKE_MODEL_BACKEND = "fake_model:create_fake_backend"
+os.environ.setdefault("MODEL_BACKEND", FAKE_MODEL_BACKEND)
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, REPO_ROOT)
+
+RESULTS_FORMAT_VERSION = 1
+
+SAMPLE_PROFILE = {
+    "age": "34", "gender": "Female", "height": "168", "weight": "63",
+    "activity_level": "Lightly Active", "pregnancy_or_lactation": "None",
+    "health_condition": "Type 2 Diabetes", "dietary_preferences": "Vegetarian",
+}
+
+SAMPLE_FOODS = ["Apple", "Banana", "Quinoa", "Lentils", "Salmon", "Spinach", "Almonds", "Greek Yogurt"]
+
+# (metric, per-food values) rows of a plausible comparison table.
+COMPARISON_ROWS = [
+    ("Calories (kcal)", ["52", "89", "120", "116", "208", "23", "579", "59"]),
+    ("Protein (g)", ["0.3", "1.1", "4.4", "9.0", "20", "2.9", "21", "10"]),
+    ("Carbohydrates (g)", ["14", "23", "21", "20", "0", "3.6", "22", "3.6"]),
+    ("Fiber (g)", ["2.4", "2.6", "2.8", "7.9", "0", "2.2", "12.5", "0"]),
+    ("Sugars (g)", ["10", "12", "0.9", "1.8", "0", "0.4", "4.4", "3.2"]),
+    ("Fat (g)", ["0.2", "0.3", "1.9", "0.4", "13", "0.4", "50", "0.4"]),
+    ("Key Vitamin", ["Vitamin C", "Vitamin B6", "Folate", "Folate", "Vitamin D", "Vitamin K", "Vitamin E", "Vitamin B12"]),
+    ("Key Mineral", ["Potassium", "Potassium", "Magnesium", "Iron", "Selenium", "Iron", "Magnesium", "Calcium"]),
+    ("Best For", ["Snacking", "Quick energy", "Grain bowls", "Soups", "Heart health", "Salads", "Snacking", "Breakfast"]),
+]
+
+
+def sample_report_text(profile=None) -> str:
+    """A full-length report: locally computed values filled into the canned OUTPUT_FORMAT text."""
+    import app
+    from fake_model import FakeModelClient
+    prompt_data = app._build_prompt_data(profile or SAMPLE_PROFILE)
+    model = FakeModelClient(latency=0, chunk_delay=0)
+    chunks = model.models.generate_content_stream(**app._recommendation_request(prompt_data))
+    filler = app.LocalValueFiller(app.local_values_for(prompt_data))
+    return filler.header() + "".join(filler.feed(chunk.text) for chunk in chunks) + filler.close()
+
+
+def sample_comparison_output(food_count: int) -> str:
+    """Model output for a comparison of the first `food_count` sample foods, fences and chatter included."""
+    foods = SAMPLE_FOODS[:food_count]
+    header = "".join(f"<th>{food}</th>" for food in foods)
+    rows = "".join(f"<tr><td>{metric}</td>" + "".join(f"<td>{value}</td>" for value in values[:food_count]) + "</tr>"
+                   for metric, values in COMPARISON_ROWS)
+    return (f"Here is the comparison you asked for:\n```html\n<table><thead><tr><th>Nutritional Metric (per 100g)</th>"
+            f"{header}</tr></thead><tbody>{rows}</tbody></table>\n```\n")
+
+
+def percentile(sorted_values, q: float) -> float:
+    """Linear-interpolated percentile of already sorted values, q in [0, 100]."""
+    if not sorted_values:
+        return float("nan")
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(samples) -> dict:
+    """Latency summary in seconds: min, max, mean, stddev and p50/p95/p99."""
+    values = sorted(samples)
+    return {
+        "rounds": len(values),
+        "min": values[0] if values else float("nan"),
+        "max": values[-1] if values else float("nan"),
+        "mean": statistics.fmean(values) if values else float("nan"),
+        "stddev": statistics.stdev(values) if len(values) > 1 else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def write_results(path: str, suite: str, results: dict, config: dict, **extra):
+    """Writes a results file: run metadata plus {benchmark name: summary} in seconds, and any `extra` keys."""
+    payload = {
+        "format": RESULTS_FORMAT_VERSION,
+        "suite": suite,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+        "results": results,
+        **extra,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+    print(f"\nResults written to {path}")
+
+
+def ms(seconds: float) -> str:
+    return f"{seconds * 1000:10.2f}"
@@ -0,0 +1,65 @@
+"""
+Compares two benchmark results files written with --json by bench_render.py or load_test.py.
+
+Prints the change of a latency statistic (and of throughput, for load runs) per benchmark,
+and exits with status 1 when any benchmark got slower than --threshold percent.
+
+    python benchmarks/compare.py benchmarks/results/baseline.json benchmarks/results/current.json [--stat p95]
+"""
+import argparse
+import json
+import math
+import sys
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def change(before, after):
+    """Relative change in percent, or None when either side has no data."""
+    if not before or math.isnan(before) or after is None or math.isnan(after):
+        return None
+    return (after - before) / before * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--stat", default="p50", choices=["min", "mean", "p50", "p95", "p99", "max"])
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent slowdown counted as a regression")
+    args = parser.parse_args()
+
+    baseline, current = load(args.baseline), load(args.current)
+    if baseline["suite"] != current["suite"]:
+        sys.exit(f"Cannot compare a {baseline['suite']} run with a {current['suite']} run.")
+    print(f"{baseline['suite']}: {baseline.get('commit')} ({baseline['created_at']}) -> {current.get('commit')} ({current['created_at']})")
+    print(f"\n{'Benchmark':<34}{args.stat + ' before':>14}{'after':>12}{'change':>9}{'req/s change':>14}")
+
+    regressions = []
+    for name in sorted(set(baseline["results"]) & set(current["results"])):
+        before, after = baseline["results"][name], current["results"][name]
+        latency_change = change(before[args.stat], after[args.stat])
+        throughput_change = change(before.get("throughput_rps"), after.get("throughput_rps"))
+        flag = ""
+        if latency_change is not None and latency_change > args.threshold:
+            regressions.append(name)
+            flag = "  slower"
+        print(f"{name:<34}{before[args.stat] * 1000:11.2f} ms{after[args.stat] * 1000:9.2f} ms"
+              f"{_percent(latency_change):>9}{_percent(throughput_change):>14}{flag}")
+
+    for name in sorted(set(baseline["results"]) ^ set(current["results"])):
+        print(f"{name:<34}  only in {'baseline' if name in baseline['results'] else 'current'}")
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) more than {args.threshold:g}% slower: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+def _percent(value):
+    return "n/a" if value is None else f"{value:+.1f}%"
+
+
+if __name__ == "__main__":
+    main()
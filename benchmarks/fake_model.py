@@ -0,0 +1,70 @@
+"""
+Offline stand-in for the Gemini client, for the tests, benchmarks and local runs. Select it with
+
+    MODEL_BACKEND=fake_model:create_fake_backend
+
+with this directory on the import path, e.g. `gunicorn --pythonpath benchmarks app:app`.
+FAKE_MODEL_LATENCY, FAKE_MODEL_CHUNK_SIZE and FAKE_MODEL_TOKEN_RATE (or FAKE_MODEL_CHUNK_DELAY)
+set its pacing.
+"""
+import asyncio
+import os
+import re
+import time
+from types import SimpleNamespace
+
+
+class FakeModelClient:
+    """
+    Streams canned OUTPUT_FORMAT text, or for "Compare ..." prompts a table with a column per
+    food, at a configurable latency and chunk rate through the same interface as genai.Client.
+    """
+    CHARS_PER_TOKEN = 4  # rough average for English text, to express chunk pacing as a token rate
+
+    def __init__(self, latency=0.5, chunk_size=80, chunk_delay=0.02):
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.models = SimpleNamespace(generate_content_stream=self._generate_content_stream)
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content_stream=self._agenerate_content_stream))
+
+    def _response_text(self, contents, config) -> str:
+        prompt = contents[0].parts[0].text
+        if prompt.startswith("Compare "):
+            foods = re.findall(r"[^,]+", prompt.removeprefix("Compare ").replace(" and ", ","))
+            header = "".join(f"<th>{food.strip()}</th>" for food in foods)
+            rows = "".join(f"<tr><td>{metric}</td>" + "<td>-</td>" * len(foods) + "</tr>" for metric in (
+                "Calories (kcal)", "Protein (g)", "Carbohydrates (g)", "Fiber (g)", "Sugars (g)",
+                "Fat (g)", "Key Vitamin", "Key Mineral", "Best For"))
+            return f"<table><thead><tr><th>Nutritional Metric (per 100g)</th>{header}</tr></thead><tbody>{rows}</tbody></table>"
+        return config.system_instruction.split("## OUTPUT_FORMAT\n---\n", 1)[-1].lstrip("\n")
+
+    def _chunks(self, contents, config):
+        text = self._response_text(contents, config)
+        return [SimpleNamespace(text=text[i:i + self.chunk_size]) for i in range(0, len(text), self.chunk_size)]
+
+    def _generate_content_stream(self, model, contents, config):
+        time.sleep(self.latency)
+        for chunk in self._chunks(contents, config):
+            yield chunk
+            time.sleep(self.chunk_delay)
+
+    async def _agenerate_content_stream(self, model, contents, config):
+        async def stream():
+            await asyncio.sleep(self.latency)
+            for chunk in self._chunks(contents, config):
+                yield chunk
+                await asyncio.sleep(self.chunk_delay)
+        return stream()
+
+
+def create_fake_backend(config):
+    chunk_size = int(os.getenv("FAKE_MODEL_CHUNK_SIZE", "80"))
+    # FAKE_MODEL_TOKEN_RATE (tokens per second) paces the chunks instead of FAKE_MODEL_CHUNK_DELAY.
+    token_rate = float(os.getenv("FAKE_MODEL_TOKEN_RATE", "0"))
+    return FakeModelClient(
+        latency=float(os.getenv("FAKE_MODEL_LATENCY", "0.5")),
+        chunk_size=chunk_size,
+        chunk_delay=chunk_size / (FakeModelClient.CHARS_PER_TOKEN * token_rate) if token_rate > 0
+        else float(os.getenv("FAKE_MODEL_CHUNK_DELAY", "0.02")),
+    )
@@ -0,0 +1,252 @@
+"""
+End-to-end load driver for the NutriAI endpoints, fully offline.
+
+By default the app is served in-process (Flask behind werkzeug's threaded server, or the ASGI
+app under uvicorn with --server asgi) with the fake model backend streaming the canned
+OUTPUT_FORMAT text at the given latency and token rate, from a fresh TEMP_DIR so every run
+starts cold. With --url, requests go to an already running server instead (start it with
+MODEL_BACKEND=fake_model:create_fake_backend and benchmarks/ on the
+import path for an offline run). Reports p50/p95/p99 latency and throughput per endpoint.
+
+    python benchmarks/load_test.py --duration 30 --concurrency 16 --json benchmarks/results/load.json
+    python benchmarks/load_test.py --server asgi --mix compare=1,batch=1 --latency 1.5
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import common
+import httpx
+
+FOODS = common.SAMPLE_FOODS + ["Oats", "Tofu", "Broccoli", "Eggs", "Chickpeas", "Brown Rice", "Avocado", "Kale"]
+
+DEFAULT_MIX = "recommendations=3,stream=3,compare=2,batch=1,download=1"
+
+
+class LoadRun:
+    """Shared state of a run: latencies per endpoint, error counts and download tokens seen so far."""
+    def __init__(self, args):
+        self.args = args
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.tokens = []
+        self.issued = 0
+        self._lock = threading.Lock()
+        endpoints = [entry.split("=") for entry in args.mix.split(",")]
+        self.endpoints = [name for name, _ in endpoints]
+        self.weights = [float(weight) for _, weight in endpoints]
+        unknown = set(self.endpoints) - set(REQUESTS)
+        if unknown:
+            raise SystemExit(f"Unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+
+    def take_request(self) -> bool:
+        with self._lock:
+            if self.args.requests and self.issued >= self.args.requests:
+                return False
+            self.issued += 1
+            return True
+
+    def record(self, name, seconds=None):
+        with self._lock:
+            if seconds is None:
+                self.errors[name] += 1
+            else:
+                self.latencies[name].append(seconds)
+
+    def add_token(self, token):
+        with self._lock:
+            self.tokens.append(token)
+
+    def random_token(self, rng):
+        with self._lock:
+            return rng.choice(self.tokens) if self.tokens else None
+
+    def pick_endpoint(self, rng):
+        name = rng.choices(self.endpoints, self.weights)[0]
+        # Nothing to download until a report has been generated.
+        return "recommendations" if name == "download" and not self.tokens else name
+
+    def profile(self, rng):
+        """One of --profiles distinct profiles, so the recommendation cache hit rate is under control."""
+        variant = rng.randrange(self.args.profiles)
+        return {**common.SAMPLE_PROFILE, "weight": str(50 + variant % 60), "height": str(150 + variant // 60)}
+
+
+def post_recommendations(client, run, rng):
+    response = client.post("/get_nutrient_recommendations", json=run.profile(rng))
+    if response.status_code == 200:
+        run.add_token(response.json()["download_token"])
+    return response.status_code
+
+
+def post_stream(client, run, rng):
+    """Streams the NDJSON report; also records the time to the first card."""
+    start = time.perf_counter()
+    first_card = None
+    done = False
+    with client.stream("POST", "/stream_nutrient_recommendations", json=run.profile(rng)) as response:
+        for line in response.iter_lines():
+            event = json.loads(line) if line else {}
+            if first_card is None and event.get("type") == "card":
+                first_card = time.perf_counter() - start
+            elif event.get("type") == "done":
+                done = True
+                run.add_token(event["download_token"])
+        status = response.status_code if done else 500
+    if first_card is not None:
+        run.record("stream:first_card", first_card)
+    return status
+
+
+def post_compare(client, run, rng):
+    return client.post("/compare_foods", json={"foods": rng.sample(FOODS, 2)}).status_code
+
+
+def post_batch(client, run, rng):
+    return client.post("/compare_foods/batch", json={"foods": rng.sample(FOODS, rng.randint(3, run.args.batch_size))}).status_code
+
+
+def get_download(client, run, rng):
+    return client.get(f"/download/{run.random_token(rng)}", params={"format": rng.choice(["pdf", "docx"])}).status_code
+
+
+REQUESTS = {
+    "recommendations": post_recommendations,
+    "stream": post_stream,
+    "compare": post_compare,
+    "batch": post_batch,
+    "download": get_download,
+}
+
+
+def worker(run, base_url, deadline, seed):
+    rng = random.Random(seed)
+    with httpx.Client(base_url=base_url, timeout=run.args.timeout) as client:
+        while time.perf_counter() < deadline and run.take_request():
+            name = run.pick_endpoint(rng)
+            start = time.perf_counter()
+            try:
+                status = REQUESTS[name](client, run, rng)
+            except httpx.HTTPError as e:
+                logging.debug(f"{name} failed: {e}")
+                status = None
+            run.record(name, time.perf_counter() - start if status == 200 else None)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args):
+    """Serves the app in-process from a fresh TEMP_DIR; returns (base URL, stop callable)."""
+    run_dir = tempfile.mkdtemp(prefix="nutri_load_")
+    tempfile.tempdir = run_dir
+    os.environ.update({
+        "MODEL_BACKEND": common.FAKE_MODEL_BACKEND,
+        "FAKE_MODEL_LATENCY": str(args.latency),
+        "FAKE_MODEL_TOKEN_RATE": str(args.token_rate),
+        "FAKE_MODEL_CHUNK_SIZE": str(args.chunk_size),
+    })
+    import app
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    port = _free_port()
+
+    if args.server == "asgi":
+        import uvicorn
+        server = uvicorn.Server(uvicorn.Config(app.asgi_app, host="127.0.0.1", port=port, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+
+        def stop():
+            server.should_exit = True
+            thread.join()
+    else:
+        from werkzeug.serving import make_server
+        server = make_server("127.0.0.1", port, app.app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+
+    def stop_and_clean():
+        stop()
+        app.app.extensions["nutri"].pdf_executor.shutdown(wait=True)  # background PDF renders still write to the run directory
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return f"http://127.0.0.1:{port}", stop_and_clean
+
+
+def report(run, elapsed):
+    results = {}
+    print(f"\n{'Endpoint (time in ms)':<24}{'Requests':>9}{'Errors':>8}{'Req/s':>9}{'P50':>10}{'P95':>10}{'P99':>10}{'Max':>10}")
+    names = sorted(set(run.latencies) | set(run.errors))
+    all_latencies = [seconds for name in names if ":" not in name for seconds in run.latencies[name]]
+    for name, latencies in [(name, run.latencies[name]) for name in names] + [("all", all_latencies)]:
+        errors = sum(count for key, count in run.errors.items() if ":" not in key) if name == "all" else run.errors[name]
+        stats = results[name] = {**common.summarize(latencies), "requests": len(latencies) + errors,
+                                 "errors": errors, "throughput_rps": len(latencies) / elapsed}
+        print(f"{name:<24}{stats['requests']:>9}{errors:>8}{stats['throughput_rps']:>9.1f}"
+              f"{common.ms(stats['p50'])}{common.ms(stats['p95'])}{common.ms(stats['p99'])}{common.ms(stats['max'])}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="target a running server instead of serving the app in-process")
+    parser.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi", help="in-process server")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0: no limit)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint=weight pairs: " + ", ".join(REQUESTS))
+    parser.add_argument("--profiles", type=int, default=50, help="distinct user profiles (fewer means more cache hits)")
+    parser.add_argument("--batch-size", type=int, default=5, help="most foods per batch comparison")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake model seconds before the first chunk")
+    parser.add_argument("--token-rate", type=float, default=1000.0, help="fake model tokens per second")
+    parser.add_argument("--chunk-size", type=int, default=80, help="fake model characters per chunk")
+    parser.add_argument("--timeout", type=float, default=120.0, help="client timeout per request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    run = LoadRun(args)
+    base_url, stop = (args.url.rstrip("/"), None) if args.url else start_server(args)
+    print(f"Driving {base_url} with {args.concurrency} clients for {args.duration:g}s, mix {args.mix}")
+    try:
+        start = time.perf_counter()
+        deadline = start + args.duration
+        threads = [threading.Thread(target=worker, args=(run, base_url, deadline, args.seed + i))
+                   for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        results = report(run, elapsed)
+        try:
+            server_stats = httpx.get(f"{base_url}/stats", timeout=10).json()
+        except (httpx.HTTPError, ValueError):
+            server_stats = None
+    finally:
+        if stop:
+            stop()
+
+    if args.json:
+        config = {key: value for key, value in vars(args).items() if key != "json"}
+        common.write_results(args.json, "load", results, {**config, "elapsed": elapsed}, server_stats=server_stats)
+
+
+if __name__ == "__main__":
+    main()
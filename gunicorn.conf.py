@@ -0,0 +1,12 @@
+"""
+Gunicorn settings, picked up from the working directory: `gunicorn app:app`.
+
+The app is imported once in the master with the document-export and model subsystems loaded
+(STARTUP_LOADING=eager), then workers are forked from it and share those modules copy-on-write
+instead of each importing them. Set STARTUP_LOADING=lazy to load them in each worker on first use.
+"""
+import os
+
+os.environ.setdefault("STARTUP_LOADING", "eager")
+
+preload_app = True
@@ -0,0 +1,633 @@
+"""
+Report model, parser and renderers (HTML, DOCX and PDF). Imports nothing from the app, so the
+cohort render processes can load it without building an app.
+"""
+import io
+import json
+import logging
+import os
+import queue
+import re
+import string
+import threading
+import time
+from functools import lru_cache
+# The document stack (docx, fpdf, pyphen) is imported where it is first used.
+
+# Load times of the lazily imported document stack; the app reports them with its startup timings.
+load_timings = {}
+
+def _record_load(phase: str, seconds: float):
+    load_timings[phase] = seconds
+    logging.info(f"Startup: {phase} took {seconds * 1000:.1f} ms")
+
+# --- Structured Report Model ---
+class ReportItem:
+    """A non-nutrient line of a section: "heading", "subheading", "group" (numbered heading), "list_item" or "text"."""
+    __slots__ = ("kind", "text", "indent")
+
+    def __init__(self, kind, text, indent):
+        self.kind = kind
+        self.text = text
+        self.indent = indent
+
+    def to_dict(self):
+        return {"kind": self.kind, "text": self.text, "indent": self.indent}
+
+
+class NutrientRecord:
+    """
+    A nutrient line such as "Histidine (H): 10-14 mg/kg | Sources: Meat, fish". `name`, `amount`,
+    `unit`, `sources` and `note` are the parsed values; `label` and `source_text` keep the text as
+    displayed. `position` is "item" for a list entry, "value" for the value of a numbered group
+    heading and "line" for a bare `|` line.
+    """
+    __slots__ = ("name", "amount", "unit", "sources", "note", "label", "source_text", "indent", "position")
+
+    def __init__(self, name, amount, unit, sources, note, label, source_text, indent, position):
+        self.name = name
+        self.amount = amount
+        self.unit = unit
+        self.sources = sources
+        self.note = note
+        self.label = label
+        self.source_text = source_text
+        self.indent = indent
+        self.position = position
+
+    def to_dict(self):
+        data = {"kind": "nutrient"}
+        for field in self.__slots__:
+            value = getattr(self, field)
+            if value not in (None, ()):
+                data[field] = list(value) if field == "sources" else value
+        return data
+
+
+class ReportSection:
+    """A top-level card of the report, e.g. "Macronutrients", with the value on its header line."""
+    __slots__ = ("title", "value", "items")
+
+    def __init__(self, title, value, items=None):
+        self.title = title
+        self.value = value
+        self.items = items if items is not None else []
+
+    def to_dict(self):
+        return {"title": self.title, "value": self.value, "items": [item.to_dict() for item in self.items]}
+
+
+class Report:
+    """Parsed report tree. Serializes to compact JSON for caching and the reports API."""
+    __slots__ = ("sections",)
+
+    def __init__(self, sections):
+        self.sections = sections
+
+    def to_dict(self):
+        return {"sections": [section.to_dict() for section in self.sections]}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, data: str) -> "Report":
+        sections = []
+        for section in json.loads(data)["sections"]:
+            items = []
+            for item in section["items"]:
+                if item["kind"] == "nutrient":
+                    items.append(NutrientRecord(
+                        item.get("name"), item.get("amount"), item.get("unit"), tuple(item.get("sources", ())),
+                        item.get("note"), item["label"], item.get("source_text"), item["indent"], item["position"]))
+                else:
+                    items.append(ReportItem(item["kind"], item["text"], item["indent"]))
+            sections.append(ReportSection(section["title"], section["value"], items))
+        return cls(sections)
+
+
+_AMOUNT_PATTERN = re.compile(r"([<>≤≥~]?\s*\d[\d.,]*(?:\s*[-–]\s*\d[\d.,]*)?)\s*([^\s\d(),;|\[\]][^\s(),;|\[\]]*)?")
+
+_VALUE_CARD_HEADER_PATTERN = re.compile(r"\*\*[^*]+:\*\*")
+
+def _parse_amount(value: str):
+    """Extracts (amount, unit) from text like "10-14 mg/kg/day" or "< 2300 mg"."""
+    match = _AMOUNT_PATTERN.search(value)
+    if not match:
+        return None, None
+    return match.group(1).replace(' ', ''), match.group(2)
+
+def _parse_sources(source_part: str):
+    """Splits the right-hand side of a `|` into (sources, note)."""
+    source_part = source_part.strip()
+    if source_part.startswith("Tip:"):
+        return (), source_part[len("Tip:"):].strip()
+    for prefix in ("Key Sources:", "Sources:"):
+        if source_part.startswith(prefix):
+            source_part = source_part[len(prefix):]
+            break
+    source_part = source_part.strip().strip('[]').strip()
+    if source_part.lower().startswith("e.g.,"):
+        source_part = source_part[len("e.g.,"):]
+    return tuple(source.strip() for source in source_part.split(',') if source.strip()), None
+
+def _nutrient_record(label, source_part, indent, position, name=None):
+    name_part, _, value = label.partition(':')
+    amount, unit = _parse_amount(value or label)
+    sources, note, source_text = (), None, None
+    if source_part is not None:
+        source_text = source_part.strip()
+        if position != "value":
+            # Group values keep their right-hand side verbatim (e.g. "0.8-1.2 g/kg"); other lines list sources or a tip.
+            sources, note = _parse_sources(source_part)
+            source_text = source_text.replace('Sources:', '').replace('Tip:', '').strip()
+    return NutrientRecord(name or name_part.strip(), amount, unit, sources, note, label, source_text, indent, position)
+
+
+class ReportParser:
+    """
+    Incremental parser that turns the AI's structured text into a Report tree.
+    Text may be fed in arbitrary chunks (including partial lines); state is kept between
+    feeds, and each call returns the sections that were completed by it.
+    """
+    def __init__(self):
+        self.sections = []
+        self._pending = ""
+        self._started = False
+        self._section = None  # The open section, or None before the first card header
+
+    @property
+    def report(self) -> Report:
+        return Report(self.sections)
+
+    def feed(self, chunk: str) -> list:
+        if not self._started:
+            # Mirrors text.strip(): leading whitespace of the whole report is ignored.
+            chunk = chunk.lstrip()
+            if not chunk:
+                return []
+            self._started = True
+        if '\n' not in chunk:
+            self._pending += chunk
+            return []
+
+        *lines, self._pending = (self._pending + chunk).split('\n')
+        finished = []
+        for line in lines:
+            section = self._process_line(line)
+            if section:
+                finished.append(section)
+        return finished
+
+    def close(self) -> list:
+        """Flushes the buffered partial line and the open section at the end of the text."""
+        finished = []
+        if self._pending:
+            section = self._process_line(self._pending)
+            if section:
+                finished.append(section)
+            self._pending = ""
+        if self._section is not None:
+            finished.append(self._section)
+            self._section = None
+        return finished
+
+    def _process_line(self, line: str):
+        """Handles one complete line and returns the previous section if this line closed it."""
+        stripped = line.strip()
+        if not stripped:
+            return None
+
+        indent_level = len(line) - len(line.lstrip(' '))
+        # Card headers are top-level bold titles, optionally followed by a value ("**BMI:** 22.5 kg/m²").
+        is_card_header = indent_level == 0 and (
+            (stripped.startswith('**') and stripped.endswith('**') and ':' in stripped)
+            or _VALUE_CARD_HEADER_PATTERN.match(stripped) is not None)
+
+        if is_card_header:
+            finished_section = self._section
+            parts = stripped.replace('**', '').split(':', 1)
+            self._section = ReportSection(parts[0].strip(), parts[1].strip())
+            self.sections.append(self._section)
+            return finished_section
+
+        if self._section is None:
+            return None
+        items = self._section.items
+
+        # Indented, bolded, numbered list items with a colon are Macronutrient-style group headings
+        # (e.g., "**1. Carbohydrates:** value").
+        if stripped.startswith('**') and re.match(r'\*\*\d\.', stripped) and ':' in stripped:
+            parts = stripped.replace('**', '').split(':', 1)
+            header_text = parts[0].strip() + ':'
+            value_text = parts[1].strip() if len(parts) > 1 else ""
+            items.append(ReportItem("group", header_text, indent_level))
+            group_name = re.sub(r'^\d+\.\s*', '', parts[0].strip())
+            if '|' in value_text:
+                label, source_part = value_text.split('|', 1)
+                items.append(_nutrient_record(label.strip(), source_part, indent_level, "value", name=group_name))
+            elif value_text:
+                items.append(_nutrient_record(value_text, None, indent_level, "value", name=group_name))
+        elif stripped.startswith('**') and stripped.endswith('**') and ':' in stripped:
+            items.append(ReportItem("heading" if indent_level < 8 else "subheading", stripped.replace('**', ''), indent_level))
+        elif stripped.startswith('-'):
+            item_text = stripped.replace('**', '')[1:].strip()
+            if '|' in item_text:
+                parts = item_text.split('|', 1)
+                items.append(_nutrient_record(parts[0].strip(), parts[1], indent_level, "item"))
+            else:
+                items.append(ReportItem("list_item", item_text, indent_level))
+        elif '|' in stripped:
+            parts = stripped.replace('**', '').split('|', 1)
+            items.append(_nutrient_record(parts[0].strip(), parts[1], indent_level, "line"))
+        else:
+            items.append(ReportItem("text", stripped.replace('**', ''), indent_level))
+        return None
+
+
+def parse_report(text: str) -> Report:
+    parser = ReportParser()
+    parser.feed(text)
+    parser.close()
+    return parser.report
+
+
+# --- Report Renderers ---
+SECTION_ICONS = {
+    "BMI": "fa-weight", "ESTIMATED DAILY CALORIES": "fa-fire",
+    "MACRONUTRIENTS": "fa-pizza-slice", "MICRONUTRIENTS": "fa-pills",
+    "OTHER KEY COMPOUNDS": "fa-tint", "ACTIONABLE ADVICE & RECOMMENDATIONS": "fa-clipboard-check"
+}
+
+def render_section_html(section: ReportSection) -> str:
+    """Renders one report section as a collapsible result card."""
+    card_id, icon = section.title.lower().replace(' ', '_').replace('&', 'and'), SECTION_ICONS.get(section.title.upper(), "fa-info-circle")
+    out = [f"""<div class='result-card' id='{card_id}'>
+    <button class='result-card-header' onclick='app.toggleCardBody("{card_id}")'>
+        <span><i class='fas {icon}'></i> {section.title}</span>
+        <i class='fas fa-chevron-down card-chevron'></i>
+    </button>
+    <div class='result-card-body'>"""]
+    if section.value:
+        out.append(f"<p class='main-value'>{section.value}</p>\n")
+
+    for item in section.items:
+        margin = item.indent * 2
+        if isinstance(item, NutrientRecord):
+            if item.position != "line":
+                margin += 10
+            if item.source_text is None:
+                out.append(f"<p style='margin-left: {margin}px;'>{item.label}</p>\n")
+            else:
+                out.append(f"""<div class='nutrient-item' style='margin-left: {margin}px;'>
+    <span class='nutrient-name'>{item.label}</span>
+    <span class='nutrient-source'>{item.source_text}</span>
+</div>\n""")
+        elif item.kind in ("group", "heading", "subheading"):
+            tag = "h4" if item.kind == "subheading" else "h3"
+            out.append(f"<{tag} class='section-heading' style='margin-left: {margin}px;'>{item.text}</{tag}>\n")
+        elif item.kind == "list_item":
+            out.append(f"<p class='list-item' style='margin-left: {margin}px;'>• {item.text}</p>\n")
+        else:
+            out.append(f"<p style='margin-left: {margin}px;'>{item.text}</p>\n")
+
+    out.append("</div></div>\n")
+    return "".join(out)
+
+def report_lines(report: Report):
+    """Yields (indent, text) lines for the document exporters; blank lines separate sections."""
+    for index, section in enumerate(report.sections):
+        if index:
+            yield 0, ""
+        yield 0, f"{section.title}: {section.value}" if section.value else f"{section.title}:"
+        for item in section.items:
+            if isinstance(item, NutrientRecord):
+                if item.position == "value":
+                    text = f"{item.label} | {item.source_text}" if item.source_text else item.label
+                    yield item.indent + 4, text
+                    continue
+                detail = f"Tip: {item.note}" if item.note else f"Sources: {', '.join(item.sources)}"
+                yield item.indent, f"{'- ' if item.position == 'item' else ''}{item.label} | {detail}"
+            elif item.kind == "list_item":
+                yield item.indent, f"- {item.text}"
+            else:
+                yield item.indent, item.text
+
+
+class RecommendationHTMLFormatter:
+    """
+    Incremental HTML renderer for streamed reports: feeds a ReportParser and returns the
+    HTML of each card as soon as its section is complete.
+    """
+    def __init__(self):
+        self.parser = ReportParser()
+
+    @property
+    def report(self) -> Report:
+        return self.parser.report
+
+    def feed(self, chunk: str) -> list:
+        return [render_section_html(section) for section in self.parser.feed(chunk)]
+
+    def close(self) -> list:
+        return [render_section_html(section) for section in self.parser.close()]
+
+
+def render_report_html(report: Report) -> str:
+    return "".join(render_section_html(section) for section in report.sections)
+
+
+# --- Document Exporters ---
+def report_to_docx(report: Report) -> bytes:
+    """Converts a parsed report to a DOCX document with specific A4 landscape formatting."""
+    from docx import Document
+    from docx.shared import Inches, Mm
+    doc = Document()
+    section = doc.sections[0]
+    section.orientation = 1
+    section.page_width = Inches(11.69)
+    section.page_height = Inches(8.27)
+    section.top_margin = Inches(0.55)
+    section.bottom_margin = Inches(0.55)
+    section.left_margin = Inches(0.55)
+    section.right_margin = Inches(0.55)
+    for indent, text in report_lines(report):
+        p = doc.add_paragraph(text)
+        p.paragraph_format.space_before = 0
+        p.paragraph_format.space_after = 0
+        if indent:
+            p.paragraph_format.left_indent = Mm(indent * PDF_INDENT_MM_PER_SPACE)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    logging.info("Successfully converted report to DOCX.")
+    return buffer.getvalue()
+
+@lru_cache(maxsize=None)
+def _pdf_class():
+    """The FPDF subclass used for reports; fpdf is imported on the first call."""
+    start = time.perf_counter()
+    from fpdf import FPDF
+
+    class PDF(FPDF):
+        """Custom PDF class to remove default header and footer."""
+        def header(self): pass
+        def footer(self): pass
+
+    _record_load("pdf_export", time.perf_counter() - start)
+    return PDF
+
+PDF_INDENT_MM_PER_SPACE = 1.5
+PDF_FONT_PATH = os.path.join(os.path.dirname(__file__), 'static', 'fonts', 'DejaVuSerif.ttf')
+
+# Glyph widths per (family, style, size), filled lazily and shared by every render in the process.
+_GLYPH_WIDTH_TABLES = {}
+
+
+class RenderResources:
+    """
+    Process-wide registry of document rendering resources: the pyphen dictionary, the resolved
+    report font and a small pool of pre-built PDF page templates (page added, font loaded).
+    fpdf2 mutates a document's font while subsetting it on output, so a parsed font cannot be
+    shared between documents; instead a background thread keeps ready templates in the pool
+    and the TTF parse happens off the request path.
+    """
+    def __init__(self, font_path, template_pool_size=2):
+        self.font_path = font_path if os.path.isfile(font_path) else None
+        if not self.font_path:
+            logging.warning(f"Report font not found at {font_path}; PDFs will fall back to Arial.")
+        self._templates = queue.Queue(maxsize=template_pool_size)
+        self._lock = threading.Lock()
+        self._refilling = False
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Threads do not survive fork; a refill that was running in the parent is gone.
+        self._lock = threading.Lock()
+        self._refilling = False
+
+    @property
+    def hyphenator(self):
+        return _hyphenator()
+
+    def _build_template(self):
+        pdf = _pdf_class()(orientation='L', unit='mm', format='A4')
+        pdf.add_page()
+        if self.font_path:
+            pdf.add_font('DejaVuSerif', '', self.font_path, uni=True)
+            pdf.set_font('DejaVuSerif', size=12)
+        else:
+            pdf.set_font('Arial', size=12)
+        return pdf
+
+    def _refill_templates(self):
+        try:
+            while not self._templates.full():
+                self._templates.put_nowait(self._build_template())
+        except queue.Full:
+            pass
+        except Exception as e:
+            logging.error(f"Failed to pre-build PDF templates: {e}", exc_info=True)
+        finally:
+            self._refilling = False
+
+    def new_pdf(self):
+        """Returns a fresh, ready-to-write PDF document and schedules a replacement template."""
+        try:
+            pdf = self._templates.get_nowait()
+        except queue.Empty:
+            pdf = self._build_template()
+        with self._lock:
+            if not self._refilling:
+                self._refilling = True
+                threading.Thread(target=self._refill_templates, name="pdf-templates", daemon=True).start()
+        return pdf
+
+    def warm_up(self):
+        """Eagerly loads every resource, logging how long each one took."""
+        start = time.perf_counter()
+        self.hyphenator
+        template_start = time.perf_counter()
+        self._refill_templates()
+        try:
+            pdf = self._templates.get_nowait()
+        except queue.Empty:
+            # Building the templates failed (already logged) or a render took the last one.
+            pdf = None
+        if pdf is not None:
+            # Pre-measure the characters that make up nearly all report text.
+            LineWrapper(pdf).width(string.printable + "²µ–—“”’")
+            try:
+                self._templates.put_nowait(pdf)
+            except queue.Full:
+                pass
+        logging.info(f"Built {self._templates.qsize()} PDF templates in {(time.perf_counter() - template_start) * 1000:.1f} ms")
+        _record_load("render_resources", time.perf_counter() - start)
+
+
+@lru_cache(maxsize=1)
+def _hyphenator():
+    """The pyphen dictionary, loaded on first use and shared by every render in the process."""
+    start = time.perf_counter()
+    import pyphen
+    hyphenator = pyphen.Pyphen(lang='en_US')
+    logging.info(f"Loaded hyphenation dictionary in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return hyphenator
+
+@lru_cache(maxsize=8192)
+def _hyphenation_points(word: str) -> tuple:
+    """Memoized pyphen hyphenation positions for a word."""
+    return tuple(int(position) for position in _hyphenator().positions(word))
+
+
+class LineWrapper:
+    """
+    Greedy, hyphenation-aware line breaker for FPDF. Word widths are summed from a cached
+    per-font glyph table instead of re-measuring the growing line for every word.
+    """
+    def __init__(self, pdf):
+        self.pdf = pdf
+        font_key = (pdf.font_family, pdf.font_style, pdf.font_size_pt)
+        self._widths = _GLYPH_WIDTH_TABLES.setdefault(font_key, {})
+        self._space_width = self.width(' ')
+
+    def width(self, text: str) -> float:
+        widths = self._widths
+        total = 0.0
+        for char in text:
+            char_width = widths.get(char)
+            if char_width is None:
+                char_width = widths[char] = self.pdf.get_string_width(char)
+            total += char_width
+        return total
+
+    def _split_to_fit(self, word: str, available: float):
+        """Returns (head_with_hyphen, rest) for the longest hyphenated prefix that fits, or None."""
+        for position in reversed(_hyphenation_points(word)):
+            head = word[:position] + '-'
+            if self.width(head) <= available:
+                return head, word[position:]
+        return None
+
+    def wrap(self, text: str, max_width: float) -> list:
+        lines, line, line_width = [], [], 0.0
+        for word in text.split():
+            word_width = self.width(word)
+            gap = self._space_width if line else 0.0
+            if line_width + gap + word_width <= max_width:
+                line.append(word)
+                line_width += gap + word_width
+                continue
+
+            # Word overflows: hyphenate onto the current line if a prefix fits, then break.
+            split = self._split_to_fit(word, max_width - line_width - gap)
+            if split:
+                line.append(split[0])
+                word = split[1]
+            if line:
+                lines.append(' '.join(line))
+            # Words longer than a whole line are broken at hyphenation points where possible.
+            while self.width(word) > max_width:
+                split = self._split_to_fit(word, max_width)
+                if not split:
+                    break
+                lines.append(split[0])
+                word = split[1]
+            line, line_width = [word], self.width(word)
+        if line:
+            lines.append(' '.join(line))
+        return lines
+
+
+def report_to_pdf(report: Report, resources: RenderResources) -> bytes:
+    """
+    Renders a parsed report straight to an A4 landscape PDF on a template from `resources`. Each
+    line's indentation level becomes a left indent, so the report's nesting survives without a
+    DOCX round trip.
+    """
+    pdf = resources.new_pdf()
+
+    base_left = pdf.l_margin
+    max_width = pdf.w - pdf.r_margin
+    wrapper = LineWrapper(pdf)
+
+    for indent, text in report_lines(report):
+        if not text:
+            pdf.ln(5)
+            continue
+
+        indent_mm = indent * PDF_INDENT_MM_PER_SPACE
+        usable_width = max_width - (base_left + indent_mm)
+
+        for line in wrapper.wrap(text, usable_width):
+            pdf.set_x(base_left + indent_mm)
+            pdf.cell(0, 5, line)
+            pdf.ln(5)
+
+    pdf_bytes = bytes(pdf.output())
+    logging.info("Successfully converted report to PDF with indentations preserved.")
+    return pdf_bytes
+
+
+# --- Cohort Rendering ---
+COHORT_REPORT_HTML = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<title>NutriAI Report</title>
+<link href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css" rel="stylesheet">
+<style>{styles}</style>
+</head>
+<body>
+<main style="max-width: 960px; margin: 2rem auto; padding: 0 1rem;">
+{cards}</main>
+<script>
+const app = {{toggleCardBody: id => document.getElementById(id).classList.toggle('open')}};
+document.querySelectorAll('.result-card').forEach(card => card.classList.add('open'));
+</script>
+</body>
+</html>
+"""
+
+# This render process's resources; set by init_render_process.
+_process_resources = None
+
+@lru_cache(maxsize=1)
+def _site_stylesheet() -> str:
+    with open(os.path.join(os.path.dirname(__file__), "static", "css", "styles.css"), encoding="utf-8") as f:
+        return f.read()
+
+def init_render_process(parent_pid: int, template_pool_size: int = 2):
+    """
+    Initializer of the cohort render processes: gives the process its own RenderResources, and makes
+    it exit once the job's process is gone, even if it was killed without shutting the pool down.
+    """
+    global _process_resources
+    _process_resources = RenderResources(PDF_FONT_PATH, template_pool_size=template_pool_size)
+
+    def watch_parent():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=watch_parent, name="parent-watch", daemon=True).start()
+
+def render_cohort_files(report_text: str, file_formats, resources=None) -> dict:
+    """
+    Renders one report in each of `file_formats` and returns {format: bytes}, the PDF with `resources`
+    or else the render process's own. Runs in the cohort render processes, so it takes the report
+    text rather than the parsed tree.
+    """
+    if resources is None:
+        resources = _process_resources
+    report = parse_report(report_text)
+    files = {}
+    for file_format in file_formats:
+        if file_format == "html":
+            html = COHORT_REPORT_HTML.format(styles=_site_stylesheet(), cards=render_report_html(report))
+            files[file_format] = html.encode('utf-8')
+        elif file_format == "txt":
+            files[file_format] = report_text.encode('utf-8')
+        elif file_format == "pdf":
+            files[file_format] = report_to_pdf(report, resources)
+        else:
+            files[file_format] = report_to_docx(report)
+    return files
@@ -145,24 +145,72 @@ class NutriApp {
 
         this.switchSection('results');
         this.showLoading(true, 'results-content', 'Analyzing your profile & generating report...');
+        this.downloadToken = null;
+        document.getElementById('downloadBtn').style.display = 'none';
 
         try {
-            const response = await axios.post('/get_nutrient_recommendations', formData);
-            document.getElementById('results-content').innerHTML = response.data.recommendations;
+            const response = await fetch('/stream_nutrient_recommendations', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(formData)
+            });
+            if (!response.ok || !response.body) {
+                const body = await response.json().catch(() => ({}));
+                throw new Error(body.error || 'Failed to fetch recommendations.');
+            }
 
-            this.downloadToken = response.data.download_token;
+            const resultsContent = document.getElementById('results-content');
+            let firstCard = true;
+            let fallbackReport = false;
+            await this.readNdjsonStream(response.body, (event) => {
+                if (event.type === 'card') {
+                    if (firstCard) {
+                        resultsContent.innerHTML = '';
+                        firstCard = false;
+                    }
+                    resultsContent.insertAdjacentHTML('beforeend', event.html);
+                } else if (event.type === 'done') {
+                    this.downloadToken = event.download_token;
+                    fallbackReport = Boolean(event.fallback);
+                } else if (event.type === 'error') {
+                    throw new Error(event.error);
+                }
+            });
+
+            if (!this.downloadToken) throw new Error('The report stream ended unexpectedly.');
             const downloadBtn = document.getElementById('downloadBtn');
             downloadBtn.style.display = 'inline-flex';
 
-            this.showToast('Report generated successfully!', 'success');
+            if (fallbackReport) {
+                this.showToast('The AI service is unavailable. Showing calculated targets with general food sources.', 'info');
+            } else {
+                this.showToast('Report generated successfully!', 'success');
+            }
         } catch (error) {
             console.error(error);
-            const errorMessage = error.response?.data?.error || 'Failed to fetch recommendations.';
+            const errorMessage = error.message || 'Failed to fetch recommendations.';
             document.getElementById('results-content').innerHTML = `<div class="no-data error"><i class="fas fa-exclamation-triangle"></i><h3>Error</h3><p>${errorMessage}</p></div>`;
             this.showToast('An error occurred.', 'error');
         }
     }
 
+    async readNdjsonStream(body, onEvent) {
+        const reader = body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            for (const line of lines) {
+                if (line.trim()) onEvent(JSON.parse(line));
+            }
+            if (done) break;
+        }
+        if (buffer.trim()) onEvent(JSON.parse(buffer));
+    }
+
     async handleCompare(event) {
         event.preventDefault();
         const food1 = document.getElementById('food1').value.trim();
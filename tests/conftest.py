@@ -0,0 +1,36 @@
+"""
+Runs the tests offline against a throwaway TEMP_DIR: the fake model backend of
+benchmarks/fake_model.py, no cross-worker metrics file, and for each test an app of its own
+whose caches and reports start empty.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+os.environ["MODEL_BACKEND"] = "fake_model:create_fake_backend"
+os.environ.setdefault("FAKE_MODEL_LATENCY", "0")
+os.environ["METRICS_MULTIPROCESS"] = "0"
+tempfile.tempdir = tempfile.mkdtemp(prefix="nutri-tests-")
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import app  # noqa: E402
+
+
+@pytest.fixture
+def flask_app(tmp_path):
+    return app.create_app({"UPLOAD_FOLDER": str(tmp_path / "files"), "PRERENDER_PDF": False})
+
+
+@pytest.fixture
+def services(flask_app):
+    return flask_app.extensions["nutri"]
+
+
+@pytest.fixture(autouse=True)
+def app_context(flask_app):
+    """The module-level subsystems (app.model_gateway, app.comparison_cache, ...) resolve to the test's app."""
+    with flask_app.app_context():
+        yield
@@ -0,0 +1,46 @@
+"""create_app(): every app is built with subsystems of its own, under its own UPLOAD_FOLDER."""
+import asyncio
+import json
+import os
+
+import app
+
+
+def test_apps_do_not_share_caches_or_storage(tmp_path):
+    first = app.create_app({"UPLOAD_FOLDER": str(tmp_path / "first"), "REPORT_STORE": "sqlite", "PRERENDER_PDF": False})
+    second = app.create_app({"UPLOAD_FOLDER": str(tmp_path / "second"), "RESPONSE_CACHE_DISK": False})
+
+    with first.app_context():
+        app.recommendation_cache.set("key", "first")
+        token = app._save_report("## Summary\nRest well.")
+    with second.app_context():
+        assert app.recommendation_cache.get("key") is None
+        assert app.report_store.get_metadata(token) is None
+    assert first.extensions["nutri"].report_store.get_metadata(token) is not None
+    assert {"reports.sqlite3", "response_cache.sqlite3"} <= set(os.listdir(tmp_path / "first"))
+    assert os.listdir(tmp_path / "second") == ["reports"]
+
+
+def test_test_config_overrides_the_environment(flask_app):
+    flask_app = app.create_app({"UPLOAD_FOLDER": flask_app.config['UPLOAD_FOLDER'], "COMPARISON_BATCH_LIMIT": 3})
+    response = flask_app.test_client().post("/compare_foods/batch", json={"foods": ["a", "b", "c", "d"]})
+    assert response.status_code == 400 and "3" in response.get_json()["error"]
+
+
+def test_the_asgi_app_serves_with_its_flask_apps_subsystems(flask_app, services):
+    asgi_app = app.AsyncNutriApp(flask_app)
+    body = json.dumps({"foods": ["Kiwi", "Mango"]}).encode()
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/compare_foods"}
+    asyncio.run(asgi_app(scope, receive, send))
+    assert messages[0]["status"] == 200
+    assert "<table>" in json.loads(messages[1]["body"])["comparison"]
+    assert services.flight_groups["async_comparisons"].stats()["started"] == 1
+    assert services.comparison_cache.stats()["size"] == 1
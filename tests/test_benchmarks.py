@@ -0,0 +1,51 @@
+"""The offline benchmark suite: the fake model, latency summaries and comparing results files."""
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import app
+import common
+from fake_model import FakeModelClient
+
+COMPARE_SCRIPT = os.path.join(common.REPO_ROOT, "benchmarks", "compare.py")
+
+
+def test_the_fake_model_streams_the_output_format_in_chunks():
+    model = FakeModelClient(latency=0, chunk_size=50, chunk_delay=0)
+    request = app._recommendation_request(app._build_prompt_data(common.SAMPLE_PROFILE))
+    chunks = [chunk.text for chunk in model.models.generate_content_stream(**request)]
+
+    assert len(chunks) > 10 and all(len(chunk) <= 50 for chunk in chunks)
+    output_format = request["config"].system_instruction.split("## OUTPUT_FORMAT\n---\n", 1)[1]
+    assert "".join(chunks) == output_format.lstrip("\n") and "**Micronutrients:**" in output_format
+
+
+def test_the_fake_model_answers_comparisons_with_a_column_per_food():
+    model = FakeModelClient(latency=0, chunk_delay=0)
+    contents = [SimpleNamespace(parts=[SimpleNamespace(text="Compare Kiwi, Mango and Oats")])]
+    table = "".join(chunk.text for chunk in model.models.generate_content_stream("model", contents, None))
+    assert app.has_food_columns(app.format_comparison(table), 3)
+
+
+def test_the_sample_report_has_every_section():
+    titles = [section.title.upper() for section in app.parse_report(common.sample_report_text()).sections]
+    assert {"BMI", "MACRONUTRIENTS", "MICRONUTRIENTS", "ACTIONABLE ADVICE & RECOMMENDATIONS"} <= set(titles)
+
+
+def test_latency_summaries_interpolate_percentiles():
+    summary = common.summarize([i / 1000 for i in range(1, 101)])
+    assert (summary["rounds"], summary["min"], summary["max"]) == (100, 0.001, 0.1)
+    assert summary["p50"] == pytest.approx(0.0505) and summary["p99"] == pytest.approx(0.09901)
+
+
+@pytest.mark.parametrize("current_p50, status", [(0.0105, 0), (0.02, 1)])
+def test_compare_fails_on_a_slowdown_beyond_the_threshold(tmp_path, current_p50, status):
+    for name, p50 in (("baseline", 0.01), ("current", current_p50)):
+        common.write_results(str(tmp_path / f"{name}.json"), "render", {"render_pdf": {**common.summarize([p50]), "p50": p50}}, {})
+    result = subprocess.run([sys.executable, COMPARE_SCRIPT, str(tmp_path / "baseline.json"), str(tmp_path / "current.json")],
+                            capture_output=True, text=True)
+    assert result.returncode == status, result.stdout + result.stderr
+    assert "render_pdf" in result.stdout
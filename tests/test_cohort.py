@@ -0,0 +1,98 @@
+"""Cohort batch jobs: deduplication, result files, and resuming from the checkpoint."""
+import json
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import app
+import reports
+
+COHORT_CSV = """Patient ID,Age,Gender,Height,Weight,Activity Level,Dietary Preferences
+p1,34,Female,168,63,Lightly Active,Vegetarian
+p2,50,Male,180,90,Sedentary,None
+p3,34,female,168,63,lightly active,vegetarian
+"""
+
+
+@pytest.fixture
+def cohort(tmp_path):
+    input_path = tmp_path / "cohort.csv"
+    input_path.write_text(COHORT_CSV, encoding="utf-8")
+
+    def create(output_format="jsonl", file_formats=("txt",)):
+        return app.CohortJob.create(str(tmp_path / "job"), input_path=str(input_path), input_format="csv",
+                                    output_format=output_format, file_formats=list(file_formats),
+                                    result_path=str(tmp_path / f"result.{output_format}"))
+    return create
+
+
+@pytest.fixture
+def model(monkeypatch, services):
+    """Counts model calls; set `down` to make them fail. The cache is bypassed so every profile reaches the model."""
+    state = {"calls": 0, "down": False}
+
+    def stream_text(request):
+        state["calls"] += 1
+        if state["down"]:
+            raise app.ModelUnavailableError("model down")
+        yield "**Micronutrients:**\n    Model report\n"
+
+    monkeypatch.setattr(services.model_gateway, "stream_text", stream_text)
+    monkeypatch.setattr(services.recommendation_cache, "get", lambda key: None)
+    return state
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_identical_profiles_are_generated_once(cohort, model):
+    job = cohort(output_format="zip", file_formats=("html", "txt"))
+    app.run_cohort_job(job, render_processes=0)
+
+    assert model["calls"] == 2
+    assert (job.state["status"], job.state["rows"], job.state["unique_profiles"]) == ("done", 3, 2)
+    with zipfile.ZipFile(job.state["result_path"]) as archive:
+        manifest = [json.loads(line) for line in archive.read("manifest.jsonl").decode().splitlines()]
+        assert archive.read("00001_p1.txt") == archive.read("00003_p3.txt")
+    assert [row["files"] for row in manifest][0] == ["00001_p1.html", "00001_p1.txt"]
+
+
+def test_render_processes_render_without_importing_the_app(cohort, model):
+    job = cohort(output_format="zip", file_formats=("html", "pdf"))
+    app.run_cohort_job(job, render_processes=1)
+
+    with zipfile.ZipFile(job.state["result_path"]) as archive:
+        assert archive.read("00001_p1.pdf").startswith(b"%PDF")
+        assert b"result-card" in archive.read("00001_p1.html")
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=reports.init_render_process, initargs=(os.getpid(),)) as renderers:
+        assert renderers.submit(eval, "'app' in __import__('sys').modules").result() is False
+
+
+def test_resume_regenerates_local_fallbacks(cohort, model):
+    model["down"] = True
+    job = cohort()
+    app.run_cohort_job(job, render_processes=0)
+    rows = read_jsonl(job.state["result_path"])
+    assert job.state["fallbacks"] == 2 and all(row["fallback"] for row in rows)
+    assert "Model report" not in rows[0]["txt"]
+
+    model["down"] = False
+    job.update(status="queued")
+    app.run_cohort_job(job, render_processes=0)
+    rows = read_jsonl(job.state["result_path"])
+    assert job.state["fallbacks"] == 0 and not any(row["fallback"] for row in rows)
+    assert all("Model report" in row["txt"] for row in rows)
+
+
+def test_resume_skips_profiles_the_model_already_generated(cohort, model):
+    job = cohort()
+    app.run_cohort_job(job, render_processes=0)
+    job.update(status="queued")
+    app.run_cohort_job(job, render_processes=0)
+    assert model["calls"] == 2
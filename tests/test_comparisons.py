@@ -0,0 +1,83 @@
+"""
+Comparison tables are cached and served only as generated: a table's "winner" marks compare its
+foods with each other, so columns from different model calls are never combined.
+"""
+import re
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def model(monkeypatch, services):
+    """Answers comparison requests with a table whose cells name the foods compared together."""
+    prompts = []
+
+    def stream_text(request):
+        prompt = request["contents"][0].parts[0].text
+        prompts.append(prompt)
+        foods = [food.strip() for food in re.split(r",| and ", prompt.removeprefix("Compare ")) if food.strip()]
+        header = "".join(f"<th>{food}</th>" for food in foods)
+        together = "+".join(foods)
+        cells = "".join(f"<td>{food} vs {together}</td>" for food in foods)
+        yield f"<table><thead><tr><th>Nutritional Metric (per 100g)</th>{header}</tr></thead><tbody><tr><td>Protein (g)</td>{cells}</tr></tbody></table>"
+
+    monkeypatch.setattr(services.model_gateway, "stream_text", stream_text)
+    return prompts
+
+
+def test_batch_asks_for_every_food_in_one_call_after_a_pair_is_cached(model):
+    pair = app.coalesced_comparison(["Banana", "Chicken"])
+    batch = app.batch_comparison(["Banana", "Chicken", "Rice"])
+
+    assert model == ["Compare Banana and Chicken", "Compare Banana, Chicken and Rice"]
+    assert "Banana vs Banana+Chicken+Rice" in batch and "vs Banana+Chicken<" not in batch
+    assert app.cached_comparison(["Chicken", "Banana"]) == app.reorder_table_columns(pair, (1, 0))
+
+
+def test_batch_tables_are_cached_for_their_own_set_only(model):
+    batch = app.batch_comparison(["Kiwi", "Mango", "Oats"])
+    assert app.batch_comparison(["Oats", "Kiwi", "Mango"]) == app.reorder_table_columns(batch, (2, 0, 1))
+    assert app.cached_comparison(["Kiwi", "Mango"]) is None
+
+    app.coalesced_comparison(["Kiwi", "Mango"])
+    assert len(model) == 2
+
+
+def test_cached_tables_are_served_with_the_requesters_headers(model):
+    app.coalesced_comparison(["banana", "Apples"])
+    table = app.cached_comparison(["Banana", "apple"])
+
+    assert re.findall(r"<th>(.*?)</th>", table) == ["Nutritional Metric (per 100g)", "Banana", "apple"]
+    assert table.index("banana vs") < table.index("Apples vs")
+    assert len(model) == 1
+
+
+def test_column_labels_are_escaped():
+    table = "<table><tr><th>Metric</th><th scope='col'>x</th></tr><tr><td>Fat</td><td>1</td></tr></table>"
+    assert app.label_table_columns(table, ("<b>Fig</b>",)) == table.replace(">x<", ">&lt;b&gt;Fig&lt;/b&gt;<")
+
+
+def test_batch_rejects_a_table_with_the_wrong_columns(monkeypatch, services):
+    monkeypatch.setattr(services.model_gateway, "stream_text", lambda request: iter(["<table><tr><th>x</th></tr></table>"]))
+    with pytest.raises(app.ComparisonFormatError):
+        app.batch_comparison(["Pear", "Plum", "Fig"])
+    assert app.cached_comparison(["Pear", "Plum", "Fig"]) is None
+
+
+@pytest.mark.parametrize("name, normalized", [
+    ("Kiwis", "kiwi"), ("  Green   Apples ", "green apple"), ("Cherries", "cherry"),
+    ("Potatoes", "potato"), ("Hummus", "hummus"), ("Swiss chard", "swiss chard"), ("Quinoa", "quinoa"),
+    ("Molasses", "molasses"), ("Blackstrap molasses", "blackstrap molasses"), ("Grits", "grits"),
+    ("Cookies", "cookie"), ("Cookie", "cookie"), ("Quiches", "quiche"), ("Peaches", "peach"),
+    ("Glasses", "glass"), ("Cheeses", "cheese"), ("Radishes", "radish"), ("Boxes", "box"), ("Dates", "date"),
+])
+def test_food_names_normalize_to_singular_casefolded_keys(name, normalized):
+    assert app.normalize_food_name(name) == normalized
+
+
+@pytest.mark.parametrize("foods", [[{"a": 1}, "pear"], ["apple", "  "], ["apple"], "apple,pear"])
+def test_compare_rejects_anything_but_two_food_names(flask_app, foods):
+    response = flask_app.test_client().post("/compare_foods", json={"foods": foods})
+    assert response.status_code == 400
@@ -0,0 +1,84 @@
+"""
+Report downloads: PDFs are rendered straight from the parsed report, DOCX only when asked for, and
+each format once per report, then served again from the report store.
+"""
+import io
+from types import SimpleNamespace
+
+import pytest
+
+import app
+import reports
+
+REPORT_TEXT = """**BMI:** 22.3 (Normal weight)
+**Micronutrients:**
+    Vitamin D | Sources: Eggs, Mushrooms
+**Actionable Advice & Recommendations:**
+    - Walk for 30 minutes a day.
+"""
+
+
+def test_repeat_downloads_are_rendered_once(flask_app, monkeypatch):
+    renders = []
+
+    def convert(report):
+        renders.append(report)
+        return b"%PDF-1.4 rendered"
+    monkeypatch.setitem(app.REPORT_CONVERTERS, "pdf", convert)
+    token = app._save_report(REPORT_TEXT)
+    client = flask_app.test_client()
+
+    first, second = client.get(f"/download/{token}"), client.get(f"/download/{token}")
+    assert first.status_code == second.status_code == 200
+    assert first.data == second.data == b"%PDF-1.4 rendered"
+    assert len(renders) == 1
+
+
+def test_a_matching_etag_is_not_modified(flask_app):
+    token = app._save_report(REPORT_TEXT)
+    client = flask_app.test_client()
+
+    response = client.get(f"/download/{token}")
+    assert response.data.startswith(b"%PDF") and response.headers["Content-Disposition"].endswith(".pdf")
+    cached = client.get(f"/download/{token}", headers={"If-None-Match": response.headers["ETag"]})
+    assert cached.status_code == 304 and not cached.data
+
+
+def test_the_pdf_is_rendered_in_the_background_when_the_report_is_saved(tmp_path):
+    flask_app = app.create_app({"UPLOAD_FOLDER": str(tmp_path / "files"), "PRERENDER_PDF": True})
+    services = flask_app.extensions["nutri"]
+    with flask_app.app_context():
+        token = app._save_report(REPORT_TEXT)
+    services.pdf_executor.shutdown(wait=True)
+
+    metadata = services.report_store.get_metadata(token)
+    assert f"{metadata.digest[:16]}.pdf" in metadata.artifacts
+
+
+def test_pdf_lines_keep_the_reports_indentation():
+    report = reports.parse_report(REPORT_TEXT)
+    pdf = reports.RenderResources(reports.PDF_FONT_PATH)._build_template()
+    lines, cell = [], pdf.cell
+
+    def record_cell(width, height, text):
+        lines.append(((pdf.x - pdf.l_margin) / reports.PDF_INDENT_MM_PER_SPACE, text))
+        return cell(width, height, text)
+    pdf.cell = record_cell
+
+    assert reports.report_to_pdf(report, SimpleNamespace(new_pdf=lambda: pdf)).startswith(b"%PDF")
+    assert lines == [(indent, text) for indent, text in reports.report_lines(report) if text]
+    assert (4, "Vitamin D | Sources: Eggs, Mushrooms") in lines
+
+
+def test_docx_is_rendered_only_when_asked_for(flask_app, services):
+    from docx import Document
+    token = app._save_report(REPORT_TEXT)
+    client = flask_app.test_client()
+
+    assert client.get(f"/download/{token}").status_code == 200
+    assert not any(name.endswith(".docx") for name in services.report_store.get_metadata(token).artifacts)
+    response = client.get(f"/download/{token}?format=docx")
+    assert response.status_code == 200 and response.headers["Content-Disposition"].endswith(".docx")
+    paragraphs = {p.text: p.paragraph_format.left_indent for p in Document(io.BytesIO(response.data)).paragraphs}
+    assert paragraphs["Vitamin D | Sources: Eggs, Mushrooms"].mm == pytest.approx(4 * reports.PDF_INDENT_MM_PER_SPACE, abs=0.01)
+    assert client.get(f"/download/{token}?format=txt").status_code == 400
@@ -0,0 +1,175 @@
+"""
+The incremental formatter must render exactly what the original single-pass formatter did,
+whether the report arrives whole or in chunks split at arbitrary points.
+"""
+import random
+import re
+
+import pytest
+
+import app
+
+VALUE_CARD_HEADER = re.compile(r"\*\*[^*]+:\*\*")
+
+
+def baseline_format_recommendations_to_html(text: str) -> str:
+    """The single-pass formatter the incremental one replaced, kept as the reference output."""
+    html_output = ""
+    lines = text.strip().split('\n')
+
+    icon_map = {
+        "BMI": "fa-weight", "ESTIMATED DAILY CALORIES": "fa-fire",
+        "MACRONUTRIENTS": "fa-pizza-slice", "MICRONUTRIENTS": "fa-pills",
+        "OTHER KEY COMPOUNDS": "fa-tint", "ACTIONABLE ADVICE & RECOMMENDATIONS": "fa-clipboard-check"
+    }
+
+    in_card = False
+
+    for line in lines:
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        indent_level = len(line) - len(line.lstrip(' '))
+        is_card_header = stripped.startswith('**') and stripped.endswith('**') and ':' in stripped and indent_level == 0
+        # The one deliberate change since: top-level "**Title:** value" lines (BMI, calories) open cards too.
+        is_card_header = is_card_header or (indent_level == 0 and VALUE_CARD_HEADER.match(stripped) is not None)
+
+        if is_card_header:
+            if in_card:
+                html_output += "</div></div>\n"
+            parts = stripped.replace('**', '').split(':', 1)
+            title, content_on_same_line = parts[0].strip(), parts[1].strip()
+            card_id, icon = title.lower().replace(' ', '_').replace('&', 'and'), icon_map.get(title.upper(), "fa-info-circle")
+            html_output += f"""<div class='result-card' id='{card_id}'>
+    <button class='result-card-header' onclick='app.toggleCardBody("{card_id}")'>
+        <span><i class='fas {icon}'></i> {title}</span>
+        <i class='fas fa-chevron-down card-chevron'></i>
+    </button>
+    <div class='result-card-body'>"""
+            in_card = True
+            if content_on_same_line:
+                html_output += f"<p class='main-value'>{content_on_same_line}</p>\n"
+            continue
+
+        if not in_card:
+            continue
+
+        # This new condition specifically finds indented, bolded, numbered list items with a colon,
+        # which is the pattern for Macronutrient subheadings (e.g., "**1. Carbohydrates:** value").
+        is_macro_style_header = stripped.startswith('**') and re.match(r'\*\*\d\.', stripped) and ':' in stripped
+
+        if is_macro_style_header:
+            clean_line = stripped.replace('**', '')
+            parts = clean_line.split(':', 1)
+            header_text = parts[0].strip() + ':'
+            value_text = parts[1].strip() if len(parts) > 1 else ""
+
+            # Create the h3 tag for the header part
+            html_output += f"<h3 class='section-heading' style='margin-left: {indent_level * 2}px;'>{header_text}</h3>\n"
+
+            # If there was a value on the same line, process and display it
+            if value_text:
+                if '|' in value_text:
+                    value_parts = value_text.split('|', 1)
+                    html_output += f"""<div class='nutrient-item' style='margin-left: {indent_level * 2 + 10}px;'>
+    <span class='nutrient-name'>{value_parts[0].strip()}</span>
+    <span class='nutrient-source'>{value_parts[1].strip()}</span>
+</div>\n"""
+                else:
+                    html_output += f"<p style='margin-left: {indent_level * 2 + 10}px;'>{value_text}</p>\n"
+            continue # Important: We've handled this line, so skip to the next one
+
+        if stripped.startswith('**') and stripped.endswith('**') and ':' in stripped:
+            tag = "h3" if indent_level < 8 else "h4"
+            html_output += f"<{tag} class='section-heading' style='margin-left: {indent_level * 2}px;'>{stripped.replace('**', '')}</{tag}>\n"
+        elif stripped.startswith('-'):
+            item_text = stripped.replace('**', '')[1:].strip()
+            if '|' in item_text:
+                parts = item_text.split('|', 1)
+                source_part = parts[1].strip().replace('Sources:', '').replace('Tip:', '').strip()
+                html_output += f"""<div class='nutrient-item' style='margin-left: {indent_level * 2 + 10}px;'>
+    <span class='nutrient-name'>{parts[0].strip()}</span>
+    <span class='nutrient-source'>{source_part}</span>
+</div>\n"""
+            else:
+                html_output += f"<p class='list-item' style='margin-left: {indent_level * 2}px;'>• {item_text}</p>\n"
+        elif '|' in stripped:
+            parts = stripped.replace('**', '').split('|', 1)
+            source_part = parts[1].strip().replace('Sources:', '').replace('Tip:', '').strip()
+            html_output += f"""<div class='nutrient-item' style='margin-left: {indent_level * 2}px;'>
+    <span class='nutrient-name'>{parts[0].strip()}</span>
+    <span class='nutrient-source'>{source_part}</span>
+</div>\n"""
+        else:
+            html_output += f"<p style='margin-left: {indent_level * 2}px;'>{stripped.replace('**', '')}</p>\n"
+
+    if in_card:
+        html_output += "</div></div>\n"
+
+    return html_output
+
+
+EDGE_CASE_REPORT = """Here is your report:
+**BMI:** 22.5 kg/m² (Normal weight)
+**ESTIMATED DAILY CALORIES:**
+    1,800-2,000 kcal (maintenance)
+
+**MACRONUTRIENTS:**
+    **1. Carbohydrates:** 225-260 g | Sources: Oats, Brown Rice
+    **2. Protein:**
+        - **Total:** 60 g | Sources: Lentils, Tofu
+        **Timing:** spread over meals
+    - Fiber: 25 g | Tip: add beans
+**MICRONUTRIENTS:**
+    **Vitamins:**
+            **Deep Heading:**
+        - Vitamin D: 15 mcg | Sources: Sunlight, Eggs
+        Iron | Sources: Spinach
+    A plain line with **bold** words
+**ACTIONABLE ADVICE & RECOMMENDATIONS:**
+    - Drink water
+    - **Sodium:** keep added salt low
+"""
+
+
+def sample_reports():
+    template = app.SYSTEM_INSTRUCTION_NUTRITIONIST.split("## OUTPUT_FORMAT\n---\n", 1)[-1].lstrip("\n")
+    prompt_data = app._build_prompt_data({"age": "34", "gender": "Female", "height": "168", "weight": "63",
+                                          "activity_level": "Lightly Active"})
+    values = app.compute_local_values(app.parse_profile(prompt_data))
+    return {"template": template, "edge_cases": EDGE_CASE_REPORT,
+            "local_fallback": app.local_fallback_report(values, "Type 2 Diabetes")}
+
+
+def chunked(text: str, rng: random.Random):
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 120)
+        yield text[position:position + size]
+        position += size
+
+
+@pytest.mark.parametrize("name", sorted(sample_reports()))
+def test_whole_report_matches_baseline(name):
+    text = sample_reports()[name]
+    assert app.format_recommendations_to_html(text) == baseline_format_recommendations_to_html(text)
+
+
+@pytest.mark.parametrize("name", sorted(sample_reports()))
+@pytest.mark.parametrize("seed", range(20))
+def test_chunked_report_matches_baseline(name, seed):
+    text = sample_reports()[name]
+    formatter = app.RecommendationHTMLFormatter()
+    cards = []
+    for chunk in chunked(text, random.Random(seed)):
+        cards.extend(formatter.feed(chunk))
+    cards.extend(formatter.close())
+    assert "".join(cards) == baseline_format_recommendations_to_html(text)
+
+
+def test_cards_are_returned_as_soon_as_the_next_section_starts():
+    formatter = app.RecommendationHTMLFormatter()
+    assert formatter.feed("**BMI:** 22.5 kg/m²\n") == []
+    cards = formatter.feed("**ESTIMATED DAILY CALORIES:** 1,900 kcal\n")
+    assert len(cards) == 1 and "id='bmi'" in cards[0]
@@ -0,0 +1,59 @@
+"""
+Locally computed values are filled into the lines the template gives them, and nowhere else:
+advice that reuses a nutrient's label keeps the model's text.
+"""
+import random
+
+import pytest
+
+import app
+
+PROFILE = {"age": "34", "gender": "Female", "height": "168", "weight": "63", "activity_level": "Lightly Active"}
+
+MODEL_OUTPUT = """**Micronutrients:**
+    **2. Minerals:**
+        - **Potassium:** | Sources: Bananas, Beans
+        - **Sodium:** | Sources: Table salt, Bread
+        - **Iron:** | Sources: Lentils, Spinach
+**Other Key Compounds:**
+    - **Water:** | Tip: Drink through the day
+**Actionable Advice & Recommendations:**
+    **General Tips:**
+        - **Sodium:** Keep added salt low by seasoning with herbs.
+        - **Potassium:** Add a portion of beans or leafy greens to lunch.
+        - **Iron:** Pair lentils with vitamin C rich foods for absorption.
+    **Water:** Keep a bottle at your desk.
+"""
+
+
+@pytest.fixture
+def values():
+    return app.local_values_for(app._build_prompt_data(PROFILE))
+
+
+def fill(values, chunks):
+    filler = app.LocalValueFiller(values)
+    return "".join(filler.feed(chunk) for chunk in chunks) + filler.close()
+
+
+def test_values_are_filled_in_nutrient_sections(values):
+    lines = fill(values, [MODEL_OUTPUT]).split("\n")
+    assert f"        - **Potassium:** {values['Potassium']} | Sources: Bananas, Beans" in lines
+    assert f"        - **Sodium:** {values['Sodium']} | Sources: Table salt, Bread" in lines
+    assert f"    - **Water:** {values['Water']} | Tip: Drink through the day" in lines
+
+
+def test_advice_reusing_a_nutrient_label_is_kept(values):
+    advice = fill(values, [MODEL_OUTPUT]).split("**Actionable Advice & Recommendations:**", 1)[1]
+    assert advice == MODEL_OUTPUT.split("**Actionable Advice & Recommendations:**", 1)[1]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_chunk_boundaries_do_not_change_the_result(values, seed):
+    rng = random.Random(seed)
+    chunks, position = [], 0
+    while position < len(MODEL_OUTPUT):
+        size = rng.randint(1, 40)
+        chunks.append(MODEL_OUTPUT[position:position + size])
+        position += size
+    assert fill(values, chunks) == fill(values, [MODEL_OUTPUT])
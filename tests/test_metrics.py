@@ -0,0 +1,45 @@
+"""Metrics: stage timings and request counts on /metrics, summed across workers, and the Server-Timing header."""
+import sqlite3
+
+import app
+
+FOODS = {"foods": ["Kiwi", "Mango"]}
+
+
+def test_requests_stages_and_cache_hits_are_exported(flask_app):
+    client = flask_app.test_client()
+    client.post("/compare_foods", json=FOODS)
+    client.post("/compare_foods", json={"foods": FOODS["foods"][::-1]})
+
+    lines = client.get("/metrics").data.decode().splitlines()
+    assert "# TYPE nutri_stage_duration_seconds histogram" in lines
+    assert 'nutri_http_requests_total{endpoint="/compare_foods",method="POST",status="200"} 2' in lines
+    assert 'nutri_stage_duration_seconds_count{stage="compare"} 1' in lines
+    assert "nutri_model_time_to_first_chunk_seconds_count 1" in lines
+    assert 'nutri_cache_hit_ratio{cache="comparisons"} 0.5' in lines
+
+
+def test_server_timing_lists_the_stages_of_the_request(tmp_path):
+    flask_app = app.create_app({"UPLOAD_FOLDER": str(tmp_path / "files"), "SERVER_TIMING": True})
+    response = flask_app.test_client().post("/compare_foods", json=FOODS)
+
+    stages = [entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")]
+    assert stages == ["compare", "total"]
+
+
+def test_workers_are_summed_and_stale_gauges_dropped(tmp_path):
+    db_path = str(tmp_path / "metrics.sqlite3")
+    first, second = (app.MetricsRegistry(app.METRIC_FAMILIES, db_path=db_path, publish_interval=5) for _ in range(2))
+    first.inc("nutri_http_requests_total", endpoint="/")
+    first.inc("nutri_http_requests_in_flight")
+    second.inc("nutri_http_requests_total", 2, endpoint="/")
+    second.inc("nutri_http_requests_in_flight")
+    second.publish()
+
+    lines = first.render().splitlines()
+    assert 'nutri_http_requests_total{endpoint="/"} 3' in lines and "nutri_http_requests_in_flight 2" in lines
+
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE metrics SET updated_at = updated_at - 60")
+    lines = first.render().splitlines()
+    assert 'nutri_http_requests_total{endpoint="/"} 3' in lines and "nutri_http_requests_in_flight 1" in lines
@@ -0,0 +1,71 @@
+"""ModelGateway: an abandoned half-open trial call must not leave the circuit breaker stuck."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+
+def _backend():
+    def generate_content_stream(**request):
+        for text in ("a", "b", "c"):
+            yield SimpleNamespace(text=text)
+
+    async def agenerate_content_stream(**request):
+        async def stream():
+            for text in ("a", "b", "c"):
+                yield SimpleNamespace(text=text)
+        return stream()
+
+    return SimpleNamespace(models=SimpleNamespace(generate_content_stream=generate_content_stream),
+                           aio=SimpleNamespace(models=SimpleNamespace(generate_content_stream=agenerate_content_stream)))
+
+
+def _half_open_gateway():
+    breaker = app.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    gateway = app.ModelGateway(_backend, max_retries=0, pool_size=1, breaker=breaker)
+    return gateway, breaker
+
+
+def test_closing_a_half_open_trial_stream_releases_the_trial():
+    gateway, breaker = _half_open_gateway()
+    stream = gateway.stream_text({})
+    assert next(stream) == "a"
+    assert breaker.state == "half_open" and breaker._trial_in_flight
+    stream.close()
+    assert breaker.state == "half_open" and not breaker._trial_in_flight
+    assert "".join(gateway.stream_text({})) == "abc"
+    assert breaker.state == "closed"
+
+
+def test_cancelling_a_half_open_async_trial_stream_releases_the_trial():
+    gateway, breaker = _half_open_gateway()
+
+    async def scenario():
+        stream = gateway.astream_text({})
+        assert await anext(stream) == "a"
+        await stream.aclose()
+        assert not breaker._trial_in_flight
+        return "".join([text async for text in gateway.astream_text({})])
+
+    assert asyncio.run(scenario()) == "abc"
+    assert breaker.state == "closed"
+
+
+def test_a_second_caller_is_refused_while_the_trial_is_in_flight():
+    gateway, breaker = _half_open_gateway()
+    stream = gateway.stream_text({})
+    next(stream)
+    with pytest.raises(app.CircuitOpenError):
+        next(gateway.stream_text({}))
+    stream.close()
+
+
+def test_model_backend_is_a_registered_name_or_a_module_function():
+    import fake_model
+    assert app._model_backend_factory("gemini") is app._create_gemini_backend
+    assert app._model_backend_factory("fake_model:create_fake_backend") is fake_model.create_fake_backend
+    with pytest.raises(ValueError):
+        app._model_backend_factory("fake")
@@ -0,0 +1,67 @@
+"""
+PDF rendering: the process-wide resources hand out ready page templates and share one hyphenation
+dictionary; wrapped lines fit the page as fpdf measures them, and overflowing words are hyphenated.
+"""
+import pytest
+
+import app
+import reports
+
+TEXT = ("Include fortified plant milks, tofu set with calcium sulfate and dark leafy greens such as kale "
+        "and bok choy to cover your calcium needs without dairy; pair iron-rich legumes with vitamin C.")
+
+
+@pytest.fixture
+def pdf():
+    return reports.RenderResources(reports.PDF_FONT_PATH)._build_template()
+
+
+def unwrap(lines):
+    return "".join(line[:-1] if line.endswith("-") else line + " " for line in lines).strip()
+
+
+@pytest.mark.parametrize("max_width", [40, 75, 150])
+def test_wrapped_lines_fit_and_keep_every_word(pdf, max_width):
+    lines = reports.LineWrapper(pdf).wrap(TEXT.replace("-", " "), max_width)
+
+    assert len(lines) > 1
+    assert all(pdf.get_string_width(line) <= max_width + 1e-6 for line in lines)
+    assert unwrap(lines) == TEXT.replace("-", " ")
+
+
+def test_cached_widths_match_fpdfs_measurement(pdf):
+    wrapper = reports.LineWrapper(pdf)
+    assert wrapper.width(TEXT) == pytest.approx(pdf.get_string_width(TEXT))
+    assert reports.LineWrapper(pdf)._widths is wrapper._widths
+
+
+def test_words_longer_than_a_line_are_broken_at_hyphenation_points(pdf):
+    word = "Supercalifragilisticexpialidocious"
+    lines = reports.LineWrapper(pdf).wrap(f"A {word}", pdf.get_string_width(word) / 3)
+
+    assert len(lines) > 2 and all(line.endswith("-") for line in lines[1:-1])
+    assert unwrap(lines) == f"A {word}"
+
+
+def test_every_render_gets_a_fresh_ready_document():
+    resources = reports.RenderResources(reports.PDF_FONT_PATH, template_pool_size=2)
+    first, second = resources.new_pdf(), resources.new_pdf()
+
+    assert first is not second
+    assert (first.page, first.font_family, second.page, second.font_family) == (1, "dejavuserif", 1, "dejavuserif")
+
+
+def test_the_hyphenation_dictionary_is_loaded_once_per_process():
+    first = reports.RenderResources(reports.PDF_FONT_PATH)
+    second = reports.RenderResources(reports.PDF_FONT_PATH)
+    assert first.hyphenator is second.hyphenator
+
+
+def test_eager_startup_warms_the_resources_up(tmp_path, monkeypatch):
+    monkeypatch.delitem(app.startup_timings, "render_resources", raising=False)
+    flask_app = app.create_app({"UPLOAD_FOLDER": str(tmp_path / "files"), "STARTUP_LOADING": "eager",
+                                "PDF_TEMPLATE_POOL_SIZE": 3})
+    resources = flask_app.extensions["nutri"].resources
+
+    assert resources._templates.qsize() == 3
+    assert "render_resources" in app.startup_timings
@@ -0,0 +1,52 @@
+"""Streamed reports: cards are sent as their sections finish, and the whole report is saved at the end."""
+import json
+import threading
+
+import pytest
+
+import app
+
+PROFILE = {"age": "34", "gender": "Female", "height": "168", "weight": "63", "activity_level": "Lightly Active"}
+
+
+@pytest.fixture
+def model(monkeypatch, services):
+    """A model that sends the first section, then holds the rest until `release` is set."""
+    state = {"release": threading.Event(), "released": None}
+
+    def stream_text(request):
+        yield "**Micronutrients:**\n    Vitamin D | Sources: Eggs\n**Actionable Advice & Recommendations:**\n"
+        state["released"] = state["release"].wait(timeout=10)
+        yield "    - Walk daily\n"
+
+    monkeypatch.setattr(services.model_gateway, "stream_text", stream_text)
+    return state
+
+
+def stream_events(client):
+    response = client.post("/stream_nutrient_recommendations", json=PROFILE, buffered=False)
+    for line in response.response:
+        for event_line in line.decode().splitlines():
+            yield json.loads(event_line)
+
+
+def test_cards_are_sent_before_the_model_finishes(flask_app, model):
+    cards = []
+    for event in stream_events(flask_app.test_client()):
+        if event["type"] == "card":
+            cards.append(event["html"])
+            if "Micronutrients" in event["html"]:
+                model["release"].set()
+    assert model["released"] is True
+    assert "Walk daily" in cards[-1]
+
+
+def test_the_streamed_report_is_saved_for_download(flask_app, services, model):
+    model["release"].set()
+    events = list(stream_events(flask_app.test_client()))
+
+    assert [event["type"] for event in events][-1] == "done" and not events[-1]["fallback"]
+    token = events[-1]["download_token"]
+    text = services.report_store.load_report(token)
+    assert "Walk daily" in text
+    assert "".join(event["html"] for event in events[:-1]) == app.format_recommendations_to_html(text)
@@ -0,0 +1,46 @@
+"""The structured report model: typed nutrient records, a compact JSON form, and one parse per report."""
+import app
+import reports
+
+REPORT_TEXT = """**BMI:** 22.3 (Normal weight)
+**Macronutrients:**
+    - Protein: 50-60 g/day | Sources: Lentils, tofu
+    - Sodium: < 2300 mg | Tip: Cook at home.
+**Micronutrients:**
+    - Histidine (H): 10-14 mg/kg | Sources: Meat, fish
+"""
+
+
+def test_nutrient_lines_are_parsed_into_records():
+    report = reports.parse_report(REPORT_TEXT)
+
+    assert [(section.title, section.value) for section in report.sections] == [
+        ("BMI", "22.3 (Normal weight)"), ("Macronutrients", ""), ("Micronutrients", "")]
+    protein, sodium = report.sections[1].items
+    assert (protein.name, protein.amount, protein.unit, protein.sources) == ("Protein", "50-60", "g/day", ("Lentils", "tofu"))
+    assert (sodium.amount, sodium.unit, sodium.sources, sodium.note) == ("<2300", "mg", (), "Cook at home.")
+
+
+def test_the_json_form_round_trips():
+    report = reports.parse_report(REPORT_TEXT)
+    restored = reports.Report.from_json(report.to_json())
+
+    assert restored.to_dict() == report.to_dict()
+    assert reports.render_report_html(restored) == reports.render_report_html(report)
+
+
+def test_a_report_is_parsed_once(monkeypatch):
+    parses = []
+    monkeypatch.setattr(app, "parse_report", lambda text: parses.append(text) or reports.parse_report(text))
+
+    assert app._report_model_for_text(REPORT_TEXT) is app._report_model_for_text(REPORT_TEXT)
+    assert len(parses) == 1
+
+
+def test_the_reports_api_serves_the_tree_as_json(flask_app):
+    token = app._save_report(REPORT_TEXT)
+    client = flask_app.test_client()
+
+    response = client.get(f"/reports/{token}")
+    assert response.get_json() == reports.parse_report(REPORT_TEXT).to_dict()
+    assert client.get(f"/reports/{token}", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
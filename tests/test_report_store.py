@@ -0,0 +1,71 @@
+"""
+Report storage: tokens are unique and time-sortable, malformed ones never reach storage, backends
+must be complete, and a report removed by the GC mid-download is a 404.
+"""
+import time
+
+import pytest
+
+import app
+
+
+def test_tokens_are_unique_and_sort_by_creation_time():
+    earlier = [app.new_report_token() for _ in range(5000)]
+    time.sleep(0.002)
+    later = app.new_report_token()
+
+    assert len(set(earlier)) == len(earlier)
+    assert all(app.is_valid_report_token(token) for token in earlier + [later])
+    assert max(earlier) < later
+
+
+def test_an_incomplete_backend_fails_when_created():
+    class NoArtifacts(app.ReportStore):
+        def save_report(self, token, text):
+            pass
+
+        def load_report(self, token):
+            return None
+
+    with pytest.raises(TypeError):
+        NoArtifacts(index=None)
+
+
+@pytest.fixture(params=["filesystem", "sqlite"])
+def flask_app(request, tmp_path):
+    return app.create_app({"UPLOAD_FOLDER": str(tmp_path), "PRERENDER_PDF": False, "REPORT_STORE": request.param})
+
+
+@pytest.mark.parametrize("path", ["/download/{}", "/download/{}?format=docx", "/reports/{}"])
+def test_a_report_removed_after_its_lookup_is_not_found(flask_app, services, monkeypatch, path):
+    store = services.report_store
+    token = app._save_report("## Summary\nRest well.")
+    metadata = store.get_metadata(token)
+    monkeypatch.setattr(services, "report_model_cache", app.ResponseCache())
+    store._remove([token])
+    # The GC ran between the index lookup and reading the payloads.
+    monkeypatch.setattr(store, "get_metadata", lambda _token: metadata)
+    response = flask_app.test_client().get(path.format(token))
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("token", ["NutriAI_Report_20240101_120000", "0" * 25, "01ARZ3NDEKTSV4RRFFQ69G5FAu",
+                                   "01ARZ3NDEKTSV4RRFFQ69G5FAI", "01ARZ3NDEKTSV4RRFFQ69G5FAVX"])
+def test_malformed_tokens_are_rejected_before_storage_is_read(flask_app, services, monkeypatch, token):
+    monkeypatch.setattr(services.report_store, "get_metadata", lambda _token: pytest.fail("storage was read"))
+    client = flask_app.test_client()
+    assert client.get(f"/download/{token}").status_code == client.get(f"/reports/{token}").status_code == 404
+
+
+def test_reports_saved_together_keep_their_own_text(services):
+    tokens = [app._save_report(f"## Summary\nReport {number}.") for number in range(20)]
+    assert len(set(tokens)) == len(tokens)
+    assert [services.report_store.load_report(token) for token in tokens] == [
+        f"## Summary\nReport {number}." for number in range(20)]
+
+
+def test_expired_reports_are_not_found(flask_app, services, monkeypatch):
+    token = app._save_report("## Summary\nRest well.")
+    monkeypatch.setattr(services.report_store, "ttl", 0)
+    assert flask_app.test_client().get(f"/reports/{token}").status_code == 404
+    assert services.report_store.load_report(token) is None
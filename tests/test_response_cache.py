@@ -0,0 +1,41 @@
+"""The sqlite tier of ResponseCache: shared entries, indexed expiry and a bounded row count."""
+import sqlite3
+import time
+
+import app
+
+
+def rows(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return [key for key, in conn.execute("SELECT key FROM responses ORDER BY expires_at")]
+
+
+def test_entries_are_shared_through_the_file(tmp_path):
+    db_path = str(tmp_path / "cache.sqlite3")
+    app.ResponseCache(db_path=db_path).set("k", "value")
+    assert app.ResponseCache(db_path=db_path).get("k") == "value"
+
+
+def test_expiry_is_indexed(tmp_path):
+    db_path = str(tmp_path / "cache.sqlite3")
+    app.ResponseCache(db_path=db_path)
+    with sqlite3.connect(db_path) as conn:
+        plan = " ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN DELETE FROM responses WHERE expires_at <= 0"))
+    assert "responses_expires_at" in plan
+
+
+def test_rows_beyond_the_cap_closest_to_expiry_are_dropped(tmp_path):
+    db_path = str(tmp_path / "cache.sqlite3")
+    cache = app.ResponseCache(db_path=db_path, max_disk_entries=3, prune_interval=0)
+    for i in range(5):
+        cache.set(f"k{i}", "value")
+        time.sleep(0.001)
+    assert rows(db_path) == ["k2", "k3", "k4"]
+
+
+def test_pruning_runs_at_most_once_per_interval(tmp_path):
+    db_path = str(tmp_path / "cache.sqlite3")
+    cache = app.ResponseCache(ttl=-1, db_path=db_path, prune_interval=3600)
+    cache.set("first", "value")
+    cache.set("second", "value")
+    assert rows(db_path) == ["second"]
@@ -0,0 +1,133 @@
+"""AsyncSingleFlight: followers share the leader's result, but not the leader's cancellation."""
+import asyncio
+import contextlib
+
+import app
+
+
+def test_follower_takes_over_when_the_leader_is_cancelled_waiting_for_a_slot():
+    async def scenario():
+        flights = app.AsyncSingleFlight("test")
+        slots = asyncio.Semaphore(0)
+        calls = []
+
+        @contextlib.asynccontextmanager
+        async def admit():
+            async with slots:
+                yield
+
+        async def fn():
+            calls.append(1)
+            return "result"
+
+        leader = asyncio.create_task(flights.call("k", fn, admit=admit))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.call("k", fn, admit=admit))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        slots.release()
+        assert await asyncio.wait_for(follower, 1) == "result"
+        assert leader.cancelled() and calls == [1]
+        return flights.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["started"] == 1 and stats["coalesced"] == 1 and stats["in_flight"] == 0
+
+
+def test_streams_replay_every_chunk_to_each_subscriber():
+    async def scenario():
+        flights = app.AsyncSingleFlight("test")
+        completed = []
+
+        async def produce():
+            for chunk in ("a", "b", "c"):
+                await asyncio.sleep(0)
+                yield chunk
+
+        streams = [await flights.stream("k", produce, on_complete=completed.append) for _ in range(3)]
+        results = await asyncio.gather(*(_join(stream) for stream in streams))
+        return results, completed
+
+    async def _join(stream):
+        return "".join([chunk async for chunk in stream])
+
+    results, completed = asyncio.run(scenario())
+    assert results == ["abc"] * 3 and completed == ["abc"]
+
+
+def test_admission_errors_are_shared_with_followers():
+    async def scenario():
+        flights = app.AsyncSingleFlight("test")
+
+        @contextlib.asynccontextmanager
+        async def admit():
+            await asyncio.sleep(0)
+            raise app.QueueFullError("busy")
+            yield
+
+        async def fn():
+            return "result"
+
+        results = await asyncio.gather(*(flights.call("k", fn, admit=admit) for _ in range(2)), return_exceptions=True)
+        return results, flights.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert all(isinstance(r, app.QueueFullError) for r in results)
+    assert stats["started"] == 0
+
+
+def test_requests_rejected_by_a_full_queue_are_not_counted_as_started():
+    async def scenario():
+        flights = app.AsyncSingleFlight("test")
+        limiter = app.GenerationLimiter(max_concurrent=1, max_queued=0)
+        release = asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            return "result"
+
+        leader = asyncio.create_task(flights.call("a", fn, admit=limiter.slot))
+        await asyncio.sleep(0)
+        rejected = await asyncio.gather(*(flights.call(key, fn, admit=limiter.slot) for key in "bcd"), return_exceptions=True)
+        release.set()
+        return await leader, rejected, flights.stats()
+
+    result, rejected, stats = asyncio.run(scenario())
+    assert result == "result" and all(isinstance(r, app.QueueFullError) for r in rejected)
+    assert stats["started"] == 1
+
+
+class _ContestedLease:
+    """A lease that other workers take `contested` more times before this worker gets it."""
+    def __init__(self, contested):
+        self.contested = contested
+        self.holder = None
+
+    def acquire(self, key, owner):
+        if self.contested:
+            self.contested -= 1
+            return False
+        self.holder = owner
+        return True
+
+    def wait(self, key):
+        pass
+
+    def release(self, key, owner):
+        assert owner == self.holder
+        self.holder = None
+
+
+def test_a_worker_generates_only_while_it_holds_the_lease():
+    lease = _ContestedLease(contested=2)
+    flights = app.SingleFlight("test", lease)
+    held = []
+
+    def fn():
+        held.append(lease.holder is not None)
+        return "result"
+
+    assert flights.call("k", fn, lookup=lambda: None) == "result"
+    assert held == [True] and lease.holder is None
+    assert flights.stats()["remote_waits"] == 2